@@ -0,0 +1,67 @@
+"""Atomic replacement of derived files
+
+Derived files (binary indexes, companions, catalogs, sidecars) are written to
+a temporary file in the directory of their final path and renamed over it
+once complete, so readers never see a partial file.  Temporary names are
+unique, so processes (or threads) writing the same file at once each publish
+a complete file, the last rename winning.
+"""
+
+import binascii
+import contextlib
+import errno
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def atomicPath(path):
+    """Context manager for writing a file atomically
+
+    Usage:
+        with atomicPath(path) as tmp, open(tmp, 'wb') as fout:
+            ...
+
+    Args:
+        path: path of file to write
+
+    Yields:
+        unique path of an empty temporary file in the directory of path,
+        which is renamed to path when the with statement completes, or
+        removed if it raises
+
+    Raises:
+        OSError: if the temporary file cannot be created
+    """
+    tmp = _createTemporary(path)
+    try:
+        yield tmp
+        os.rename(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _createTemporary(path):
+    """Create an empty file with a unique name next to path
+
+    Unlike tempfile.mkstemp, the file gets the permissions of any file the
+    process creates (0666 less the umask), which the final file keeps
+
+    Returns:
+        path of temporary file
+    """
+    (dirname, basename) = os.path.split(path)
+    for i in range(0, tempfile.TMP_MAX):
+        tmp = os.path.join(dirname, '%s.%s.tmp' % (
+            basename, binascii.hexlify(os.urandom(4))))
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            continue
+        os.close(fd)
+        return tmp
+    raise OSError(errno.EEXIST, "No unique temporary file name for '%s'." %
+                  path)
@@ -0,0 +1,105 @@
+"""Memory-budgeted LRU cache for blocks of simulation feature data"""
+
+from collections import OrderedDict
+import threading
+
+
+class BlockCache(object):
+    """LRU cache of numpy arrays bounded by total size in bytes
+
+    Blocks are marked read-only when added, since they are shared by all
+    later hits
+
+    Attributes:
+        _maxBytes: maximum total size of cached blocks in bytes
+        _bytes: total size of cached blocks in bytes
+        _blocks: cached blocks, least recently used first
+        _hits: # of lookups that found their block
+        _misses: # of lookups that did not find their block
+        _evictions: # of blocks evicted to stay within _maxBytes
+        _lock: lock serializing access across threads
+    """
+
+    def __init__(self, maxBytes):
+        """Class constructor
+
+        Args:
+            maxBytes: maximum total size of cached blocks in bytes (0 disables
+                      caching)
+        """
+        self._maxBytes = maxBytes
+        self._bytes = 0
+        self._blocks = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+
+    def get(self, key):
+        """Get cached block
+
+        Args:
+            key: block key
+
+        Returns:
+            cached (read-only) numpy array, or None if block is not cached
+        """
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._blocks[key] = block
+            return block
+
+
+    def contains(self, key):
+        """Check whether a block is cached, without counting a hit or miss"""
+        with self._lock:
+            return key in self._blocks
+
+
+    def put(self, key, block):
+        """Add block to cache, evicting least recently used blocks
+
+        Blocks larger than the whole budget are not cached
+
+        Args:
+            key: block key
+            block: numpy array
+        """
+        if block.nbytes > self._maxBytes:
+            return
+        block.flags.writeable = False
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            while self._bytes + block.nbytes > self._maxBytes:
+                self._bytes -= self._blocks.popitem(last=False)[1].nbytes
+                self._evictions += 1
+            self._blocks[key] = block
+            self._bytes += block.nbytes
+
+
+    def clear(self):
+        """Remove all cached blocks (counters are kept)"""
+        with self._lock:
+            self._blocks.clear()
+            self._bytes = 0
+
+
+    def getStats(self):
+        """Get cache counters
+
+        Returns:
+            Dictionary with # of hits, misses, evictions and cached blocks,
+            cached bytes and maximum bytes
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses,
+                    'evictions': self._evictions,
+                    'blocks': len(self._blocks), 'bytes': self._bytes,
+                    'maxBytes': self._maxBytes}
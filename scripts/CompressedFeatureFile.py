@@ -0,0 +1,190 @@
+"""Random-access compressed container for simulation feature files
+
+A compressed feature file (features_pXX_rYYY.blk) holds the same data as a
+raw feature file, but every cycle is compressed independently, so any cycle
+can be read without decompressing the rest of the file.
+
+Layout (all integers are int64):
+    header: magic, codec id, # of cycles, # of zones, # of metrics
+    sorted cycle #s: one per cycle
+    block offsets: one per cycle plus end of last block, from start of file
+    compressed blocks: each a (# of zones X # of metrics) float32 array
+"""
+
+import bz2
+import numpy as np
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = 0x4b4c4246  # 'FBLK'
+HEADER = ['magic', 'codec', 'ncycles', 'nzones', 'nmetrics']
+CODECS = {'zlib': 1, 'bz2': 2, 'zstd': 3}
+
+
+def compressBlock(codec, data):
+    """Compress a block of bytes
+
+    Args:
+        codec: codec name (see CODECS)
+        data: bytes to compress
+
+    Returns:
+        compressed bytes
+    """
+    if codec == 'zlib':
+        return zlib.compress(data)
+    if codec == 'bz2':
+        return bz2.compress(data)
+    if codec == 'zstd':
+        return _zstd().ZstdCompressor().compress(data)
+    raise ValueError("Unknown codec '%s'." % codec)
+
+
+def decompressBlock(codec, data):
+    """Decompress a block of bytes
+
+    Args:
+        codec: codec name (see CODECS)
+        data: compressed bytes
+
+    Returns:
+        decompressed bytes
+    """
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'bz2':
+        return bz2.decompress(data)
+    if codec == 'zstd':
+        return _zstd().ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown codec '%s'." % codec)
+
+
+def _zstd():
+    """Get zstandard module, which is only needed for the zstd codec"""
+    if zstandard is None:
+        raise ImportError("The zstd codec requires the zstandard package.")
+    return zstandard
+
+
+def writeCompressedFeatureFile(path, codec, cycles, nzones, nmetrics, blocks):
+    """Write compressed feature file
+
+    Args:
+        path: path of compressed feature file
+        codec: codec name (see CODECS)
+        cycles: sorted list of simulation cycle #s
+        nzones: # of zones in partition
+        nmetrics: # of metrics
+        blocks: iterable of (# of zones X # of metrics) float32 arrays, one
+                per cycle in the order of cycles
+    """
+    header = [MAGIC, CODECS[codec], len(cycles), nzones, nmetrics]
+    offsets = np.zeros(len(cycles) + 1, dtype=np.int64)
+    with open(path, 'wb') as fout:
+        np.asarray(header, dtype=np.int64).tofile(fout)
+        np.asarray(cycles, dtype=np.int64).tofile(fout)
+        tableStart = fout.tell()
+        offsets.tofile(fout)
+
+        offsets[0] = fout.tell()
+        for (i, block) in enumerate(blocks):
+            data = np.ascontiguousarray(block, dtype=np.float32).tostring()
+            fout.write(compressBlock(codec, data))
+            offsets[i+1] = fout.tell()
+
+        fout.seek(tableStart)
+        offsets.tofile(fout)
+
+
+class CompressedFeatureFile(object):
+    """Random-access reader for a compressed feature file
+
+    Attributes:
+        _path: path of compressed feature file
+        _openFile: function that returns an open file handle for a path
+        _cache: cache of decompressed blocks
+        codec: codec name
+        cycles: 1D numpy int64 array of sorted cycle #s
+        nzones: # of zones in partition
+        nmetrics: # of metrics
+        _offsets: 1D numpy int64 array of block offsets
+    """
+
+    def __init__(self, path, openFile, cache):
+        """Class constructor, reads header and block offset table
+
+        Args:
+            path: path of compressed feature file
+            openFile: function that returns an open file handle for a path
+            cache: BlockCache for decompressed blocks
+        """
+        self._path = path
+        self._openFile = openFile
+        self._cache = cache
+
+        fin = openFile(path)
+        fin.seek(0)
+        header = np.fromfile(fin, dtype=np.int64, count=len(HEADER))
+        header = dict(zip(HEADER, map(int, header)))
+        if header['magic'] != MAGIC:
+            raise IOError("Invalid compressed feature file '%s'." % path)
+
+        self.codec = dict((v, k) for (k, v) in CODECS.items())[header['codec']]
+        self.nzones = header['nzones']
+        self.nmetrics = header['nmetrics']
+        self.cycles = np.fromfile(fin, dtype=np.int64, count=header['ncycles'])
+        self._offsets = np.fromfile(fin, dtype=np.int64,
+                                    count=header['ncycles'] + 1)
+
+
+    def position(self, cycles):
+        """Get positions of one or more cycle #s in sorted cycle order
+
+        Raises:
+            KeyError: if any cycle is not in the file
+        """
+        pos = np.minimum(np.searchsorted(self.cycles, cycles),
+                         len(self.cycles) - 1)
+        found = self.cycles[pos] == cycles
+        if not np.all(found):
+            raise KeyError(np.asarray(cycles)[~found] if np.ndim(cycles)
+                           else cycles)
+        return pos
+
+
+    def readCycle(self, cycle):
+        """Read (decompressed) data of one cycle
+
+        Args:
+            cycle: simulation cycle # (time step)
+
+        Returns:
+            read-only 2D numpy array of shape (# of zones X # of metrics)
+        """
+        return self.readBlock(int(self.position(cycle)))
+
+
+    def readBlock(self, pos):
+        """Read (decompressed) data of the cycle at a position
+
+        Args:
+            pos: position of cycle in sorted cycle order
+
+        Returns:
+            read-only 2D numpy array of shape (# of zones X # of metrics)
+        """
+        key = (self._path, int(pos))
+        block = self._cache.get(key)
+        if block is None:
+            fin = self._openFile(self._path)
+            fin.seek(self._offsets[pos])
+            data = fin.read(self._offsets[pos+1] - self._offsets[pos])
+            block = np.frombuffer(decompressBlock(self.codec, data),
+                                  dtype=np.float32)
+            block = np.reshape(block, (self.nzones, self.nmetrics))
+            self._cache.put(key, block)
+        return block
@@ -0,0 +1,181 @@
+"""Catalog of a simulation data directory
+
+The catalog (catalog.json in the data directory) records everything scripts
+otherwise rediscover by scanning the file system: partitions, runs, cycles
+per run, file sizes, zone id ranges, metric names, failure summaries and the
+piston/density parameters encoded in the data directory path.  It is built by
+a single scan the first time it is requested and loaded from the JSON file
+afterwards, until a run index file is added, removed or modified (e.g. runs
+or cycles are added); rebuild it (buildCatalog or running this script) after
+adding failures to the data directory.
+"""
+
+from AtomicFile import atomicPath
+from FailureCatalog import FailureCatalog
+import glob
+import json
+import numpy as np
+import os
+import sys
+
+CATALOG_FILE = 'catalog.json'
+CATALOG_VERSION = 2
+
+
+def loadCatalog(dataDir, rebuild=False):
+    """Load catalog of a data directory, building it if necessary
+
+    Args:
+        dataDir: data directory
+        rebuild: rebuild catalog even if it is up to date
+
+    Returns:
+        Dictionary with catalog content (see buildCatalog)
+    """
+    path = "%s/%s" % (dataDir, CATALOG_FILE)
+    if not rebuild and os.path.isfile(path):
+        with open(path, 'r') as fin:
+            catalog = json.load(fin)
+        if (catalog.get('version') == CATALOG_VERSION and
+                catalog['indexes'] == _getIndexTimes(dataDir)):
+            return catalog
+    return buildCatalog(dataDir)
+
+
+def buildCatalog(dataDir):
+    """Scan data directory and write its catalog
+
+    The catalog is written to catalog.json in the data directory; failure to
+    write it (e.g. read-only data directory) is not an error
+
+    Args:
+        dataDir: data directory
+
+    Returns:
+        Dictionary with catalog content:
+            version: catalog format version
+            indexes: dictionary with file names of run index files as keys
+                     and their modification times as values, which the
+                     catalog is checked against when loaded
+            numParts: # of partitions in mesh
+            runs: sorted list of simulation run #s
+            metrics: metric names in order of feature vectors
+            partitions: list with # of zones and minimum/maximum zone id of
+                        each partition
+            cycles: list with # of cycles and first/last cycle # of each run
+            files: dictionary with file names of feature files as keys and
+                   file sizes in bytes as values
+            failures: # of failures, plus # of failures and first failed
+                      cycle # of each run with failures
+            piston: piston parameter parsed from data directory path (or None)
+            density: density parameter parsed from data directory path (or
+                     None)
+    """
+    # imported here because FeatureDataReader loads catalogs itself
+    from FeatureDataReader import FeatureDataReader
+
+    indexes = _getIndexTimes(dataDir)
+    numParts = len(glob.glob("%s/features/metadata_p*.txt" % dataDir))
+    reader = FeatureDataReader(dataDir, numParts)
+    runs = _scanRuns(dataDir)
+
+    partitions = []
+    for part in range(0, numParts):
+        ids = reader.getPartitionZoneIds(part)
+        partitions.append({'part': part, 'nzones': len(ids),
+                           'minZone': int(ids.min()) if len(ids) else None,
+                           'maxZone': int(ids.max()) if len(ids) else None})
+
+    cycles = []
+    for run in runs:
+        index = reader._readFileIndex(run, 0)
+        cycles.append({'run': run, 'ncycles': len(index['cycles']),
+                       'first': int(index['cycles'][0]),
+                       'last': int(index['cycles'][-1])})
+
+    files = {}
+    for path in glob.glob("%s/features/features_p*_r*" % dataDir):
+        files[os.path.basename(path)] = os.path.getsize(path)
+
+    (piston, density) = parseRunParameters(dataDir)
+    catalog = {'version': CATALOG_VERSION, 'indexes': indexes,
+               'numParts': numParts, 'runs': runs,
+               'metrics': reader.getMetricNames(),
+               'partitions': partitions, 'cycles': cycles, 'files': files,
+               'failures': _summarizeFailures(dataDir),
+               'piston': piston, 'density': density}
+
+    path = "%s/%s" % (dataDir, CATALOG_FILE)
+    try:
+        with atomicPath(path) as tmp, open(tmp, 'w') as fout:
+            json.dump(catalog, fout, indent=1, sort_keys=True)
+    except (IOError, OSError):
+        pass
+    return catalog
+
+
+def parseRunParameters(dataDir):
+    """Parse piston and density parameters from a data directory path
+
+    Paths of parameter studies contain e.g. 'piston100' and 'density1.50'
+
+    Args:
+        dataDir: data directory
+
+    Returns:
+        Pair (piston parameter, density parameter), None where not in path
+    """
+    piston = density = None
+    if "piston" in dataDir:
+        offset = dataDir.find("piston") + len("piston")
+        piston = int(dataDir[offset:offset+3])
+    if "density" in dataDir:
+        offset = dataDir.find("density") + len("density")
+        density = float(dataDir[offset:offset+4])
+    return (piston, density)
+
+
+def _scanRuns(dataDir):
+    """Get sorted list of simulation run #s with an index file"""
+    files = glob.glob("%s/indexes/indexes_p00_r*.txt" % dataDir)
+    return sorted([int(f[-7:-4]) for f in files])
+
+
+def _getIndexTimes(dataDir):
+    """Get modification times of the run index files of a data directory
+
+    Returns:
+        Dictionary with file names as keys and modification times as values
+    """
+    return dict([(os.path.basename(path), os.path.getmtime(path))
+                 for path in glob.glob("%s/indexes/indexes_p*_r*.txt" %
+                                       dataDir)])
+
+
+def _summarizeFailures(dataDir):
+    """Summarize failures of a data directory (see FailureCatalog)
+
+    Args:
+        dataDir: data directory
+
+    Returns:
+        Dictionary with total # of failures and a list with # of failures and
+        first failed cycle # of each run with failures
+    """
+    catalog = FailureCatalog(dataDir)
+    (runs, counts) = np.unique(catalog.failures['run'], return_counts=True)
+    summary = [{'run': int(run), 'count': int(count),
+                'firstCycle': int(first['cycle'])}
+               for (run, count, first) in zip(runs, counts,
+                                              catalog.firstPerRun())]
+    return {'count': len(catalog), 'runs': summary}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print 'Usage: DatasetCatalog.py dataDir'
+        sys.exit(1)
+
+    catalog = buildCatalog(sys.argv[1])
+    print "%d partitions, %d runs, %d failures" % (catalog['numParts'],
+        len(catalog['runs']), catalog['failures']['count'])
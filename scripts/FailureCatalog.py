@@ -0,0 +1,180 @@
+"""Binary catalog of the zone failures of a simulation data directory
+
+Failure files (failures/side_pXX and failures/corner_pXX) contain a 'Run,...'
+header followed by run, cycle and zone of each failure, and possibly a
+'volume,...' section that is ignored.  They are parsed once into
+    dataDir/failures/failures.npy
+a structured array of FAILURE_DTYPE records in the order of the failure files
+(by partition, side before corner, then by line), which is memory-mapped on
+later opens and rebuilt whenever a failure file is newer than it.
+"""
+
+from AtomicFile import atomicPath
+import glob
+import numpy as np
+import os
+import re
+import sys
+
+CATALOG_FILE = 'failures.npy'
+
+KINDS = ('side', 'corner')
+
+FAILURE_DTYPE = np.dtype([('part', np.int32), ('run', np.int32),
+                          ('cycle', np.int64), ('zone', np.int64),
+                          ('kind', np.int8)])
+
+
+class FailureCatalog(object):
+    """Failures of a data directory with vectorized queries
+
+    Queries return structured arrays of FAILURE_DTYPE records in catalog
+    order (unless noted otherwise)
+
+    Attributes:
+        failures: structured numpy array of all failures
+    """
+
+    def __init__(self, dataDir, rebuild=False):
+        """Class constructor, loads (or builds) the catalog
+
+        Args:
+            dataDir: data directory
+            rebuild: rebuild catalog even if it is up to date
+        """
+        path = "%s/failures/%s" % (dataDir, CATALOG_FILE)
+        sources = _getFailureFiles(dataDir)
+        if (rebuild or not os.path.isfile(path) or
+                any([os.path.getmtime(source) > os.path.getmtime(path)
+                     for (part, kind, source) in sources])):
+            self.failures = buildFailureCatalog(dataDir)
+        else:
+            self.failures = np.load(path, mmap_mode='r')
+
+
+    def __len__(self):
+        return len(self.failures)
+
+
+    def forRuns(self, runs):
+        """Get failures of one or more runs
+
+        Args:
+            runs: simulation run # or list of run #s
+        """
+        return self.failures[np.in1d(self.failures['run'], runs)]
+
+
+    def inCycleWindow(self, first, last, runs=None):
+        """Get failures within an inclusive window of cycles
+
+        Args:
+            first: first simulation cycle # of window
+            last: last simulation cycle # of window
+            runs: simulation run # or list of run #s (default is all runs)
+        """
+        cycles = self.failures['cycle']
+        mask = (cycles >= first) & (cycles <= last)
+        if runs is not None:
+            mask &= np.in1d(self.failures['run'], runs)
+        return self.failures[mask]
+
+
+    def firstPerRun(self):
+        """Get first failure (lowest cycle #) of every run with failures
+
+        Returns:
+            structured array with one record per run, sorted by run #; ties
+            are broken by catalog order
+        """
+        if len(self.failures) == 0:
+            return self.failures[:0]
+        order = np.lexsort((np.arange(len(self.failures)),
+                            self.failures['cycle'], self.failures['run']))
+        runs = self.failures['run'][order]
+        first = np.flatnonzero(np.concatenate(([True], runs[1:] != runs[:-1])))
+        return self.failures[order[first]]
+
+
+    def perZone(self, runs=None):
+        """Count failures of every zone that failed
+
+        Args:
+            runs: simulation run # or list of run #s (default is all runs)
+
+        Returns:
+            Pair (zones, counts) of 1D numpy int64 arrays, sorted by zone id
+        """
+        failures = self.failures if runs is None else self.forRuns(runs)
+        return np.unique(failures['zone'], return_counts=True)
+
+
+def buildFailureCatalog(dataDir):
+    """Parse the failure files of a data directory and write the catalog
+
+    Failure to write the catalog (e.g. read-only data directory) is not an
+    error; the parsed failures are still returned
+
+    Args:
+        dataDir: data directory
+
+    Returns:
+        structured numpy array of FAILURE_DTYPE records
+    """
+    blocks = []
+    for (part, kind, source) in _getFailureFiles(dataDir):
+        rows = []
+        with open(source, 'r') as fin:
+            state = 0
+            for line in fin:
+                vals = line.split(",")
+                if vals[0] == "Run":
+                    state = 1
+                elif vals[0] == "volume":
+                    state = 2
+                elif state == 1:
+                    rows.append(vals[:3])
+        block = np.zeros(len(rows), dtype=FAILURE_DTYPE)
+        if rows:
+            values = np.asarray(rows, dtype=np.int64)
+            (block['run'], block['cycle'], block['zone']) = values.T
+        (block['part'], block['kind']) = (part, KINDS.index(kind))
+        blocks.append(block)
+    failures = (np.concatenate(blocks) if blocks
+                else np.zeros(0, dtype=FAILURE_DTYPE))
+
+    path = "%s/failures/%s" % (dataDir, CATALOG_FILE)
+    try:
+        with atomicPath(path) as tmp, open(tmp, 'wb') as fout:
+            np.save(fout, failures)
+    except (IOError, OSError):
+        pass
+    return failures
+
+
+def _getFailureFiles(dataDir):
+    """Get failure files of a data directory
+
+    Returns:
+        list of (partition #, kind, path) tuples, sorted by partition and kind
+        (in order of KINDS)
+    """
+    files = []
+    for path in glob.glob("%s/failures/*_p*" % dataDir):
+        match = re.match(r'(side|corner)_p(\d+)$', os.path.basename(path))
+        if match:
+            files.append((int(match.group(2)), KINDS.index(match.group(1)),
+                          path))
+    return [(part, KINDS[kind], path) for (part, kind, path) in sorted(files)]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print 'Usage: FailureCatalog.py dataDir'
+        sys.exit(1)
+
+    catalog = FailureCatalog(sys.argv[1], rebuild=True)
+    print "%d failures" % len(catalog)
+    for failure in catalog.firstPerRun():
+        print "run %d: first failure at cycle %d (zone %d)" % (
+            failure['run'], failure['cycle'], failure['zone'])
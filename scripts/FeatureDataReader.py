@@ -1,5 +1,66 @@
+from collections import OrderedDict
+from AtomicFile import atomicPath
+from BlockCache import BlockCache
+from DatasetCatalog import loadCatalog
+from multiprocessing.pool import ThreadPool
 import numpy as np
+import os
+import Queue
+from ReadPlan import ReadPlan
+from StorageBackend import BACKEND_VARIABLE, getBackendClass, splitDataUri
 import sys
+import threading
+
+class _FileHandlePool(object):
+    """Bounded pool of open read-only file handles with LRU eviction
+    
+    Handles are reopened after a fork, because a child process shares the 
+    file offsets of the handles it inherits with its parent
+    
+    Attributes:
+        _maxOpen: maximum # of open file handles
+        _handles: open file handles keyed by path, least recently used first
+        _pid: id of process that opened the handles
+    """
+
+    def __init__(self, maxOpen):
+        """Class constructor
+        
+        Args:
+            maxOpen: maximum # of open file handles
+        """
+        self._maxOpen = max(1, maxOpen)
+        self._handles = OrderedDict()
+        self._pid = os.getpid()
+
+
+    def get(self, path):
+        """Get open file handle for path, opening it if necessary
+        
+        Args:
+            path: path of file
+            
+        Returns:
+            file object opened for binary reading
+        """
+        if self._pid != os.getpid():
+            self.close()
+            self._pid = os.getpid()
+
+        fin = self._handles.pop(path, None)
+        if fin is None:
+            fin = open(path, 'rb')
+            while len(self._handles) >= self._maxOpen:
+                self._handles.popitem(last=False)[1].close()
+        self._handles[path] = fin
+        return fin
+
+
+    def close(self):
+        """Close all open file handles"""
+        while self._handles:
+            self._handles.popitem()[1].close()
+
 
 class FeatureDataReader(object):
     """Reader for simulation data related to machine learning features
@@ -7,118 +68,566 @@ class FeatureDataReader(object):
     Attributes:
         _dataDir: data directory
         _numParts: # of partitions in mesh
-        _zoneOffsets: a map that takes zone id and returns partition and
-                      offset within
+        _zoneDirectory: parallel arrays of zone ids (sorted), partitions and 
+                        offsets within partition, used to map zone id to 
+                        partition and offset
         _indexCache: cache content of index file, which contains starting 
-                     position (for seek) of each cycle
+                     position (for seek) of each cycle, as sorted arrays, 
+                     plus the # of bytes of the text index parsed so far 
+                     (see refresh)
         _metaData: cache content of meta data file, which contains metrics 
                    names and zone ids
+        _useMmap: if True, feature files are memory-mapped and reads return 
+                  views into the mapping instead of fresh copies
+        _filePools: pools of open file handles used by the read methods, one 
+                    per thread so that threads never share file offsets
+        _maxOpenFiles: maximum # of open file handles per thread
+        _numThreads: # of threads used to read partitions concurrently
+        _threadPool: pool of worker threads (created on first use)
+        _catalog: catalog of data directory (loaded on first use)
+        _cacheBytes: memory budget of block cache in bytes
+        _blockCache: LRU cache of partition slabs of raw feature files, keyed 
+                     by (run, partition, cycle position), and of decompressed 
+                     cycles of compressed feature files
+        _backends: storage backends created by the reader, keyed by name
+        _backend: storage backend all reads are dispatched through
+        _gapBytes: maximum # of unrequested bytes between two records that 
+                   planned reads still merge into one read
     """
 
-    def __init__(self, dataDir, numParts):
+    def __init__(self, dataDir, numParts=None, useMmap=False, maxOpenFiles=64, 
+                 cacheBytes=64*1024*1024, numThreads=1, backend=None, 
+                 gapBytes=0):
         """Class constructor
         
         Args:
-            dataDir: data directory
-            numParts: # of partitions in mesh
+            dataDir: data directory, optionally as a URI naming the storage 
+                     backend (e.g. 'tiled:///path/to/data')
+            numParts: # of partitions in mesh (default is taken from the 
+                      catalog of the data directory)
+            useMmap: memory-map feature files rather than seek and read
+            maxOpenFiles: maximum # of file handles kept open between reads
+            cacheBytes: memory budget in bytes for caching partition slabs 
+                        and decompressed cycles (0 disables caching)
+            numThreads: # of threads used to read partitions concurrently 
+                        (1 reads partitions serially)
+            backend: name of storage backend (see StorageBackend; default is 
+                     the backend named by the data directory URI, else by the 
+                     FEATURE_DATA_BACKEND environment variable, else 'auto')
+            gapBytes: maximum # of unrequested bytes between two zone records 
+                      that readZones (and planReads) still merge into one 
+                      read (0 merges adjacent records only)
         """
+        (scheme, dataDir) = splitDataUri(dataDir)
         self._dataDir = dataDir
+        self._catalog = None
+        if numParts is None:
+            numParts = self.getCatalog()['numParts']
         self._numParts = numParts
+        self._useMmap = useMmap
         
-        self._zoneOffsets = {}
+        self._zoneDirectory = None
         self._indexCache = {}
         self._metaData = {}
+        self._maxOpenFiles = maxOpenFiles
+        self._filePools = []
+        self._localPool = threading.local()
+        self._poolLock = threading.Lock()
+        self._numThreads = numThreads
+        self._threadPool = None
+        self._cacheBytes = cacheBytes
+        self._blockCache = BlockCache(cacheBytes)
+        self._gapBytes = gapBytes
+        self._backends = {}
+        self._backend = self.getBackend(backend or scheme or 
+                                        os.environ.get(BACKEND_VARIABLE, 'auto'))
         
 
-    def readZone(self, run, cycle, zone):
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+    def close(self):
+        """Close all file handles and worker threads kept open by the reader
+        
+        The reader can still be used afterwards; files are reopened on demand
+        """
+        if self._threadPool is not None:
+            self._threadPool.close()
+            self._threadPool.join()
+            self._threadPool = None
+        with self._poolLock:
+            for pool in self._filePools:
+                pool.close()
+
+
+    def readZone(self, run, cycle, zone, metrics=None, out=None):
         """Read data from a single mesh zone from a simulation cycle of a run
         
         Args:
             run: simulation run #
             cycle: simulation cycle # (time step)
             zone: mesh zone id
+            metrics: list of metric names or indexes to read (default is all 
+                     metrics, in order of getMetricNames)
+            out: C-contiguous float32 array of the shape of the result to 
+                 read into (default is a new array)
         
         Returns:
             1D numpy array of size (# of metrics)
         """
-        zid = self._getZoneOffset(zone)
-        index = self._readFileIndex(run, zid['part'])
-        meta = self._readMetaData(zid['part'])
-        
-        fname = 'features_p%02d_r%03d.npy' % (zid['part'], run)
-        nmetrics = len(meta['metrics'])
-        offset = zid['offset'] * nmetrics * 4
+        mindex = self._getMetricIndexes(metrics)
+        (part, zoneOffset) = self.lookupZones(zone)
+        pos = int(self._findCycles(run, part, cycle))
+        if out is None:
+            return self._backend.readSlab(run, part, pos, pos+1, zoneOffset, 
+                                          zoneOffset+1, mindex)[0, 0]
+        self._checkOut(out, (self._countMetrics(mindex),))
+        self._backend.readSlab(run, part, pos, pos+1, zoneOffset, zoneOffset+1, 
+                               mindex, out[np.newaxis, np.newaxis])
+        return out
 
-        with open("%s/features/%s" % (self._dataDir,fname), 'rb') as fin:
-            fin.seek(index[cycle] + offset)
-            return np.fromfile(fin, dtype=np.float32, count=nmetrics)
 
-
-    def readPartition(self, run, part, cycle):
+    def readPartition(self, run, part, cycle, metrics=None, out=None):
         """Read data from entire mesh partition from a simulation cycle of a run
         
+        Partitions read from raw feature files are kept in the block cache, 
+        where they also serve later readZone and readZones calls
+        
         Args:
             run: simulation run #
             part: mesh partition #
             cycle: simulation cycle # (time step)
+            metrics: list of metric names or indexes to read (default is all 
+                     metrics, in order of getMetricNames)
+            out: C-contiguous float32 array of the shape of the result to 
+                 read into (default is a new array)
             
         Returns:
             2D numpy array of shape (# of zones in partition X # of metrics)
         """
-        index = self._readFileIndex(run, part)
-        meta = self._readMetaData(part)
-
-        fname = 'features_p%02d_r%03d.npy' % (part, run)
-        nmetrics = len(meta['metrics'])
-        nzones = len(meta['zones'])
-        
-        with open("%s/features/%s" % (self._dataDir,fname), 'rb') as fin:
-            fin.seek(index[cycle])
-            data = np.fromfile(fin, dtype=np.float32, count=nzones*nmetrics)
-            return np.reshape(data, (nzones,nmetrics))
+        mindex = self._getMetricIndexes(metrics)
+        pos = int(self._findCycles(run, part, cycle))
+        nzones = len(self._readMetaData(part)['zones'])
+        if out is None:
+            return self._backend.readSlab(run, part, pos, pos+1, 0, nzones, 
+                                          mindex)[0]
+        self._checkOut(out, (nzones, self._countMetrics(mindex)))
+        self._backend.readSlab(run, part, pos, pos+1, 0, nzones, mindex, 
+                               out[np.newaxis])
+        return out
 
 
-    def readAllCyclesForZone(self, run, zone):
+    def readAllCyclesForZone(self, run, zone, metrics=None, out=None):
         """Read data from all simulation cycles in a run of a single mesh zone
         
+        If a zone-major companion file exists for the run and partition (see 
+        FeatureDataWriter.writeZoneMajor), the zone trajectory is read from it 
+        with a single contiguous read
+        
         Args:
             run: simulation run #
             zone: mesh zone id
+            metrics: list of metric names or indexes to read (default is all 
+                     metrics, in order of getMetricNames)
+            out: C-contiguous float32 array of the shape of the result to 
+                 read into (default is a new array)
             
         Returns:
             2D numpy array of shape (# of cycles X # of metrics)
         """
-        zid = self._getZoneOffset(zone)
-        index = self._readFileIndex(run, zid['part'])
-        meta = self._readMetaData(zid['part'])
+        mindex = self._getMetricIndexes(metrics)
+        (part, zoneOffset) = self.lookupZones(zone)
+        ncycles = len(self._backend.metadata(run, part)['cycles'])
+        if out is None:
+            return self._backend.readSlab(run, part, 0, ncycles, zoneOffset, 
+                                          zoneOffset+1, mindex)[:, 0]
+        self._checkOut(out, (ncycles, self._countMetrics(mindex)))
+        self._backend.readSlab(run, part, 0, ncycles, zoneOffset, zoneOffset+1, 
+                               mindex, out[:, np.newaxis])
+        return out
+
+
+    def readZoneAcrossRuns(self, zone, runs=None, metrics=None, out=None):
+        """Read data from all simulation cycles of a single mesh zone in many runs
         
-        fname = 'features_p%02d_r%03d.npy' % (zid['part'], run)
-        nmetrics = len(meta['metrics'])
-        offset = zid['offset'] * nmetrics * 4
+        Runs are read concurrently if the reader was created with 
+        numThreads > 1
+        Runs have different # of cycles, so the result is padded to the 
+        longest run and the padding is masked
+        
+        Args:
+            zone: mesh zone id
+            runs: list of simulation run #s (default is all runs in data 
+                  directory)
+            metrics: list of metric names or indexes to read (default is all 
+                     metrics, in order of getMetricNames)
+            out: C-contiguous float32 array of shape (# of runs X maximum # 
+                 of cycles X # of metrics) to read into, which becomes the 
+                 data of the masked array (default is a new array)
+            
+        Returns:
+            3D numpy masked array of shape (# of runs X maximum # of cycles X 
+            # of metrics), where [i, j] holds the data of the j-th cycle (in 
+            sorted order) of runs[i]
+        """
+        mindex = self._getMetricIndexes(metrics)
+        if runs is None:
+            runs = self.getRuns()
+        (part, zoneOffset) = self.lookupZones(zone)
+        ncycles = np.array([len(self._backend.metadata(run, part)['cycles']) 
+                            for run in runs], dtype=np.int64)
+        nmetrics = self._countMetrics(mindex)
+
+        shape = (len(runs), ncycles.max() if len(runs) else 0, nmetrics)
+        if out is None:
+            data = np.empty(shape, dtype=np.float32)
+        else:
+            self._checkOut(out, shape)
+            data = out
+        for i in range(0, len(runs)):
+            data[i, ncycles[i]:] = np.nan
+        def readRun(i):
+            self.readAllCyclesForZone(runs[i], zone, mindex, 
+                                      out=data[i, :ncycles[i]])
+        if self._numThreads > 1:
+            self._getThreadPool().map(readRun, range(0, len(runs)))
+        else:
+            for i in range(0, len(runs)):
+                readRun(i)
 
-        with open("%s/features/%s" % (self._dataDir,fname), 'rb') as fin:
-            data = []
-            for cycle in sorted(index.keys()):
-                fin.seek(index[cycle] + offset)
-                single = np.fromfile(fin, dtype=np.float32, count=nmetrics)
-                data.append(np.reshape(single, (1,nmetrics)))
-            return np.concatenate(data)
+        mask = np.arange(data.shape[1])[None,:] >= ncycles[:,None]
+        mask = np.repeat(mask[:,:,None], nmetrics, axis=2)
+        return np.ma.masked_array(data, mask=mask)
 
 
-    def readAllZonesInCycle(self, run, cycle):
+    def readAllZonesInCycle(self, run, cycle, metrics=None, out=None):
         """Read data from all mesh zones from a simulation cycle of a run
         
+        Partitions are read straight into slices of a single output array, 
+        concurrently if the reader was created with numThreads > 1
+        
         Args:
             run: simulation run #
             cycle: simulation cycle # (time step)
+            metrics: list of metric names or indexes to read (default is all 
+                     metrics, in order of getMetricNames)
+            out: C-contiguous float32 array of the shape of the result to 
+                 read into (default is a new array)
 
         Returns:
             2D numpy array of shape (# of zones in mesh X # of metrics)
         """
-        data = []
-        for part in range(0, self._numParts):
-            data.append(self.readPartition(run, part, cycle))
-        return np.concatenate(data)
+        mindex = self._getMetricIndexes(metrics)
+        if out is None:
+            out = self._allocateCycle(mindex)
+        else:
+            self._checkOut(out, self._allocateCycle(mindex, shapeOnly=True))
+        self._readAllZonesInCycleInto(run, cycle, mindex, out)
+        return out
+
+
+    def iterCycles(self, run, start=0, stop=None, step=1, metrics=None, 
+                   prefetch=4):
+        """Iterate over full-mesh data of a range of cycles of a run
+        
+        A background thread reads up to prefetch cycles ahead of the consumer 
+        into a fixed ring of buffers, so reading overlaps with analysis and 
+        memory use is constant; cycles read are not added to the block cache
+        The yielded array is a buffer that is reused: it is only valid until 
+        the next iteration, so copy it to keep it
+        Only cycles the run has are read; cycle #s need not be consecutive
+        
+        Args:
+            run: simulation run #
+            start: first simulation cycle #
+            stop: simulation cycle # to stop before (default is one past the 
+                  last cycle of the run)
+            step: read every step-th cycle of the run within [start, stop)
+            metrics: list of metric names or indexes to read (default is all 
+                     metrics, in order of getMetricNames)
+            prefetch: # of cycles read ahead of the consumer
+            
+        Yields:
+            Pair (cycle #, 2D numpy array of shape (# of zones in mesh X 
+            # of metrics))
+        """
+        mindex = self._getMetricIndexes(metrics)
+        cycles = self._backend.metadata(run, 0)['cycles']
+        selected = cycles >= start
+        if stop is not None:
+            selected &= cycles < stop
+        cycles = cycles[selected][::step]
+
+        buffers = [self._allocateCycle(mindex) for i in range(0, prefetch + 1)]
+        free = Queue.Queue()
+        for i in range(0, len(buffers)):
+            free.put(i)
+        ready = Queue.Queue()
+        stopping = threading.Event()
+
+        def produce():
+            try:
+                for cycle in cycles:
+                    i = free.get()
+                    if stopping.is_set():
+                        return
+                    self._readAllZonesInCycleInto(run, cycle, mindex, 
+                                                  buffers[i], cache=False)
+                    ready.put((int(cycle), i))
+                ready.put(None)
+            except Exception:
+                ready.put(sys.exc_info())
+            finally:
+                self._releaseFilePool()
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                if len(item) == 3:
+                    raise item[0], item[1], item[2]
+                (cycle, i) = item
+                yield (cycle, buffers[i])
+                free.put(i)
+        finally:
+            stopping.set()
+            free.put(None)
+            producer.join()
+
+
+    def _allocateCycle(self, mindex, shapeOnly=False):
+        """Allocate array for full-mesh data of a single cycle
+        
+        Args:
+            mindex: list of metric indexes, or None for all metrics
+            shapeOnly: return the shape of the array instead
+            
+        Returns:
+            uninitialized 2D numpy float32 array of shape 
+            (# of zones in mesh X # of metrics)
+        """
+        nzones = sum([len(self._readMetaData(part)['zones']) 
+                      for part in range(0, self._numParts)])
+        shape = (nzones, self._countMetrics(mindex))
+        if shapeOnly:
+            return shape
+        return np.empty(shape, dtype=np.float32)
+
+
+    def _countMetrics(self, mindex):
+        """Get # of metrics read for a list of metric indexes (None is all)"""
+        return len(self.getMetricNames() if mindex is None else mindex)
+
+
+    def _checkOut(self, out, shape):
+        """Check a caller-provided output array
+        
+        Args:
+            out: numpy array
+            shape: shape of the result
+            
+        Raises:
+            ValueError: if out is not a float32 array of the shape of the result
+        """
+        if out.dtype != np.float32 or out.shape != tuple(shape):
+            raise ValueError("Output array must be float32 of shape %s, not "
+                             "%s of shape %s." % (tuple(shape), out.dtype, 
+                                                  out.shape))
+
+
+    def _readAllZonesInCycleInto(self, run, cycle, mindex, out, cache=True):
+        """Read data from all mesh zones of a cycle into an existing array
+        
+        Args:
+            run: simulation run #
+            cycle: simulation cycle # (time step)
+            mindex: list of metric indexes, or None for all metrics
+            out: C-contiguous float32 array of shape 
+                 (# of zones in mesh X # of metrics)
+            cache: keep partitions read in the block cache
+        """
+        sizes = [len(self._readMetaData(part)['zones']) 
+                 for part in range(0, self._numParts)]
+        bounds = np.cumsum([0] + sizes)
+
+        def readPart(part):
+            self._readPartitionInto(run, part, cycle, mindex, 
+                                    out[bounds[part]:bounds[part+1]], cache)
+        if self._numThreads > 1:
+            self._getThreadPool().map(readPart, range(0, self._numParts))
+        else:
+            for part in range(0, self._numParts):
+                readPart(part)
+
+
+    def readZones(self, run, cycles, zones, metrics=None, out=None):
+        """Read data from many (cycle, zone) pairs of a run at once
+
+        Reads are planned with planReads, so the # of reads is the # of 
+        distinct byte ranges rather than the # of requests
+
+        Args:
+            run: simulation run #
+            cycles: 1D array-like of simulation cycle #s
+            zones: 1D array-like of mesh zone ids, same size as cycles
+            metrics: list of metric names or indexes to read (default is all
+                     metrics, in order of getMetricNames)
+            out: float32 array of shape (# of requests X # of metrics) to 
+                 read into (default is a new array)
+
+        Returns:
+            2D numpy array of shape (# of requests X # of metrics), where row
+            i holds the data of zones[i] in cycles[i]
+        """
+        mindex = self._getMetricIndexes(metrics)
+        if out is not None:
+            self._checkOut(out, (len(cycles), self._countMetrics(mindex)))
+        return self.planReads(run, cycles, zones, mindex).execute(out)
+
+
+    def planReads(self, runs, cycles, zones, metrics=None, gapBytes=None):
+        """Plan coalesced reads of many (run, cycle, zone) requests
+
+        Requests are grouped by file and sorted by byte offset, and records 
+        closer than gapBytes are merged into a single read; the plan reads 
+        nothing until it is executed
+
+        Args:
+            runs: simulation run # or 1D array-like of run #s, same size as 
+                  cycles
+            cycles: 1D array-like of simulation cycle #s
+            zones: 1D array-like of mesh zone ids, same size as cycles
+            metrics: list of metric names or indexes to read (default is all
+                     metrics, in order of getMetricNames)
+            gapBytes: maximum # of unrequested bytes between two records that 
+                      are still read as one range (default is the gapBytes 
+                      of the reader)
+
+        Returns:
+            ReadPlan, whose execute method returns a 2D numpy array of shape 
+            (# of requests X # of metrics) in request order, and whose 
+            getStats method reports planned vs. raw bytes
+        """
+        if gapBytes is None:
+            gapBytes = self._gapBytes
+        return ReadPlan(self, runs, cycles, zones, 
+                        self._getMetricIndexes(metrics), gapBytes)
+
+
+    def _readPartitionInto(self, run, part, cycle, mindex, out, cache=True):
+        """Read data from entire mesh partition into an existing array
+        
+        Raw feature files are read with readinto directly into out; other 
+        storage is copied
+        
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            cycle: simulation cycle # (time step)
+            mindex: list of metric indexes, or None for all metrics
+            out: C-contiguous float32 array of shape 
+                 (# of zones in partition X # of metrics)
+            cache: keep the partition in the block cache
+        """
+        pos = int(self._findCycles(run, part, cycle))
+        self._backend.readSlab(run, part, pos, pos+1, 0, len(out), mindex, 
+                               out[np.newaxis], cache)
+
+
+    def _getThreadPool(self):
+        """Get pool of worker threads, creating it on first use"""
+        with self._poolLock:
+            if self._threadPool is None:
+                self._threadPool = ThreadPool(self._numThreads)
+            return self._threadPool
+
+
+    def getCacheStats(self):
+        """Get block cache counters
+        
+        Returns:
+            Dictionary with # of hits, misses, evictions and cached blocks, 
+            cached bytes and memory budget in bytes
+        """
+        return self._blockCache.getStats()
+
+
+    def lookupCycles(self, run, part, cycles):
+        """Look up seek positions of one or more cycles in a feature file
+        
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            cycles: simulation cycle # or 1D array-like of cycle #s
+            
+        Returns:
+            seek position (for a single cycle) or 1D numpy int64 array of 
+            seek positions (for an array of cycles)
+            
+        Raises:
+            KeyError: if any cycle is not in the file index
+        """
+        index = self._readFileIndex(run, part)
+        return index['offsets'][self._searchCycles(index['cycles'], cycles)]
+
+
+    def lookupZones(self, zones):
+        """Look up mesh partition # and offset within partition of zone ids
+        
+        Args:
+            zones: mesh zone id or 1D array-like of zone ids
+            
+        Returns:
+            Pair (partition #, offset) for a single zone, or pair of 1D numpy 
+            int32 arrays (partition #s, offsets) for an array of zones
+            
+        Raises:
+            KeyError: if any zone id is not in the mesh
+        """
+        zdir = self._readZoneDirectory()
+        pos = np.searchsorted(zdir['ids'], zones)
+        pos = np.minimum(pos, len(zdir['ids']) - 1)
+        found = zdir['ids'][pos] == zones
+        if not np.all(found):
+            raise KeyError(np.asarray(zones)[~found] if np.ndim(zones) 
+                           else zones)
+        if np.ndim(zones):
+            return (zdir['parts'][pos], zdir['offsets'][pos])
+        return (int(zdir['parts'][pos]), int(zdir['offsets'][pos]))
+
+
+    def getMetricIndexes(self, metrics):
+        """Get indexes of feature metrics within feature vectors
+        
+        Args:
+            metrics: list of metric names or indexes
+            
+        Returns:
+            list of metric indexes
+            
+        Raises:
+            KeyError: if any metric name is unknown
+            IndexError: if any metric index is out of range
+        """
+        names = self._readMetaData(0)['metrics']
+        mindex = []
+        for metric in metrics:
+            if isinstance(metric, basestring):
+                mindex.append(names[metric])
+            elif metric < 0 or metric >= len(names):
+                raise IndexError("Metric index %d out of range." % metric)
+            else:
+                mindex.append(int(metric))
+        return mindex
 
 
     def getPartitionZoneIds(self, part):
@@ -149,6 +658,26 @@ class FeatureDataReader(object):
         return np.concatenate(data)
 
 
+    def getCatalog(self):
+        """Get catalog of data directory, building it on first use
+        
+        Returns:
+            Dictionary with catalog content (see DatasetCatalog.buildCatalog)
+        """
+        if self._catalog is None:
+            self._catalog = loadCatalog(self._dataDir)
+        return self._catalog
+
+
+    def getRuns(self):
+        """Get simulation run #s available in data directory
+        
+        Returns:
+            sorted list of simulation run #s
+        """
+        return list(self.getCatalog()['runs'])
+
+
     def getMetricNames(self):
         """Get names (or labels) of feature metrics
         
@@ -162,33 +691,294 @@ class FeatureDataReader(object):
         return [name for name in sorted(metrics, key=metrics.get)]
 
 
+    def getBackend(self, name=None):
+        """Get storage backend, creating it on first use
+        
+        Args:
+            name: backend name (default is the backend all reads are 
+                  dispatched through)
+            
+        Returns:
+            StorageBackend
+        """
+        if name is None:
+            return self._backend
+        if name not in self._backends:
+            self._backends[name] = getBackendClass(name)(self)
+        return self._backends[name]
+
+
+    def _findCycles(self, run, part, cycles):
+        """Find positions of one or more cycles in sorted cycle order
+        
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            cycles: simulation cycle # or 1D array-like of cycle #s
+            
+        Returns:
+            position or 1D numpy array of positions in the storage backend
+            
+        Raises:
+            KeyError: if any cycle is not in the storage backend
+        """
+        return self._searchCycles(self._backend.metadata(run, part)['cycles'], 
+                                  cycles)
+
+
+    def _searchCycles(self, sortedCycles, cycles):
+        """Find positions of one or more cycles in an array of sorted cycles
+        
+        Args:
+            sortedCycles: sorted 1D numpy array of cycle #s
+            cycles: simulation cycle # or 1D array-like of cycle #s
+            
+        Returns:
+            position or 1D numpy array of positions in sortedCycles
+            
+        Raises:
+            KeyError: if any cycle is not in sortedCycles
+        """
+        pos = np.searchsorted(sortedCycles, cycles)
+        pos = np.minimum(pos, len(sortedCycles) - 1)
+        found = sortedCycles[pos] == cycles
+        if not np.all(found):
+            raise KeyError(np.asarray(cycles)[~found] if np.ndim(cycles) 
+                           else cycles)
+        return pos
+
+
+    def _getMetricIndexes(self, metrics):
+        """Get metric indexes for the metrics argument of the read methods
+        
+        Args:
+            metrics: list of metric names or indexes, or None for all metrics
+            
+        Returns:
+            list of metric indexes, or None for all metrics
+        """
+        if metrics is None:
+            return None
+        return self.getMetricIndexes(metrics)
+
+
     def _readFileIndex(self, run, part):
-        """Read file index and cache content into dictionary for mesh partition
+        """Read file index and cache content for mesh partition
         
         File index contains the seek position for the start of each cycle
         This speeds up the process for reading data from each cycle
-        For each mesh partition, a separate dictionary is constructed that can 
-        be indexed by the partition file name
-        Essentially, this is a dictionary of dictionaries
+        The text index (indexes_pXX_rYYY.txt) is converted once into a binary 
+        index (indexes_pXX_rYYY.npy), a (# of cycles X 2) int64 array of cycle 
+        # and seek position sorted by cycle #, which is memory-mapped on 
+        subsequent opens
+        The binary index is updated whenever it is older than the text index, 
+        parsing only the lines appended to the text index since
         
         Args:
             run: simulation run #
             part: mesh partition #
 
         Returns:
-            Dictionary with keys as cycle # and values as seek position
+            Dictionary with two 1D numpy int64 arrays: sorted cycle #s and 
+            their seek positions
         """
         fname = 'indexes_p%02d_r%03d.txt' % (part, run)
         if fname not in self._indexCache:
-            with open("%s/indexes/%s" % (self._dataDir,fname), 'r') as fin:
-                index = {}
-                for line in fin:
-                    key,val = line.split(' -> ')
-                    index[int(key)] = int(val)
-                self._indexCache[fname] = index
+            path = "%s/indexes/%s" % (self._dataDir,fname)
+            binPath = path[:-4] + '.npy'
+            textBytes = None
+            if os.path.isfile(binPath):
+                table = np.load(binPath, mmap_mode='r')
+                if os.path.getmtime(binPath) < os.path.getmtime(path):
+                    (table, textBytes) = self._convertFileIndex(path, binPath, 
+                                                                table)
+            else:
+                (table, textBytes) = self._convertFileIndex(path, binPath)
+            self._indexCache[fname] = {'cycles': table[:,0], 
+                                       'offsets': table[:,1], 
+                                       'run': run, 'part': part, 
+                                       'table': table, 'textBytes': textBytes}
         return self._indexCache[fname]
 
 
+    def _convertFileIndex(self, path, binPath, table=None, textBytes=None):
+        """Parse text file index and write it as binary file index
+        
+        Given the table of an earlier binary index, only the lines appended 
+        to the text index since are parsed
+        A line is complete once its newline is written; a partially written 
+        last line (of a run that is still writing cycles) is left for the 
+        next update
+        Failure to write the binary index (e.g. read-only data directory) is 
+        not an error; the parsed index is still returned
+        
+        Args:
+            path: path of text file index
+            binPath: path of binary file index
+            table: table of earlier binary index (default is to parse the 
+                   whole text index)
+            textBytes: # of bytes of text index parsed into table (default is 
+                       computed from table)
+            
+        Returns:
+            Pair (table, textBytes) of 2D numpy int64 array of shape 
+            (# of cycles X 2) sorted by cycle # and # of bytes of text index 
+            parsed into it
+        """
+        start = 0
+        if table is not None:
+            if textBytes is None:
+                textBytes = self._countFileIndexBytes(path, table)
+            if textBytes is None:
+                table = None
+            else:
+                start = textBytes
+        with open(path, 'r') as fin:
+            fin.seek(start)
+            text = fin.read()
+        text = text[:text.rfind('\n') + 1]
+        values = text.replace(' -> ', ' ').split()
+        new = np.reshape(np.asarray(values, dtype=np.int64), (-1, 2))
+        if table is None:
+            table = new[np.argsort(new[:,0], kind='mergesort')]
+        elif len(new):
+            table = self._mergeFileIndex(table, new)
+        textBytes = start + len(text)
+        try:
+            with atomicPath(binPath) as tmp, open(tmp, 'wb') as fout:
+                np.save(fout, table)
+        except (IOError, OSError):
+            pass
+        return (table, textBytes)
+
+
+    def _mergeFileIndex(self, table, new):
+        """Merge newly parsed entries into a file index table
+        
+        Args:
+            table: 2D numpy int64 array of shape (# of cycles X 2) sorted by 
+                   cycle #
+            new: 2D numpy int64 array of shape (# of new cycles X 2)
+            
+        Returns:
+            2D numpy int64 array of all entries sorted by cycle #
+        """
+        new = new[np.argsort(new[:,0], kind='mergesort')]
+        table = np.concatenate((table, new))
+        if len(table) > len(new) and new[0,0] <= table[-len(new)-1,0]:
+            table = table[np.argsort(table[:,0], kind='mergesort')]
+        return table
+
+
+    def _countFileIndexBytes(self, path, table):
+        """Compute # of bytes of a text file index parsed into a table
+        
+        Text indexes are written as 'cycle -> offset' lines, so their size 
+        follows from the # of digits of the entries without reading them
+        
+        Args:
+            path: path of text file index
+            table: 2D numpy int64 array of shape (# of cycles X 2)
+            
+        Returns:
+            # of bytes, or None if the text index does not have the expected 
+            size (e.g. it is not written in the canonical format)
+        """
+        digits = np.ones(table.shape, dtype=np.int64)
+        for power in range(1, 19):
+            digits += (table >= 10**power)
+        textBytes = int(digits.sum()) + 5 * len(table)
+        if textBytes == 0:
+            return 0
+        if textBytes > os.path.getsize(path):
+            return None
+        with open(path, 'r') as fin:
+            fin.seek(textBytes - 1)
+            if fin.read(1) != '\n':
+                return None
+        return textBytes
+
+
+    def refresh(self):
+        """Pick up cycles appended to runs since their file index was read
+        
+        Only file indexes the reader has read are checked; the lines appended 
+        to each of them are parsed and merged into the cached index (and 
+        binary file index), so the cost is proportional to the new data
+        Storage backends drop their cached handles of changed partitions, so 
+        feature files are reopened with their new size on the next read
+        Cached blocks stay valid if the new cycles follow all earlier cycles; 
+        otherwise the block cache is cleared
+        
+        Returns:
+            Dictionary with (run, partition) pairs as keys and # of new cycles 
+            as values, for partitions with new cycles
+        """
+        changed = {}
+        for (fname, index) in self._indexCache.items():
+            path = "%s/indexes/%s" % (self._dataDir, fname)
+            if index['textBytes'] is None:
+                index['textBytes'] = self._countFileIndexBytes(path, 
+                                                               index['table'])
+            if (index['textBytes'] is not None and 
+                    os.path.getsize(path) <= index['textBytes']):
+                continue
+
+            (cycles, run, part) = (index['cycles'], index['run'], index['part'])
+            (table, textBytes) = self._convertFileIndex(
+                path, path[:-4] + '.npy', index['table'], index['textBytes'])
+            index.update({'cycles': table[:,0], 'offsets': table[:,1], 
+                          'table': table, 'textBytes': textBytes})
+            count = len(table) - len(cycles)
+            if count == 0:
+                continue
+
+            appended = (len(cycles) == 0 or 
+                        (table[len(cycles)-1,0] == cycles[-1] and 
+                         table[len(cycles),0] > cycles[-1]))
+            if not appended:
+                self._blockCache.clear()
+            for backend in self._backends.values():
+                backend.forget(run, part)
+            changed[(run, part)] = count
+        return changed
+
+
+    def _openFile(self, path):
+        """Get open file handle for binary reading from the file handle pool
+        
+        Each thread has its own pool, so concurrent reads never interleave 
+        seeks on a shared handle
+        
+        Args:
+            path: path of file
+            
+        Returns:
+            file object opened for binary reading
+        """
+        pool = getattr(self._localPool, 'pool', None)
+        if pool is None:
+            pool = _FileHandlePool(self._maxOpenFiles)
+            self._localPool.pool = pool
+            with self._poolLock:
+                self._filePools.append(pool)
+        return pool.get(path)
+
+
+    def _releaseFilePool(self):
+        """Close and drop the file handle pool of the calling thread
+        
+        Threads that end (e.g. the producer of iterCycles) call this, since 
+        their pools are never used again
+        """
+        pool = getattr(self._localPool, 'pool', None)
+        if pool is not None:
+            del self._localPool.pool
+            with self._poolLock:
+                self._filePools.remove(pool)
+            pool.close()
+
+
     def _readMetaData(self, part):
         """Read meta data and cache content into dictinary for mesh partition
         
@@ -226,27 +1016,44 @@ class FeatureDataReader(object):
         return self._metaData[fname]
 
 
-    def _getZoneOffset(self, zone):
-        """Get mesh partition # and offset within partition for a single zone
+    def _readZoneDirectory(self):
+        """Read zone directory and cache content for all mesh partitions
         
-        Construct a dictionary using zone ids as keys and partition plus offset 
-        as values
-        This requires first reading (and caching) the meta data files for all 
-        mesh partitions
+        The zone directory maps each zone id to its mesh partition and offset 
+        within the partition, as three parallel int32 arrays sorted by zone id
+        Building it requires reading the meta data files for all mesh 
+        partitions, so it is persisted as features/zones.npy, a (# of zones in 
+        mesh X 3) int32 array of zone id, partition and offset, which is 
+        rebuilt whenever it is older than any meta data file
         
-        Args:
-            zone: mesh zone id
-            
         Returns:
-            Dictionary with keys as zone ids and values as partition and offset
+            Dictionary with three 1D numpy int32 arrays: zone ids (sorted), 
+            partitions and offsets within partition
         """
-        if not self._zoneOffsets:
-            for part in range(0, self._numParts):
-                meta = self._readMetaData(part)
-                for key in meta['zones'].keys():
-                    self._zoneOffsets[key] = {'part': part, 
-                                              'offset': meta['zones'][key]}
-        return self._zoneOffsets[zone]
+        if self._zoneDirectory is None:
+            path = "%s/features/zones.npy" % self._dataDir
+            metaPaths = ["%s/features/metadata_p%02d.txt" % (self._dataDir, part)
+                         for part in range(0, self._numParts)]
+            if (os.path.isfile(path) and os.path.getmtime(path) >= 
+                    max(map(os.path.getmtime, metaPaths))):
+                table = np.load(path)
+            else:
+                table = []
+                for part in range(0, self._numParts):
+                    ids = self.getPartitionZoneIds(part)
+                    table.append(np.column_stack((ids, 
+                        np.full(len(ids), part, dtype=np.int32), 
+                        np.arange(len(ids), dtype=np.int32))))
+                table = np.concatenate(table)
+                table = table[np.argsort(table[:,0], kind='mergesort')]
+                try:
+                    with atomicPath(path) as tmp, open(tmp, 'wb') as fout:
+                        np.save(fout, table)
+                except (IOError, OSError):
+                    pass
+            self._zoneDirectory = {'ids': table[:,0], 'parts': table[:,1], 
+                                   'offsets': table[:,2]}
+        return self._zoneDirectory
 
 
 if __name__ == '__main__':
@@ -0,0 +1,251 @@
+"""Writers for derived (companion) files of simulation feature data
+
+The raw feature files written by the simulation are laid out cycle-major:
+each cycle is a (# of zones X # of metrics) block.  The functions in this
+module derive alternative layouts from them, which FeatureDataReader picks up
+automatically when present.
+"""
+
+from AtomicFile import atomicPath
+import bz2
+from CompressedFeatureFile import writeCompressedFeatureFile
+import numpy as np
+import os
+import sys
+from FeatureDataReader import FeatureDataReader
+
+# upper bound on memory used for a single block while transposing
+BLOCK_BYTES = 256 * 1024 * 1024
+
+
+def writeZoneMajor(dataDir, numParts, run, part):
+    """Write zone-major companion of a feature file for run and partition
+
+    The companion features/zonemajor_pXX_rYYY.npy stores the full trajectory
+    of each zone contiguously, i.e. a (# of zones X # of cycles X # of
+    metrics) float32 array with cycles in sorted order, so
+    FeatureDataReader.readAllCyclesForZone becomes a single contiguous read
+    Zones are transposed in blocks bounded by BLOCK_BYTES (cycles stored out
+    of order are reordered block by block), and the companion is written to
+    a temporary file first so readers never see a partial file
+
+    Args:
+        dataDir: data directory
+        numParts: # of partitions in mesh
+        run: simulation run #
+        part: mesh partition #
+
+    Returns:
+        path of companion file
+    """
+    reader = FeatureDataReader(dataDir, numParts, useMmap=True)
+    fmap = reader.getBackend('mmap').open(run, part)
+    rows = np.arange(len(fmap['data']))[fmap['order']]
+    (ncycles, nzones, nmetrics) = (len(rows),) + fmap['data'].shape[1:]
+
+    path = "%s/features/zonemajor_p%02d_r%03d.npy" % (dataDir, part, run)
+    step = max(1, BLOCK_BYTES // (ncycles * nmetrics * 4))
+    with atomicPath(path) as tmp, open(tmp, 'wb') as fout:
+        for first in range(0, nzones, step):
+            block = fmap['data'][rows, first:first+step].transpose(1, 0, 2)
+            np.ascontiguousarray(block).tofile(fout)
+    return path
+
+
+def writeAllZoneMajor(dataDir, numParts, runs=None):
+    """Write zone-major companions for all partitions of a set of runs
+
+    Args:
+        dataDir: data directory
+        numParts: # of partitions in mesh
+        runs: list of simulation run #s (default is all runs in data directory)
+
+    Returns:
+        list of paths of companion files
+    """
+    if runs is None:
+        runs = FeatureDataReader(dataDir, numParts).getRuns()
+    paths = []
+    for run in runs:
+        for part in range(0, numParts):
+            paths.append(writeZoneMajor(dataDir, numParts, run, part))
+    return paths
+
+
+def writeMetricColumns(dataDir, numParts, run, part, metrics=None):
+    """Write metric-columnar files of a feature file for run and partition
+
+    Each metric is written to features/metric_pXX_rYYY_mMM.npy, a (# of 
+    cycles X # of zones) float32 array with cycles in sorted order, so 
+    FeatureDataReader reads only the selected metrics when called with 
+    metrics=[...]
+
+    Args:
+        dataDir: data directory
+        numParts: # of partitions in mesh
+        run: simulation run #
+        part: mesh partition #
+        metrics: list of metric names or indexes (default is all metrics)
+
+    Returns:
+        list of paths of metric-columnar files
+    """
+    reader = FeatureDataReader(dataDir, numParts, useMmap=True)
+    if metrics is None:
+        metrics = reader.getMetricNames()
+    fmap = reader.getBackend('mmap').open(run, part)
+    rows = np.arange(len(fmap['data']))[fmap['order']]
+    (ncycles, nzones, nmetrics) = (len(rows),) + fmap['data'].shape[1:]
+
+    paths = []
+    step = max(1, BLOCK_BYTES // (nzones * nmetrics * 4))
+    for metric in reader.getMetricIndexes(metrics):
+        path = "%s/features/metric_p%02d_r%03d_m%02d.npy" % (dataDir, part, 
+                                                            run, metric)
+        with atomicPath(path) as tmp, open(tmp, 'wb') as fout:
+            for first in range(0, ncycles, step):
+                block = fmap['data'][rows[first:first+step], :, metric]
+                np.ascontiguousarray(block).tofile(fout)
+        paths.append(path)
+    return paths
+
+
+def refreshCompanions(dataDir, numParts, run, part):
+    """Bring existing companion files of run and partition up to date
+
+    Used while a run is still writing cycles: the cycles appended to the 
+    feature file since a metric-columnar file was written are appended to it 
+    (the cycles it already holds are not read again), so its cost is 
+    proportional to the new data; readers map only the cycles of their file 
+    index, so they never see a cycle that is still being appended
+    A zone-major companion cannot be extended in place, since every zone's 
+    trajectory grows, so an out-of-date one is rewritten as a whole
+    Files whose content no longer matches the first cycles of the feature 
+    file (checked on their last cycle) are rewritten as well
+
+    Args:
+        dataDir: data directory
+        numParts: # of partitions in mesh
+        run: simulation run #
+        part: mesh partition #
+
+    Returns:
+        list of paths of extended or rewritten companion files
+    """
+    reader = FeatureDataReader(dataDir, numParts, useMmap=True)
+    fmap = reader.getBackend('mmap').open(run, part)
+    if fmap is None:
+        return []
+    rows = np.arange(len(fmap['data']))[fmap['order']]
+    (ncycles, nzones, nmetrics) = (len(rows),) + fmap['data'].shape[1:]
+
+    paths = []
+    path = "%s/features/zonemajor_p%02d_r%03d.npy" % (dataDir, part, run)
+    if (os.path.isfile(path) and 
+            os.path.getsize(path) != ncycles * nzones * nmetrics * 4):
+        paths.append(writeZoneMajor(dataDir, numParts, run, part))
+
+    cycleBytes = nzones * 4
+    step = max(1, BLOCK_BYTES // (nzones * nmetrics * 4))
+    for metric in range(0, nmetrics):
+        path = "%s/features/metric_p%02d_r%03d_m%02d.npy" % (dataDir, part, 
+                                                            run, metric)
+        if not os.path.isfile(path):
+            continue
+        (count, extra) = divmod(os.path.getsize(path), cycleBytes)
+        if count == ncycles and extra == 0:
+            continue
+        if count > ncycles or extra or (count and not np.array_equal(
+                np.memmap(path, dtype=np.float32, mode='r', 
+                          offset=(count - 1) * cycleBytes, shape=(nzones,)), 
+                fmap['data'][rows[count-1], :, metric])):
+            paths += writeMetricColumns(dataDir, numParts, run, part, [metric])
+            continue
+        with open(path, 'ab') as fout:
+            for first in range(count, ncycles, step):
+                block = fmap['data'][rows[first:first+step], :, metric]
+                np.ascontiguousarray(block).tofile(fout)
+        paths.append(path)
+    return paths
+
+
+def writeCompressed(dataDir, numParts, run, part, codec='bz2'):
+    """Write compressed feature file for run and partition
+
+    The compressed file features/features_pXX_rYYY.blk compresses every cycle
+    independently (see CompressedFeatureFile), so FeatureDataReader can read
+    it directly with random access once the raw feature file is removed
+    The source is the bz2 archive features_pXX_rYYY.npy.bz2 if present, 
+    otherwise the raw feature file; the archive is decompressed as a stream, 
+    so it never needs to be unpacked to disk
+
+    Args:
+        dataDir: data directory
+        numParts: # of partitions in mesh
+        run: simulation run #
+        part: mesh partition #
+        codec: compression codec ('zlib', 'bz2' or 'zstd')
+
+    Returns:
+        path of compressed feature file
+    """
+    reader = FeatureDataReader(dataDir, numParts)
+    index = reader._readFileIndex(run, part)
+    nzones = len(reader.getPartitionZoneIds(part))
+    nmetrics = len(reader.getMetricNames())
+    cycleBytes = nzones * nmetrics * 4
+    if np.any(np.diff(index['offsets']) < cycleBytes):
+        raise ValueError("Cycles of run %d partition %d are not stored in "
+                         "cycle order." % (run, part))
+
+    base = "%s/features/features_p%02d_r%03d" % (dataDir, part, run)
+    if os.path.isfile(base + '.npy.bz2'):
+        src = bz2.BZ2File(base + '.npy.bz2', 'rb')
+    else:
+        src = open(base + '.npy', 'rb')
+
+    def readCycles():
+        position = 0
+        for offset in index['offsets']:
+            while position < offset:
+                skipped = len(src.read(min(offset - position, cycleBytes)))
+                if skipped == 0:
+                    raise IOError("Unexpected end of file in '%s'." % src.name)
+                position += skipped
+            data = src.read(cycleBytes)
+            if len(data) != cycleBytes:
+                raise IOError("Unexpected end of file in '%s'." % src.name)
+            position += cycleBytes
+            yield np.reshape(np.frombuffer(data, dtype=np.float32), 
+                             (nzones, nmetrics))
+
+    try:
+        with atomicPath(base + '.blk') as tmp:
+            writeCompressedFeatureFile(tmp, codec, index['cycles'], nzones, 
+                                       nmetrics, readCycles())
+    finally:
+        src.close()
+    return base + '.blk'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] not in ('zonemajor', 'columns', 
+                                                'compress'):
+        print 'Usage: FeatureDataWriter.py zonemajor|columns|compress dataDir numParts [run ...]'
+        sys.exit(1)
+
+    (command, dataDir, numParts) = (sys.argv[1], sys.argv[2], int(sys.argv[3]))
+    runs = [int(run) for run in sys.argv[4:]] or None
+    if command == 'zonemajor':
+        for path in writeAllZoneMajor(dataDir, numParts, runs):
+            print path
+    else:
+        if runs is None:
+            runs = FeatureDataReader(dataDir, numParts).getRuns()
+        for run in runs:
+            for part in range(0, numParts):
+                if command == 'columns':
+                    for path in writeMetricColumns(dataDir, numParts, run, part):
+                        print path
+                else:
+                    print writeCompressed(dataDir, numParts, run, part)
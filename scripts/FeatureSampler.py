@@ -0,0 +1,183 @@
+"""Random sampling of (run, cycle, zone) instances of simulation feature data
+
+Instances are drawn without materializing the population: a sample of N
+instances costs O(N) draws plus a single planned read (see
+FeatureDataReader.planReads), which reads the sampled records in file offset
+order and merges nearby ones, so the cost scales with N rather than with the
+size of the data directory.
+"""
+
+import numpy as np
+import sys
+from FeatureDataReader import FeatureDataReader
+
+STRATA = ('run', 'part', 'band')
+
+
+def sampleInstances(reader, n, runs=None, cycles=None, stratify=(),
+                    numBands=4, metrics=None, seed=None):
+    """Draw a random sample of (run, cycle, zone) instances and read them
+
+    Without stratification, instances are drawn uniformly without
+    replacement from all zones of all selected cycles of all runs
+    With stratification, the population is split into strata by any
+    combination of run, mesh partition and cycle band (numBands ranges of
+    equally many cycles of each run), and every stratum gets an equal share
+    of the sample; strata smaller than their share are taken in full, and
+    the rest of their share goes to the other strata
+    If the population has fewer than n instances, all of them are returned
+
+    Args:
+        reader: FeatureDataReader
+        n: # of instances to draw
+        runs: list of simulation run #s (default is all runs in data
+              directory)
+        cycles: 1D array-like of simulation cycle #s to draw from (default is
+                all cycles of each run)
+        stratify: names of strata dimensions (see STRATA)
+        numBands: # of cycle bands per run, used when stratifying by 'band'
+        metrics: list of metric names or indexes to read (default is all
+                 metrics, in order of getMetricNames)
+        seed: seed of random number generator (default is unseeded)
+
+    Returns:
+        Pair (data, index) where data is a 2D numpy array of shape
+        (# of instances X # of metrics) and index is a 2D numpy int64 array
+        of shape (# of instances X 3) whose row i holds run, cycle # and zone
+        id of data[i]; instances are sorted by run, cycle and zone id
+    """
+    for name in stratify:
+        if name not in STRATA:
+            raise ValueError("Unknown stratum '%s'." % name)
+    rng = np.random.RandomState(seed)
+    if runs is None:
+        runs = reader.getRuns()
+
+    cells = _getCells(reader, runs, cycles, stratify, numBands)
+    sizes = np.array([len(cell['positions']) * len(cell['zones'])
+                      for cell in cells], dtype=np.int64)
+    keys = [tuple([cell[name] for name in stratify]) for cell in cells]
+    strata = sorted(set(keys))
+    stratumOf = np.array([strata.index(key) for key in keys], dtype=np.int64)
+    stratumSizes = np.bincount(stratumOf, weights=sizes,
+                               minlength=len(strata)).astype(np.int64)
+    counts = _allocateSample(rng, n, stratumSizes)
+
+    index = []
+    for stratum in range(0, len(strata)):
+        members = np.flatnonzero(stratumOf == stratum)
+        bounds = np.cumsum(np.concatenate(([0], sizes[members])))
+        flat = _drawWithoutReplacement(rng, stratumSizes[stratum],
+                                       counts[stratum])
+        owner = np.searchsorted(bounds, flat, side='right') - 1
+        for (i, member) in enumerate(members):
+            cell = cells[member]
+            offsets = flat[owner == i] - bounds[i]
+            (rows, columns) = np.divmod(offsets, len(cell['zones']))
+            index.append(np.column_stack((
+                np.full(len(offsets), cell['run'], dtype=np.int64),
+                cell['cycles'][cell['positions'][rows]],
+                cell['zones'][columns])))
+
+    index = np.concatenate(index) if index else np.zeros((0, 3), np.int64)
+    index = index[np.lexsort((index[:,2], index[:,1], index[:,0]))]
+
+    data = reader.planReads(index[:,0], index[:,1], index[:,2],
+                            metrics).execute()
+    return (data, index)
+
+
+def _getCells(reader, runs, cycles, stratify, numBands):
+    """Split the sampling population into cells of the finest stratification
+
+    Args:
+        reader: FeatureDataReader
+        runs: list of simulation run #s
+        cycles: 1D array-like of simulation cycle #s, or None for all cycles
+        stratify: names of strata dimensions
+        numBands: # of cycle bands per run
+
+    Returns:
+        list of dictionaries with run, partition (None unless stratifying by
+        partition), band (0 unless stratifying by band), sorted cycle #s of
+        the run, positions of the cell's cycles within them, and zone ids
+    """
+    parts = [None]
+    zones = [reader.getCycleZoneIds().astype(np.int64)]
+    if 'part' in stratify:
+        parts = range(0, reader._numParts)
+        zones = [reader.getPartitionZoneIds(part).astype(np.int64)
+                 for part in parts]
+
+    cells = []
+    for run in runs:
+        runCycles = reader.getBackend().metadata(run, 0)['cycles']
+        positions = np.arange(len(runCycles))
+        if cycles is not None:
+            positions = positions[np.in1d(runCycles, cycles)]
+        bands = [positions]
+        if 'band' in stratify:
+            bands = np.array_split(positions, numBands)
+        for (band, bandPositions) in enumerate(bands):
+            for (part, partZones) in zip(parts, zones):
+                cells.append({'run': run, 'part': part, 'band': band,
+                              'cycles': runCycles, 'positions': bandPositions,
+                              'zones': partZones})
+    return cells
+
+
+def _allocateSample(rng, n, sizes):
+    """Split a sample size into equal shares of strata, capped at their sizes
+
+    Args:
+        rng: numpy RandomState
+        n: total sample size
+        sizes: 1D numpy int64 array of strata sizes
+
+    Returns:
+        1D numpy int64 array of # of instances to draw from each stratum
+    """
+    counts = np.zeros(len(sizes), dtype=np.int64)
+    remaining = n
+    while remaining > 0:
+        avail = np.flatnonzero(counts < sizes)
+        if len(avail) == 0:
+            break
+        share = np.full(len(avail), remaining // len(avail), dtype=np.int64)
+        share[rng.permutation(len(avail))[:remaining % len(avail)]] += 1
+        share = np.minimum(share, sizes[avail] - counts[avail])
+        counts[avail] += share
+        remaining -= share.sum()
+    return counts
+
+
+def _drawWithoutReplacement(rng, total, k):
+    """Draw k distinct integers from range(total) in O(k) time and memory
+
+    Args:
+        rng: numpy RandomState
+        total: size of range
+        k: # of integers to draw (at most total)
+
+    Returns:
+        sorted 1D numpy int64 array of k distinct integers
+    """
+    if 2 * k > total:
+        return np.sort(rng.permutation(total)[:k]).astype(np.int64)
+    chosen = np.zeros(0, dtype=np.int64)
+    while len(chosen) < k:
+        extra = rng.randint(0, total, size=k-len(chosen), dtype=np.int64)
+        chosen = np.unique(np.concatenate((chosen, extra)))
+    return chosen
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print 'Usage: FeatureSampler.py dataDir n [stratum ...]'
+        sys.exit(1)
+
+    reader = FeatureDataReader(sys.argv[1])
+    (data, index) = sampleInstances(reader, int(sys.argv[2]),
+                                    stratify=sys.argv[3:])
+    print data.shape
+    print index[:10]
@@ -0,0 +1,231 @@
+"""Per-cycle mesh-wide statistics of simulation runs
+
+For every (run, cycle, metric), the statistics sidecar holds the mean,
+(population) standard deviation, minimum, maximum and percentiles of the
+metric over all zones of the mesh, and the zone that deviates most from the
+mean together with its deviation.  The sidecar of a run is built from slabs
+of many cycles of every partition, reduced across the mesh with vectorized
+numpy operations, and stored as
+    dataDir/stats/meshstats_rYYY.npy
+a structured array of shape (# of cycles X # of metrics), which grows by the
+rows of cycles appended to the run later (see refreshMeshStats).  The ZSD
+analysis of RebeccaScripts/ZSDAnalysis.py, which compares a zone against the
+mesh in every cycle, then only reads the trajectory of that zone.
+"""
+
+import numpy as np
+import os
+import sys
+from FeatureDataReader import FeatureDataReader
+from ZoneStatistics import appendStats, isStale, saveStats
+
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+MESH_STATS_DTYPE = np.dtype([('cycle', np.int64), ('mean', np.float64),
+                             ('std', np.float64), ('min', np.float32),
+                             ('max', np.float32), ('maxDevZone', np.int64),
+                             ('maxDev', np.float32),
+                             ('percentiles', np.float32, len(PERCENTILES))])
+
+ZSD_COLUMNS = ('Cycle', 'SD', 'FP', 'FZ', 'FailedZoneValue', 'FailedZoneDiff')
+
+
+def buildMeshStats(reader, run, cyclesPerChunk=16, start=0, stop=None):
+    """Compute mesh-wide statistics of all cycles and metrics of a run
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        cyclesPerChunk: # of cycles read and reduced at once
+        start: position of first cycle (in sorted cycle order) to compute
+        stop: position one past last cycle to compute (default is the last
+              cycle that all partitions have; cycles of a run that is still
+              writing them are left for refreshMeshStats)
+
+    Returns:
+        structured numpy array of dtype MESH_STATS_DTYPE and shape
+        (# of cycles X # of metrics)
+    """
+    backend = reader.getBackend()
+    zones = reader.getCycleZoneIds().astype(np.int64)
+    if stop is None:
+        stop = min([len(backend.metadata(run, part)['cycles'])
+                    for part in range(0, reader._numParts)])
+    cycles = backend.metadata(run, 0)['cycles'][start:stop]
+    nmetrics = len(reader.getMetricNames())
+    stats = np.zeros((len(cycles), nmetrics), dtype=MESH_STATS_DTYPE)
+
+    buf = np.empty((min(cyclesPerChunk, len(cycles)), len(zones), nmetrics),
+                   dtype=np.float32)
+    for first in range(0, len(cycles), cyclesPerChunk):
+        last = min(first + cyclesPerChunk, len(cycles))
+        data = buf[:last-first]
+        start = 0
+        for part in range(0, reader._numParts):
+            positions = reader._findCycles(run, part, cycles[first:last])
+            nzones = len(reader.getPartitionZoneIds(part))
+            backend.readSlab(run, part, positions[0], positions[-1] + 1, 0,
+                             nzones, None, data[:, start:start+nzones],
+                             cache=False)
+            start += nzones
+        _reduceChunk(stats[first:last], data, zones)
+    stats['cycle'] = cycles[:, np.newaxis]
+    return stats
+
+
+def _reduceChunk(stats, data, zones):
+    """Reduce a chunk of full-mesh cycles to mesh-wide statistics
+
+    Args:
+        stats: structured array of dtype MESH_STATS_DTYPE and shape
+               (# of cycles X # of metrics), filled in place
+        data: 3D numpy array of shape (# of cycles X # of zones X # of
+              metrics)
+        zones: 1D numpy array of zone ids of the zones axis of data
+    """
+    values = data.astype(np.float64)
+    mean = values.mean(axis=1)
+    deviation = mean[:, np.newaxis] - values
+    worst = np.abs(deviation).argmax(axis=1)
+    (c, m) = np.indices(worst.shape)
+
+    stats['mean'] = mean
+    stats['std'] = np.sqrt(np.square(deviation).mean(axis=1))
+    stats['min'] = data.min(axis=1)
+    stats['max'] = data.max(axis=1)
+    stats['maxDevZone'] = zones[worst]
+    stats['maxDev'] = deviation[c, worst, m]
+    stats['percentiles'] = np.rollaxis(
+        np.percentile(data, PERCENTILES, axis=1), 0, 3)
+
+
+def getMeshStatsPath(dataDir, run):
+    """Get path of the mesh statistics sidecar of a run"""
+    return "%s/stats/meshstats_r%03d.npy" % (dataDir, run)
+
+
+def writeMeshStats(reader, run, cyclesPerChunk=16):
+    """Build the mesh statistics sidecar of a run
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        cyclesPerChunk: # of cycles read and reduced at once
+
+    Returns:
+        path of sidecar
+    """
+    stats = buildMeshStats(reader, run, cyclesPerChunk)
+    path = getMeshStatsPath(reader._dataDir, run)
+    saveStats(path, stats)
+    return path
+
+
+def loadMeshStats(reader, run):
+    """Load the mesh statistics sidecar of a run, building it if needed
+
+    The sidecar is rebuilt whenever it is older than a file index of the run
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+
+    Returns:
+        memory-mapped structured array of dtype MESH_STATS_DTYPE and shape
+        (# of cycles X # of metrics)
+    """
+    path = getMeshStatsPath(reader._dataDir, run)
+    if not os.path.isfile(path) or isStale(reader, run, path):
+        refreshMeshStats(reader, run)
+    return np.load(path, mmap_mode='r')
+
+
+def refreshMeshStats(reader, run, cyclesPerChunk=16):
+    """Extend the mesh statistics sidecar of a run by cycles appended since
+
+    Only the new cycles are read, and their rows appended to the sidecar in
+    place; the sidecar is rebuilt if it does not exist or its cycles are no
+    longer the first cycles of the run
+    Cycles that not all partitions have yet are left for the next refresh
+
+    Args:
+        reader: FeatureDataReader (refreshed first, see
+                FeatureDataReader.refresh)
+        run: simulation run #
+        cyclesPerChunk: # of cycles read and reduced at once
+
+    Returns:
+        path of sidecar
+    """
+    reader.refresh()
+    path = getMeshStatsPath(reader._dataDir, run)
+    if not os.path.isfile(path):
+        return writeMeshStats(reader, run, cyclesPerChunk)
+    stored = np.load(path, mmap_mode='r')['cycle'][:, 0]
+    (count, lastCycle) = (len(stored), stored[-1] if len(stored) else None)
+    del stored
+    cycles = reader.getBackend().metadata(run, 0)['cycles']
+    if count > len(cycles) or (count and lastCycle != cycles[count-1]):
+        return writeMeshStats(reader, run, cyclesPerChunk)
+    rows = buildMeshStats(reader, run, cyclesPerChunk, count)
+    if len(rows):
+        appendStats(path, rows)
+    return path
+
+
+def queryZSD(reader, run, zone, metric='oddy'):
+    """Compare a zone against the mesh in every cycle of a run
+
+    Only the trajectory of the zone is read; all mesh-wide values come from
+    the mesh statistics sidecar
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        zone: mesh zone id
+        metric: metric name or index
+
+    Returns:
+        2D numpy float64 array of shape (# of cycles X 6) with the columns of
+        ZSD_COLUMNS: cycle #, standard deviation of the metric over the mesh,
+        deviation (mesh mean - value) of the zone deviating most from the
+        mean, id of that zone, value of the given zone and its difference to
+        the mesh mean (value - mesh mean)
+    """
+    [m] = reader.getMetricIndexes([metric])
+    stats = loadMeshStats(reader, run)[:, m]
+    values = reader.readAllCyclesForZone(run, zone, [m])[:, 0]
+    return np.column_stack((stats['cycle'], stats['std'], stats['maxDev'],
+                            stats['maxDevZone'], values,
+                            values - stats['mean']))
+
+
+def writeZSDReport(reader, run, zone, path, metric='oddy'):
+    """Write the ZSD analysis of a zone as CSV file (see queryZSD)
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        zone: mesh zone id
+        path: path of CSV file
+        metric: metric name or index
+    """
+    result = queryZSD(reader, run, zone, metric)
+    with open(path, 'w') as fout:
+        fout.write(','.join(ZSD_COLUMNS) + '\n')
+        for row in result:
+            fout.write('%d,%r,%r,%d,%r,%r\n' % tuple(row))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print 'Usage: MeshStatistics.py dataDir run [zone metric report.csv]'
+        sys.exit(1)
+
+    reader = FeatureDataReader(sys.argv[1])
+    run = int(sys.argv[2])
+    if len(sys.argv) > 5:
+        writeZSDReport(reader, run, int(sys.argv[3]), sys.argv[5],
+                       sys.argv[4])
+    else:
+        print writeMeshStats(reader, run)
@@ -0,0 +1,191 @@
+"""Neighbour-aggregate features of mesh zones
+
+Failing zones cluster in space, so the state of the zones around a zone is a
+useful feature of it.  NeighborFeatures computes, for every zone of a
+full-mesh block of values at once, the mean, maximum and minimum over its
+neighbours (see ZoneGraph) and the magnitude of the least-squares gradient
+of the values around it.  Means and gradients are sparse matrix products;
+maxima and minima are reductions over the CSR segments of the graph.
+"""
+
+import numpy as np
+import scipy.sparse
+import sys
+from FeatureDataReader import FeatureDataReader
+from ZoneGraph import MESH_DIR, ZoneGraph
+
+AGGREGATES = ('mean', 'max', 'min', 'gradient')
+
+
+class NeighborFeatures(object):
+    """Neighbour aggregates of values given for all zones of the mesh
+
+    Attributes:
+        _zones: zone ids in order of the rows of value blocks
+        _order: rows of blocks sorted by zone id, used to look up zone ids
+        _adjacency: binary CSR adjacency matrix in order of block rows
+        _mean: CSR matrix averaging the values of neighbours
+        _degrees: # of neighbours of each zone
+        _gradX, _gradY: CSR matrices of the x and y offsets of the centroids
+                        of neighbours from the centroid of each zone
+        _inverse: entries (xx, xy, yy) of the (pseudo-)inverse 2 X 2 normal
+                  matrix of the least-squares gradient of each zone
+    """
+
+    def __init__(self, graph, zones, minShared=1):
+        """Class constructor
+
+        Args:
+            graph: ZoneGraph
+            zones: 1D array-like of zone ids in order of the rows of the
+                   blocks to compute features of (e.g. getCycleZoneIds of a
+                   FeatureDataReader); zones not in this list are ignored as
+                   neighbours
+            minShared: minimum # of nodes two zones share to be neighbours
+        """
+        self._zones = np.asarray(zones)
+        self._order = np.argsort(self._zones, kind='mergesort')
+        rows = graph.getRows(self._zones)
+        adjacency = graph.getAdjacency(minShared)[rows][:, rows].tocsr()
+        adjacency.data[:] = 1
+        adjacency.sort_indices()
+        self._adjacency = adjacency.astype(np.float64)
+        self._degrees = np.diff(adjacency.indptr)
+
+        scale = 1.0 / np.maximum(self._degrees, 1)
+        self._mean = scipy.sparse.diags(scale) * self._adjacency
+
+        centroids = graph.centroids[rows]
+        edgeRows = np.repeat(np.arange(len(rows)), self._degrees)
+        offsets = centroids[adjacency.indices] - centroids[edgeRows]
+        (self._gradX, self._gradY) = [
+            scipy.sparse.csr_matrix((offsets[:, i], adjacency.indices,
+                                     adjacency.indptr),
+                                    shape=adjacency.shape)
+            for i in (0, 1)]
+        xx = np.bincount(edgeRows, offsets[:, 0]**2, len(rows))
+        xy = np.bincount(edgeRows, offsets[:, 0]*offsets[:, 1], len(rows))
+        yy = np.bincount(edgeRows, offsets[:, 1]**2, len(rows))
+        # the normal matrix of zones whose neighbours lie on a line through
+        # them has rank 1; its pseudo-inverse M / trace(M)^2 yields the
+        # gradient along that line
+        det = xx * yy - xy * xy
+        trace = xx + yy
+        full = det > 1e-9 * trace * trace
+        scale = np.zeros(len(rows))
+        scale[full] = 1.0 / det[full]
+        line = ~full & (trace > 0)
+        scale[line] = 1.0 / trace[line]**2
+        self._inverse = [np.where(full, yy, xx) * scale,
+                         np.where(full, -xy, xy) * scale,
+                         np.where(full, xx, yy) * scale]
+
+
+    def getRows(self, zones):
+        """Get rows of value blocks of zone ids
+
+        Args:
+            zones: 1D array-like of mesh zone ids
+
+        Returns:
+            1D numpy array of rows
+
+        Raises:
+            KeyError: if any zone id is not among the zones of the features
+        """
+        pos = np.searchsorted(self._zones[self._order], zones)
+        pos = np.minimum(pos, len(self._zones) - 1)
+        rows = self._order[pos]
+        found = self._zones[rows] == zones
+        if not np.all(found):
+            raise KeyError(np.asarray(zones)[~found])
+        return rows
+
+
+    def compute(self, block, aggregates=AGGREGATES):
+        """Compute neighbour aggregates of all zones
+
+        Zones without neighbours get their own values as mean, maximum and
+        minimum, and a gradient of 0
+
+        Args:
+            block: 2D numpy array of shape (# of zones X # of values), e.g.
+                   selected metrics of a cycle (see
+                   FeatureDataReader.readAllZonesInCycle)
+            aggregates: names of aggregates (see AGGREGATES)
+
+        Returns:
+            2D numpy float64 array of shape (# of zones X # of aggregates *
+            # of values), with the columns of each aggregate side by side in
+            order of aggregates
+        """
+        values = np.asarray(block, dtype=np.float64)
+        columns = []
+        for name in aggregates:
+            if name == 'mean':
+                result = self._mean * values
+                alone = (self._degrees == 0)
+                result[alone] = values[alone]
+            elif name in ('max', 'min'):
+                result = self._reduce(values, np.maximum if name == 'max'
+                                      else np.minimum)
+            elif name == 'gradient':
+                result = self._gradient(values)
+            else:
+                raise ValueError("Unknown aggregate '%s'." % name)
+            columns.append(result)
+        return np.hstack(columns)
+
+
+    def _reduce(self, values, ufunc):
+        """Reduce the values of the neighbours of every zone with a ufunc"""
+        result = values.copy()
+        linked = np.flatnonzero(self._degrees)
+        if len(linked):
+            segments = values[self._adjacency.indices]
+            result[linked] = ufunc.reduceat(
+                segments, self._adjacency.indptr[linked], axis=0)
+        return result
+
+
+    def _gradient(self, values):
+        """Magnitude of the least-squares gradient of values at every zone
+
+        The gradient g of zone i is the least-norm minimizer of the sum over
+        its neighbours j of (v[j] - v[i] - g . (c[j] - c[i]))^2, where c are
+        zone centroids
+        """
+        bx = self._gradX * values - self._gradX.sum(axis=1).A * values
+        by = self._gradY * values - self._gradY.sum(axis=1).A * values
+        (xx, xy, yy) = [entry[:, np.newaxis] for entry in self._inverse]
+        return np.hypot(xx * bx + xy * by, xy * bx + yy * by)
+
+
+def getFeatureNames(names, aggregates=AGGREGATES):
+    """Get names of the columns computed by NeighborFeatures.compute
+
+    Args:
+        names: names of the columns of the value blocks (e.g. metric names)
+        aggregates: names of aggregates
+
+    Returns:
+        list of names like 'nbr_mean_oddy'
+    """
+    return ['nbr_%s_%s' % (aggregate, name) for aggregate in aggregates
+            for name in names]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print 'Usage: NeighborFeatures.py dataDir run cycle metric ' \
+              '[meshDir]'
+        sys.exit(1)
+
+    reader = FeatureDataReader(sys.argv[1])
+    graph = ZoneGraph(sys.argv[5] if len(sys.argv) > 5 else MESH_DIR)
+    features = NeighborFeatures(graph, reader.getCycleZoneIds())
+    block = reader.readAllZonesInCycle(int(sys.argv[2]), int(sys.argv[3]),
+                                       [sys.argv[4]])
+    np.set_printoptions(suppress=True, precision=4)
+    print getFeatureNames([sys.argv[4]])
+    print features.compute(block)[:10]
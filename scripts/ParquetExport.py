@@ -0,0 +1,206 @@
+"""Columnar (Parquet) export of simulation feature data
+
+Features are exported as one row per (cycle, zone) with columns run, part,
+cycle, zone and one float32 column per metric.  Files are partitioned by run,
+partition and cycle range:
+    outDir/run=RRR/part=PP/cycles_CCCCCCCC_CCCCCCCC.parquet
+and each file is split into row groups of a few cycles, for which Parquet
+stores min/max statistics of every column.  loadParquet uses the directory
+names, file names and row group statistics to skip data that cannot match
+its filters, before filtering the remaining rows exactly.
+
+Requires the pyarrow package (and pandas for loadParquet).
+"""
+
+from AtomicFile import atomicPath
+import glob
+import numpy as np
+import operator
+import os
+import re
+import sys
+from FeatureDataReader import FeatureDataReader
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = pq = None
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,
+             '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+def exportParquet(dataDir, outDir, numParts=None, runs=None,
+                  cyclesPerFile=1024, cyclesPerRowGroup=64):
+    """Export feature data of a data directory to partitioned Parquet files
+
+    Args:
+        dataDir: data directory
+        outDir: output directory
+        numParts: # of partitions in mesh (default is taken from the catalog)
+        runs: list of simulation run #s (default is all runs in data directory)
+        cyclesPerFile: # of cycles per Parquet file
+        cyclesPerRowGroup: # of cycles per row group
+
+    Returns:
+        list of paths of Parquet files
+    """
+    _requirePyarrow()
+    reader = FeatureDataReader(dataDir, numParts)
+    if runs is None:
+        runs = reader.getRuns()
+    names = reader.getMetricNames()
+    backend = reader.getBackend()
+
+    paths = []
+    for run in runs:
+        for part in range(0, reader._numParts):
+            zones = reader.getPartitionZoneIds(part)
+            cycles = backend.metadata(run, part)['cycles']
+            partDir = "%s/run=%03d/part=%02d" % (outDir, run, part)
+            if not os.path.isdir(partDir):
+                os.makedirs(partDir)
+
+            buf = np.empty((min(cyclesPerFile, len(cycles)), len(zones),
+                            len(names)), dtype=np.float32)
+            for first in range(0, len(cycles), cyclesPerFile):
+                block = cycles[first:first+cyclesPerFile]
+                data = backend.readSlab(run, part, first, first + len(block),
+                                        0, len(zones), None,
+                                        buf[:len(block)], cache=False)
+                data = data.reshape(-1, len(names))
+                columns = [
+                    np.full(len(data), run, dtype=np.int32),
+                    np.full(len(data), part, dtype=np.int32),
+                    np.repeat(block.astype(np.int32), len(zones)),
+                    np.tile(zones, len(block))]
+                columns += [data[:, i] for i in range(0, len(names))]
+                table = pyarrow.Table.from_arrays(
+                    [pyarrow.array(column) for column in columns],
+                    ['run', 'part', 'cycle', 'zone'] + names)
+
+                path = "%s/cycles_%08d_%08d.parquet" % (partDir, block[0],
+                                                         block[-1])
+                with atomicPath(path) as tmp:
+                    pq.write_table(table, tmp, row_group_size=(
+                        cyclesPerRowGroup * len(zones)))
+                paths.append(path)
+    return paths
+
+
+def loadParquet(outDir, filters=(), columns=None):
+    """Load exported feature data matching a conjunction of filters
+
+    Files and row groups are skipped when their run/partition directory,
+    cycle range or min/max statistics show that no row can match
+
+    Args:
+        outDir: directory written by exportParquet
+        filters: list of (column, operator, value) tuples that must all hold,
+                 where operator is one of '==', '!=', '<', '<=', '>', '>=' or
+                 'between' (value is an inclusive (low, high) pair), e.g.
+                 [('oddy', '>', 1e4), ('cycle', 'between', (a, b))]
+        columns: list of columns to load (default is all columns)
+
+    Returns:
+        pandas DataFrame with one row per matching (cycle, zone), or None if
+        all data was skipped
+    """
+    _requirePyarrow()
+    filters = [_normalizeFilter(f) for f in filters]
+
+    tables = []
+    for path in sorted(glob.glob("%s/run=*/part=*/cycles_*.parquet" % outDir)):
+        match = re.search(r'run=(\d+)/part=(\d+)/cycles_(\d+)_(\d+)\.parquet$',
+                          path.replace(os.sep, '/'))
+        bounds = {'run': (int(match.group(1)), int(match.group(1))),
+                  'part': (int(match.group(2)), int(match.group(2))),
+                  'cycle': (int(match.group(3)), int(match.group(4)))}
+        if not _mayMatch(filters, bounds):
+            continue
+
+        pfile = pq.ParquetFile(path)
+        schema = pfile.metadata.schema
+        names = [schema.column(i).name for i in range(0, len(schema))]
+        needed = None
+        if columns is not None:
+            needed = list(columns) + [f[0] for f in filters
+                                      if f[0] not in columns]
+        for group in range(0, pfile.num_row_groups):
+            meta = pfile.metadata.row_group(group)
+            stats = {}
+            for (i, name) in enumerate(names):
+                column = meta.column(i).statistics
+                if column is not None and column.has_min_max:
+                    stats[name] = (column.min, column.max)
+            if _mayMatch(filters, stats):
+                tables.append(pfile.read_row_group(group, columns=needed))
+
+    if not tables:
+        return None
+    frame = pyarrow.concat_tables(tables).to_pandas()
+    mask = np.ones(len(frame), dtype=bool)
+    for (name, op, value) in filters:
+        if op == 'between':
+            mask &= (frame[name].values >= value[0]) & \
+                    (frame[name].values <= value[1])
+        else:
+            mask &= OPERATORS[op](frame[name].values, value)
+    frame = frame[mask].reset_index(drop=True)
+    if columns is not None:
+        frame = frame[list(columns)]
+    return frame
+
+
+def _normalizeFilter(f):
+    """Check a (column, operator, value) filter tuple"""
+    (name, op, value) = f
+    if op != 'between' and op not in OPERATORS:
+        raise ValueError("Unknown filter operator '%s'." % op)
+    return (name, op, value)
+
+
+def _mayMatch(filters, bounds):
+    """Check whether data with given column bounds may match all filters
+
+    Args:
+        filters: list of (column, operator, value) tuples
+        bounds: dictionary with column names as keys and (min, max) pairs as
+                values; columns without bounds may match anything
+
+    Returns:
+        False if some filter cannot match any value within bounds
+    """
+    for (name, op, value) in filters:
+        if name not in bounds:
+            continue
+        (lo, hi) = bounds[name]
+        if op == 'between':
+            if hi < value[0] or lo > value[1]:
+                return False
+        elif op == '==' and (value < lo or value > hi):
+            return False
+        elif op == '!=' and lo == hi == value:
+            return False
+        elif (op == '<' and lo >= value) or (op == '<=' and lo > value):
+            return False
+        elif (op == '>' and hi <= value) or (op == '>=' and hi < value):
+            return False
+    return True
+
+
+def _requirePyarrow():
+    """Raise ImportError if pyarrow is not installed"""
+    if pq is None:
+        raise ImportError("Parquet export requires the pyarrow package.")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print 'Usage: ParquetExport.py dataDir outDir [run ...]'
+        sys.exit(1)
+
+    runs = [int(run) for run in sys.argv[3:]] or None
+    for path in exportParquet(sys.argv[1], sys.argv[2], runs=runs):
+        print path
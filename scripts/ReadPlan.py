@@ -0,0 +1,222 @@
+"""Coalesced reads of many (run, cycle, zone) requests
+
+A ReadPlan turns an unordered list of zone requests into few large reads:
+requests are grouped by file and sorted by byte offset, and records closer
+than a gap tolerance are merged into a single byte range.  Executing the plan
+issues the reads (concurrently if the reader has numThreads > 1) and scatters
+the records back into request order.
+"""
+
+import numpy as np
+
+
+def planRanges(seeks, recordBytes, gapBytes=0):
+    """Merge records at sorted byte offsets into byte ranges
+
+    Args:
+        seeks: sorted 1D numpy int64 array of byte offsets of records
+        recordBytes: size of a record in bytes
+        gapBytes: maximum # of unrequested bytes between two records that are
+                  still read as one range (0 merges adjacent or overlapping
+                  records only)
+
+    Returns:
+        Pair (starts, stops) of 1D numpy arrays with the positions in seeks
+        of the first record of each range and one past its last record
+    """
+    if len(seeks) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    breaks = np.flatnonzero(np.diff(seeks) > recordBytes + gapBytes) + 1
+    starts = np.concatenate(([0], breaks))
+    stops = np.concatenate((breaks, [len(seeks)]))
+    return (starts, stops)
+
+
+def readRecords(fin, seeks, recordBytes, first, last):
+    """Read a merged byte range and extract its records
+
+    Args:
+        fin: file object opened for binary reading
+        seeks: sorted 1D numpy int64 array of byte offsets of records
+        recordBytes: size of a record in bytes (a multiple of 4)
+        first: position in seeks of first record of range
+        last: position in seeks one past last record of range
+
+    Returns:
+        2D numpy float32 array of shape (last - first X recordBytes / 4)
+    """
+    start = seeks[first]
+    buf = np.empty(seeks[last-1] - start + recordBytes, dtype=np.uint8)
+    fin.seek(start)
+    if fin.readinto(buf) != buf.nbytes:
+        raise IOError("Unexpected end of file in '%s'." % fin.name)
+    shifts = seeks[first:last] - start
+    if np.all(shifts % 4 == 0):
+        index = (shifts // 4)[:,None] + np.arange(recordBytes // 4)
+        return buf.view(np.float32)[index]
+    index = shifts[:,None] + np.arange(recordBytes)
+    return np.ascontiguousarray(buf[index]).view(np.float32)
+
+
+class ReadPlan(object):
+    """Plan of coalesced reads for a list of (run, cycle, zone) requests
+
+    Requests are grouped by run and mesh partition.  Groups whose storage
+    backend can locate records in a file (see StorageBackend.locate) are read
+    as merged byte ranges; all other requests (including records the backend
+    serves itself, e.g. from the block cache) are read with the backend's
+    readGather
+
+    Attributes:
+        _reader: FeatureDataReader the plan reads with
+        _mindex: list of metric indexes, or None for all metrics
+        _numRequests: # of requests
+        _groups: list of dictionaries, one per run and partition, with run,
+                 partition, requests read by readGather (rows, positions,
+                 zone offsets) and, for located requests, the file path,
+                 record size, request rows sorted by byte offset, their byte
+                 offsets and the ranges of them read at once
+        _stats: dictionary of plan statistics (see getStats)
+    """
+
+    def __init__(self, reader, runs, cycles, zones, mindex=None, gapBytes=0):
+        """Class constructor, plans reads without reading any feature data
+
+        Args:
+            reader: FeatureDataReader
+            runs: simulation run # or 1D array-like of run #s, same size as
+                  cycles
+            cycles: 1D array-like of simulation cycle #s
+            zones: 1D array-like of mesh zone ids, same size as cycles
+            mindex: list of metric indexes, or None for all metrics
+            gapBytes: maximum # of unrequested bytes between two records that
+                      are still read as one range
+        """
+        self._reader = reader
+        self._mindex = mindex
+        cycles = np.asarray(cycles, dtype=np.int64)
+        zones = np.asarray(zones, dtype=np.int64)
+        runs = np.broadcast_to(np.asarray(runs, dtype=np.int64), cycles.shape)
+        (parts, zoneOffsets) = reader.lookupZones(zones)
+        self._numRequests = len(cycles)
+
+        self._groups = []
+        self._stats = {'requests': len(cycles), 'gathered': 0, 'reads': 0,
+                       'rawBytes': 0, 'plannedBytes': 0}
+        backend = reader.getBackend()
+        keys = runs * (reader._numParts + 1) + parts
+        for key in np.unique(keys):
+            rows = np.flatnonzero(keys == key)
+            (run, part) = (int(runs[rows[0]]), int(parts[rows[0]]))
+            positions = reader._findCycles(run, part, cycles[rows])
+            group = {'run': run, 'part': part, 'rows': rows,
+                     'positions': positions, 'zoneOffsets': zoneOffsets[rows]}
+            located = backend.locate(run, part, positions, zoneOffsets[rows],
+                                     mindex)
+            if located is not None:
+                self._planGroup(group, located, gapBytes)
+            self._stats['gathered'] += len(group['rows'])
+            self._groups.append(group)
+
+
+    def _planGroup(self, group, located, gapBytes):
+        """Plan merged byte ranges for the located requests of a group
+
+        Args:
+            group: group dictionary, whose rows, positions and zone offsets
+                   are reduced to the requests left to readGather
+            located: dictionary returned by StorageBackend.locate
+            gapBytes: maximum # of unrequested bytes between merged records
+        """
+        seeks = located['seeks']
+        recordBytes = located['recordBytes']
+        keep = (seeks < 0)
+        order = np.argsort(seeks[~keep], kind='mergesort')
+        seeks = seeks[~keep][order]
+        (starts, stops) = planRanges(seeks, recordBytes, gapBytes)
+
+        group['path'] = located['path']
+        group['recordBytes'] = recordBytes
+        group['sortedRows'] = group['rows'][~keep][order]
+        group['seeks'] = seeks
+        group['ranges'] = list(zip(starts, stops))
+        for name in ('rows', 'positions', 'zoneOffsets'):
+            group[name] = group[name][keep]
+
+        self._stats['reads'] += len(starts)
+        self._stats['rawBytes'] += len(seeks) * recordBytes
+        self._stats['plannedBytes'] += int(np.sum(
+            seeks[stops-1] - seeks[starts] + recordBytes))
+
+
+    def getStats(self):
+        """Get plan statistics
+
+        Returns:
+            Dictionary with # of requests, # of requests read with the
+            backend's readGather, # of merged reads, and bytes of located
+            requests when read one by one (rawBytes) and as planned
+            (plannedBytes, which include bytes in merged gaps but count
+            duplicate requests once)
+        """
+        return dict(self._stats)
+
+
+    def execute(self, out=None):
+        """Read all requests
+
+        Args:
+            out: float32 array of shape (# of requests X # of metrics) to
+                 read into (default is a new array)
+
+        Returns:
+            2D numpy array of shape (# of requests X # of metrics), where row
+            i holds the data of the i-th request
+        """
+        reader = self._reader
+        if out is None:
+            nmetrics = len(reader.getMetricNames() if self._mindex is None
+                           else self._mindex)
+            out = np.empty((self._numRequests, nmetrics), dtype=np.float32)
+
+        tasks = []
+        for group in self._groups:
+            if len(group['rows']):
+                tasks.append((group, None))
+            if 'ranges' in group:
+                # split ranges of a group into one batch per thread
+                step = max(1, -(-len(group['ranges']) // reader._numThreads))
+                for first in range(0, len(group['ranges']), step):
+                    tasks.append((group, group['ranges'][first:first+step]))
+
+        def run(task):
+            (group, ranges) = task
+            if ranges is None:
+                out[group['rows']] = reader.getBackend().readGather(
+                    group['run'], group['part'], group['positions'],
+                    group['zoneOffsets'], self._mindex)
+            else:
+                self._readRanges(group, ranges, out)
+        if reader._numThreads > 1 and len(tasks) > 1:
+            reader._getThreadPool().map(run, tasks)
+        else:
+            for task in tasks:
+                run(task)
+        return out
+
+
+    def _readRanges(self, group, ranges, out):
+        """Read merged byte ranges of a group and scatter their records
+
+        Args:
+            group: group dictionary
+            ranges: list of (first, last) positions in group['seeks']
+            out: output array in request order
+        """
+        (seeks, rows) = (group['seeks'], group['sortedRows'])
+        fin = self._reader._openFile(group['path'])
+        for (first, last) in ranges:
+            records = readRecords(fin, seeks, group['recordBytes'], first, last)
+            if self._mindex is not None:
+                records = records[:, self._mindex]
+            out[rows[first:last]] = records
@@ -0,0 +1,105 @@
+"""Following simulation runs that are still writing cycles
+
+A running simulation appends cycles to its feature files and lines to its
+file indexes.  followRun polls a run for such cycles and, whenever some
+appear, brings the derived files of the run up to date at a cost
+proportional to the new data: the reader's cached file indexes (see
+FeatureDataReader.refresh), metric-columnar and zone-major companion files
+(see FeatureDataWriter.refreshCompanions) and the statistics sidecars (see
+ZoneStatistics and MeshStatistics) that exist for the run.
+"""
+
+import numpy as np
+import os
+import sys
+import time
+from FeatureDataReader import FeatureDataReader
+from FeatureDataWriter import refreshCompanions
+from MeshStatistics import getMeshStatsPath, refreshMeshStats
+from ZoneStatistics import getZoneStatsPath, refreshZoneStats
+
+
+def getCompleteCycles(reader, run):
+    """Get cycles of a run that all mesh partitions have
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+
+    Returns:
+        sorted 1D numpy int64 array of cycle #s
+    """
+    backend = reader.getBackend()
+    count = min([len(backend.metadata(run, part)['cycles'])
+                 for part in range(0, reader._numParts)])
+    return backend.metadata(run, 0)['cycles'][:count]
+
+
+def refreshRun(reader, run):
+    """Bring a run and its existing derived files up to date
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+
+    Returns:
+        list of paths of updated files
+    """
+    reader.refresh()
+    paths = []
+    for part in range(0, reader._numParts):
+        paths += refreshCompanions(reader._dataDir, reader._numParts, run,
+                                   part)
+    # companions may have been replaced on disk; reopen them on the next read
+    reader.close()
+    for part in range(0, reader._numParts):
+        for backend in reader._backends.values():
+            backend.forget(run, part)
+    if os.path.isfile(getZoneStatsPath(reader._dataDir, run)):
+        paths.append(refreshZoneStats(reader, run))
+    if os.path.isfile(getMeshStatsPath(reader._dataDir, run)):
+        paths.append(refreshMeshStats(reader, run))
+    return paths
+
+
+def followRun(reader, run, interval=10.0, timeout=None):
+    """Wait for cycles appended to a run and update its derived files
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        interval: # of seconds between polls of the file indexes
+        timeout: # of seconds without new cycles after which to stop
+                 (default is to follow the run forever)
+
+    Yields:
+        1D numpy int64 array of cycle #s that all partitions have since the
+        previous iteration (the first iteration yields the cycles the run
+        already has)
+    """
+    known = 0
+    idle = 0.0
+    while True:
+        cycles = getCompleteCycles(reader, run)
+        if len(cycles) > known:
+            refreshRun(reader, run)
+            yield np.array(cycles[known:])
+            (known, idle) = (len(cycles), 0.0)
+            continue
+        if timeout is not None and idle >= timeout:
+            return
+        time.sleep(interval)
+        idle += interval
+        reader.refresh()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print 'Usage: RunFollower.py dataDir run [interval [timeout]]'
+        sys.exit(1)
+
+    reader = FeatureDataReader(sys.argv[1])
+    interval = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    timeout = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    for cycles in followRun(reader, int(sys.argv[2]), interval, timeout):
+        print '%d new cycles (%d..%d)' % (len(cycles), cycles[0], cycles[-1])
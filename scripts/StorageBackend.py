@@ -0,0 +1,865 @@
+"""Storage backends of FeatureDataReader
+
+A storage backend reads feature data of a run and partition from one storage
+layout.  FeatureDataReader translates cycle #s and zone ids into positions
+(cycles in sorted order, zones as offsets within the partition) and
+dispatches every read through its backend, so layouts can be swapped without
+changing the analysis scripts.  A backend implements:
+    open(run, part): open storage of a run and partition, returning a
+                     backend-specific handle, or None if the backend has no
+                     data for it
+    metadata(run, part): sorted cycle #s, # of zones and # of metrics
+    readSlab(...): read a rectangle of cycle positions X zone offsets
+    readGather(...): read arbitrary (cycle position, zone offset) pairs
+    locate(...): optionally, byte offsets of zone records in a file, which
+                 lets ReadPlan merge the reads of many requests
+
+Backends are selected by name, either with the backend argument of
+FeatureDataReader, with a URI as data directory (e.g. 'tiled:///path/to/data')
+or with the FEATURE_DATA_BACKEND environment variable.  The default 'auto'
+backend picks the best storage available for each read.  Further backends can
+be added with registerBackend.
+"""
+
+from CompressedFeatureFile import CompressedFeatureFile
+import numpy as np
+import os
+from ReadPlan import planRanges, readRecords
+
+# environment variable selecting the backend of readers that do not name one
+BACKEND_VARIABLE = 'FEATURE_DATA_BACKEND'
+
+# registered backend classes, keyed by name
+BACKENDS = {}
+
+# modules that register further backends when imported, keyed by name
+PLUGINS = {'tiled': 'TiledFeatureStore'}
+
+
+def registerBackend(name, backendClass):
+    """Register a storage backend class under a name
+
+    Args:
+        name: backend name, as used in URIs and the backend argument of
+              FeatureDataReader
+        backendClass: subclass of StorageBackend
+    """
+    BACKENDS[name] = backendClass
+
+
+def getBackendClass(name):
+    """Get storage backend class registered under a name
+
+    Args:
+        name: backend name
+
+    Returns:
+        subclass of StorageBackend
+
+    Raises:
+        ValueError: if no backend is registered under name
+    """
+    if name not in BACKENDS and name in PLUGINS:
+        __import__(PLUGINS[name])
+    if name not in BACKENDS:
+        raise ValueError("Unknown storage backend '%s'." % name)
+    return BACKENDS[name]
+
+
+def splitDataUri(dataDir):
+    """Split a data directory URI into backend name and data directory
+
+    Args:
+        dataDir: data directory, optionally prefixed with 'backend://'
+
+    Returns:
+        Pair (backend name or None, data directory)
+    """
+    if '://' in dataDir:
+        (name, path) = dataDir.split('://', 1)
+        return (name, path)
+    return (None, dataDir)
+
+
+class StorageBackend(object):
+    """Base class of storage backends
+
+    Backends share the file index, meta data, file handles and block cache of
+    the reader that created them
+
+    Attributes:
+        name: backend name
+        _reader: FeatureDataReader using the backend
+    """
+
+    name = None
+
+    def __init__(self, reader):
+        """Class constructor
+
+        Args:
+            reader: FeatureDataReader using the backend
+        """
+        self._reader = reader
+
+
+    def open(self, run, part):
+        """Open storage of a run and partition
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+
+        Returns:
+            backend-specific handle (cached by the backend), or None if the
+            backend has no data for the run and partition
+        """
+        raise NotImplementedError
+
+
+    def metadata(self, run, part):
+        """Get layout of the data of a run and partition
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+
+        Returns:
+            Dictionary with sorted cycle #s (1D numpy int64 array), # of zones
+            in partition and # of metrics
+        """
+        meta = self._reader._readMetaData(part)
+        return {'cycles': self._reader._readFileIndex(run, part)['cycles'],
+                'nzones': len(meta['zones']),
+                'nmetrics': len(meta['metrics'])}
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            cycleStart: position of first cycle (in sorted cycle order)
+            cycleStop: position one past last cycle
+            zoneStart: offset of first zone within partition
+            zoneStop: offset one past last zone
+            mindex: list of metric indexes, or None for all metrics
+            out: C-contiguous float32 array of shape (# of cycles in slab X
+                 # of zones in slab X # of metrics) to read into (default is
+                 a new array)
+            cache: keep partition slabs read in the reader's block cache
+                   (False for scans, which would only evict slabs that are
+                   read again)
+
+        Returns:
+            3D numpy array of shape
+            (# of cycles in slab X # of zones in slab X # of metrics)
+        """
+        raise NotImplementedError
+
+
+    def readGather(self, run, part, positions, zoneOffsets, mindex=None):
+        """Read data of many (cycle position, zone offset) pairs
+
+        The default implementation reads one slab per distinct cycle
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            positions: 1D numpy array of cycle positions (in sorted cycle
+                       order)
+            zoneOffsets: 1D numpy array of zone offsets within partition, same
+                         size as positions
+            mindex: list of metric indexes, or None for all metrics
+
+        Returns:
+            2D numpy array of shape (# of pairs X # of metrics)
+        """
+        out = self._allocate(run, part, (len(positions),), mindex)
+        for pos in np.unique(positions):
+            sel = np.flatnonzero(positions == pos)
+            (lo, hi) = (zoneOffsets[sel].min(), zoneOffsets[sel].max() + 1)
+            slab = self.readSlab(run, part, pos, pos+1, lo, hi, mindex)
+            out[sel] = slab[0, zoneOffsets[sel] - lo]
+        return out
+
+
+    def locate(self, run, part, positions, zoneOffsets, mindex=None):
+        """Locate the records of (cycle position, zone offset) pairs in a file
+
+        A record holds all metrics of a zone in a cycle as float32 values
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            positions: 1D numpy array of cycle positions (in sorted cycle
+                       order)
+            zoneOffsets: 1D numpy array of zone offsets within partition, same
+                         size as positions
+            mindex: list of metric indexes, or None for all metrics
+
+        Returns:
+            Dictionary with file path, record size in bytes and a 1D numpy
+            int64 array of byte offsets of the records, where -1 marks pairs
+            better read with readGather (e.g. cached), or None if the backend
+            does not store records contiguously in a file
+        """
+        return None
+
+
+    def forget(self, run, part):
+        """Drop cached handles of a run and partition
+
+        Called by FeatureDataReader.refresh when cycles were appended to the
+        run, so that the next read reopens the storage with the new cycles
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+        """
+        pass
+
+
+    def _require(self, run, part):
+        """Open storage of a run and partition, which must exist
+
+        Raises:
+            IOError: if the backend has no data for the run and partition
+        """
+        handle = self.open(run, part)
+        if handle is None:
+            raise IOError("No %s feature data for run %d, partition %d in "
+                          "'%s'." % (self.name, run, part,
+                                     self._reader._dataDir))
+        return handle
+
+
+    def _allocate(self, run, part, shape, mindex, out=None):
+        """Allocate output array with metrics as last axis
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            shape: shape of output array without the metrics axis
+            mindex: list of metric indexes, or None for all metrics
+            out: existing output array to use instead
+
+        Returns:
+            uninitialized float32 array (or out)
+        """
+        if out is not None:
+            return out
+        if mindex is None:
+            nmetrics = len(self._reader._readMetaData(part)['metrics'])
+        else:
+            nmetrics = len(mindex)
+        return np.empty(tuple(shape) + (nmetrics,), dtype=np.float32)
+
+
+    def _selectMetrics(self, data, mindex):
+        """Select metrics (last axis) from data read with all metrics"""
+        if mindex is None:
+            return data
+        return data[..., mindex]
+
+
+    def _readInto(self, fin, out):
+        """Fill a C-contiguous array with bytes from the current file position
+
+        Raises:
+            IOError: if the file ends before out is filled
+        """
+        if out.nbytes and fin.readinto(out) != out.nbytes:
+            raise IOError("Unexpected end of file in '%s'." % fin.name)
+
+
+class RawBackend(StorageBackend):
+    """Seek-and-read backend for raw feature files (features_pXX_rYYY.npy)
+
+    Whole-partition slabs are kept in the reader's block cache, where they
+    also serve later reads of single zones, unless read with cache=False
+
+    Attributes:
+        _paths: cache of feature file paths, one per run and partition (None
+                if file does not exist)
+    """
+
+    name = 'raw'
+
+    def __init__(self, reader):
+        StorageBackend.__init__(self, reader)
+        self._paths = {}
+
+
+    def open(self, run, part):
+        """Look up raw feature file, returning its path"""
+        fname = 'features_p%02d_r%03d.npy' % (part, run)
+        if fname not in self._paths:
+            path = "%s/features/%s" % (self._reader._dataDir, fname)
+            self._paths[fname] = path if os.path.isfile(path) else None
+        return self._paths[fname]
+
+
+    def forget(self, run, part):
+        """Drop cached path, since the file may have been created since"""
+        self._paths.pop('features_p%02d_r%03d.npy' % (part, run), None)
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition
+
+        Each cycle of the slab is a single contiguous read, straight into out
+        where possible; slabs of many cycles and few zones are gathered
+        through a memory mapping instead of seeking to every cycle
+        """
+        nzones = len(self._reader._readMetaData(part)['zones'])
+        out = self._allocate(run, part, (cycleStop - cycleStart,
+                                         zoneStop - zoneStart), mindex, out)
+        if cycleStop - cycleStart > 1 and zoneStop - zoneStart < nzones:
+            out[...] = self._reader.getBackend('mmap').readSlab(
+                run, part, cycleStart, cycleStop, zoneStart, zoneStop, mindex)
+            return out
+
+        path = self._require(run, part)
+        offsets = self._reader._readFileIndex(run, part)['offsets']
+        nmetrics = len(self._reader._readMetaData(part)['metrics'])
+        whole = (zoneStart == 0 and zoneStop == nzones)
+        for (i, pos) in enumerate(range(cycleStart, cycleStop)):
+            slab = self._getCachedSlab(run, part, pos)
+            if slab is not None:
+                out[i] = self._selectMetrics(slab[zoneStart:zoneStop], mindex)
+                continue
+
+            direct = (mindex is None and out[i].flags.c_contiguous)
+            if direct:
+                data = out[i]
+            else:
+                data = np.empty((zoneStop - zoneStart, nmetrics),
+                                dtype=np.float32)
+            fin = self._reader._openFile(path)
+            fin.seek(offsets[pos] + zoneStart * nmetrics * 4)
+            self._readInto(fin, data)
+            if whole and cache:
+                self._putCachedSlab(run, part, pos, data)
+            if not direct:
+                out[i] = self._selectMetrics(data, mindex)
+        return out
+
+
+    def readGather(self, run, part, positions, zoneOffsets, mindex=None):
+        """Read data of many (cycle position, zone offset) pairs
+
+        Pairs whose partition slab is in the block cache are served from it
+        The others are sorted by seek position, and records closer than the
+        reader's gap tolerance are merged into a single read
+        """
+        out = self._allocate(run, part, (len(positions),), mindex)
+        sel = np.arange(len(positions))
+
+        # serve pairs whose partition slab is in the block cache
+        if self._reader._cacheBytes > 0:
+            cached = np.zeros(len(sel), dtype=bool)
+            for pos in np.unique(positions):
+                slab = self._getCachedSlab(run, part, pos)
+                if slab is not None:
+                    hit = (positions == pos)
+                    data = slab[zoneOffsets[hit]]
+                    out[hit] = self._selectMetrics(data, mindex)
+                    cached |= hit
+            sel = sel[~cached]
+            if len(sel) == 0:
+                return out
+
+        nmetrics = len(self._reader._readMetaData(part)['metrics'])
+        offsets = self._reader._readFileIndex(run, part)['offsets']
+        seeks = (offsets[positions[sel]] +
+                 zoneOffsets[sel].astype(np.int64) * nmetrics * 4)
+        order = np.argsort(seeks, kind='mergesort')
+        (sel, seeks) = (sel[order], seeks[order])
+        (starts, stops) = planRanges(seeks, nmetrics * 4,
+                                     self._reader._gapBytes)
+
+        fin = self._reader._openFile(self._require(run, part))
+        for (first, last) in zip(starts, stops):
+            data = readRecords(fin, seeks, nmetrics * 4, first, last)
+            out[sel[first:last]] = self._selectMetrics(data, mindex)
+        return out
+
+
+    def locate(self, run, part, positions, zoneOffsets, mindex=None):
+        """Locate records in the raw feature file
+
+        Pairs whose partition slab is in the block cache are left to
+        readGather
+        """
+        nmetrics = len(self._reader._readMetaData(part)['metrics'])
+        offsets = self._reader._readFileIndex(run, part)['offsets']
+        seeks = (offsets[positions] +
+                 np.asarray(zoneOffsets, dtype=np.int64) * nmetrics * 4)
+        if self._reader._cacheBytes > 0:
+            for pos in np.unique(positions):
+                if self._reader._blockCache.contains((run, part, int(pos))):
+                    seeks[positions == pos] = -1
+        return {'path': self._require(run, part), 'recordBytes': nmetrics * 4,
+                'seeks': seeks}
+
+
+    def _getCachedSlab(self, run, part, pos):
+        """Get partition slab of a cycle position from the block cache
+
+        Returns:
+            read-only 2D numpy array of shape (# of zones in partition X
+            # of metrics), or None if slab is not cached
+        """
+        if self._reader._cacheBytes <= 0:
+            return None
+        return self._reader._blockCache.get((run, part, int(pos)))
+
+
+    def _putCachedSlab(self, run, part, pos, data):
+        """Add a copy of a partition slab of a cycle position to the block
+        cache"""
+        if self._reader._cacheBytes > 0:
+            self._reader._blockCache.put((run, part, int(pos)), np.array(data))
+
+
+class MmapBackend(StorageBackend):
+    """Memory-mapping backend for raw feature files
+
+    Reads return views into the mapping instead of fresh copies where
+    possible
+
+    Attributes:
+        _featureMaps: cache of memory-mapped feature files, one per run and
+                      partition (None if file does not exist)
+    """
+
+    name = 'mmap'
+
+    def __init__(self, reader):
+        StorageBackend.__init__(self, reader)
+        self._featureMaps = {}
+
+
+    def open(self, run, part):
+        """Memory-map feature file and cache mapping for run and partition
+
+        The feature file is a sequence of cycles, each of which is a
+        (# of zones X # of metrics) block of float32 values, so the whole file
+        can be mapped as one 3D array without copying any data
+        The file index is used to translate cycle # into row of the mapping
+
+        Returns:
+            Dictionary with three elements (or None if there is no feature
+            file):
+                data: 3D numpy memmap of shape
+                      (# of cycles X # of zones in partition X # of metrics)
+                start: seek position of first row of data
+                order: rows of data sorted by cycle #, either a slice (if
+                       cycles are stored contiguously and in order) or a 1D
+                       numpy array
+        """
+        fname = 'features_p%02d_r%03d.npy' % (part, run)
+        if fname not in self._featureMaps:
+            path = "%s/features/%s" % (self._reader._dataDir, fname)
+            fmap = None
+            if os.path.isfile(path):
+                index = self._reader._readFileIndex(run, part)
+                meta = self._reader._readMetaData(part)
+
+                nmetrics = len(meta['metrics'])
+                nzones = len(meta['zones'])
+                cycleBytes = nzones * nmetrics * 4
+
+                start = int(index['offsets'].min())
+                ncycles = (os.path.getsize(path) - start) // cycleBytes
+                data = np.memmap(path, dtype=np.float32, mode='r',
+                                 offset=start, shape=(ncycles, nzones, nmetrics))
+
+                order = (index['offsets'] - start) // cycleBytes
+                if np.array_equal(order, np.arange(order[0],
+                                                   order[0]+len(order))):
+                    order = slice(order[0], order[0]+len(order))
+                fmap = {'data': data, 'start': start, 'order': order}
+            self._featureMaps[fname] = fmap
+        return self._featureMaps[fname]
+
+
+    def forget(self, run, part):
+        """Drop cached mapping, which does not cover the appended cycles"""
+        self._featureMaps.pop('features_p%02d_r%03d.npy' % (part, run), None)
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition
+
+        Without out, the slab is a view into the mapping if the cycles are
+        stored in order and all metrics are selected
+        """
+        fmap = self._require(run, part)
+        rows = self._getRows(fmap, cycleStart, cycleStop)
+        data = self._selectMetrics(fmap['data'][rows, zoneStart:zoneStop],
+                                   mindex)
+        if out is None:
+            return data
+        out[...] = data
+        return out
+
+
+    def readGather(self, run, part, positions, zoneOffsets, mindex=None):
+        """Read data of many (cycle position, zone offset) pairs"""
+        fmap = self._require(run, part)
+        if isinstance(fmap['order'], slice):
+            rows = fmap['order'].start + positions
+        else:
+            rows = fmap['order'][positions]
+        return self._selectMetrics(fmap['data'][rows, zoneOffsets], mindex)
+
+
+    def _getRows(self, fmap, start, stop):
+        """Get rows of the mapping of a range of cycle positions"""
+        order = fmap['order']
+        if isinstance(order, slice):
+            return slice(order.start + start, order.start + stop)
+        return order[start:stop]
+
+
+class CompressedBackend(StorageBackend):
+    """Backend for compressed feature files (features_pXX_rYYY.blk)
+
+    Decompressed cycles are kept in the reader's block cache
+
+    Attributes:
+        _compressed: cache of compressed feature files, one per run and
+                     partition (None if file does not exist)
+    """
+
+    name = 'compressed'
+
+    def __init__(self, reader):
+        StorageBackend.__init__(self, reader)
+        self._compressed = {}
+
+
+    def open(self, run, part):
+        """Look up compressed feature file and cache its header
+
+        Returns:
+            CompressedFeatureFile, or None if there is no compressed file
+        """
+        fname = 'features_p%02d_r%03d.blk' % (part, run)
+        if fname not in self._compressed:
+            path = "%s/features/%s" % (self._reader._dataDir, fname)
+            cfile = None
+            if os.path.isfile(path):
+                cfile = CompressedFeatureFile(path, self._reader._openFile,
+                                              self._reader._blockCache)
+            self._compressed[fname] = cfile
+        return self._compressed[fname]
+
+
+    def forget(self, run, part):
+        """Drop cached compressed feature file"""
+        self._compressed.pop('features_p%02d_r%03d.blk' % (part, run), None)
+
+
+    def metadata(self, run, part):
+        """Get layout of the data of a run and partition from file header"""
+        cfile = self._require(run, part)
+        return {'cycles': cfile.cycles, 'nzones': cfile.nzones,
+                'nmetrics': cfile.nmetrics}
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition
+
+        Every cycle of the slab is decompressed as a whole
+        """
+        cfile = self._require(run, part)
+        out = self._allocate(run, part, (cycleStop - cycleStart,
+                                         zoneStop - zoneStart), mindex, out)
+        for (i, pos) in enumerate(range(cycleStart, cycleStop)):
+            block = cfile.readBlock(pos)[zoneStart:zoneStop]
+            out[i] = self._selectMetrics(block, mindex)
+        return out
+
+
+class ColumnarBackend(StorageBackend):
+    """Backend for metric-columnar files (metric_pXX_rYYY_mMM.npy)
+
+    A metric-columnar file (see FeatureDataWriter.writeMetricColumns) stores a
+    single metric as a (# of cycles X # of zones in partition) float32 array
+    with cycles in sorted order, so reading a few metrics touches only their
+    columns
+
+    Attributes:
+        _columns: cache of memory-mapped metric-columnar files of each run and
+                  partition, as dictionaries keyed by metric index
+    """
+
+    name = 'columnar'
+
+    def __init__(self, reader):
+        StorageBackend.__init__(self, reader)
+        self._columns = {}
+
+
+    def open(self, run, part):
+        """Memory-map metric-columnar files of run and partition
+
+        Files holding fewer cycles than the file index are ignored; cycles
+        beyond it (e.g. appended by FeatureDataWriter.refreshCompanions since
+        the index was read, possibly in part) are not mapped
+
+        Returns:
+            Dictionary of 2D numpy memmaps keyed by metric index, or None if
+            there are no metric-columnar files
+        """
+        key = (run, part)
+        if key not in self._columns:
+            ncycles = len(self._reader._readFileIndex(run, part)['cycles'])
+            meta = self._reader._readMetaData(part)
+            nzones = len(meta['zones'])
+            columns = {}
+            for metric in range(0, len(meta['metrics'])):
+                fname = 'metric_p%02d_r%03d_m%02d.npy' % (part, run, metric)
+                path = "%s/features/%s" % (self._reader._dataDir, fname)
+                if (os.path.isfile(path) and
+                        os.path.getsize(path) >= ncycles * nzones * 4):
+                    columns[metric] = np.memmap(path, dtype=np.float32,
+                        mode='r', shape=(ncycles, nzones))
+            self._columns[key] = columns or None
+        return self._columns[key]
+
+
+    def forget(self, run, part):
+        """Drop cached mappings, which do not cover the appended cycles"""
+        self._columns.pop((run, part), None)
+
+
+    def hasMetrics(self, run, part, mindex):
+        """Check whether all selected metrics have a metric-columnar file
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            mindex: list of metric indexes, or None for all metrics
+        """
+        columns = self.open(run, part)
+        if columns is None:
+            return False
+        if mindex is None:
+            mindex = range(0, len(self._reader._readMetaData(part)['metrics']))
+        return all([metric in columns for metric in mindex])
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition"""
+        columns = self._getColumns(run, part, mindex)
+        out = self._allocate(run, part, (cycleStop - cycleStart,
+                                         zoneStop - zoneStart), mindex, out)
+        for (i, column) in enumerate(columns):
+            out[..., i] = column[cycleStart:cycleStop, zoneStart:zoneStop]
+        return out
+
+
+    def readGather(self, run, part, positions, zoneOffsets, mindex=None):
+        """Read data of many (cycle position, zone offset) pairs"""
+        columns = self._getColumns(run, part, mindex)
+        out = self._allocate(run, part, (len(positions),), mindex)
+        for (i, column) in enumerate(columns):
+            out[:, i] = column[positions, zoneOffsets]
+        return out
+
+
+    def _getColumns(self, run, part, mindex):
+        """Get memory-mapped columns of selected metrics
+
+        Raises:
+            IOError: if any selected metric has no metric-columnar file
+        """
+        if not self.hasMetrics(run, part, mindex):
+            raise IOError("Missing metric-columnar files for run %d, "
+                          "partition %d in '%s'." % (run, part,
+                                                     self._reader._dataDir))
+        columns = self.open(run, part)
+        if mindex is None:
+            return [columns[metric] for metric in sorted(columns.keys())]
+        return [columns[metric] for metric in mindex]
+
+
+class ZoneMajorBackend(StorageBackend):
+    """Backend for zone-major companion files (zonemajor_pXX_rYYY.npy)
+
+    The companion file (see FeatureDataWriter.writeZoneMajor) stores the same
+    data as the feature file, but transposed to (# of zones X # of cycles X
+    # of metrics) with cycles in sorted order, so the trajectory of a zone is
+    a single contiguous read
+
+    Attributes:
+        _zoneMajor: cache of zone-major companion files, one per run and
+                    partition (None if companion does not exist)
+    """
+
+    name = 'zonemajor'
+
+    def __init__(self, reader):
+        StorageBackend.__init__(self, reader)
+        self._zoneMajor = {}
+
+
+    def open(self, run, part):
+        """Look up zone-major companion file and cache its layout
+
+        A companion whose size does not match the file index is ignored
+
+        Returns:
+            Dictionary with path, # of cycles and bytes per zone (plus a
+            memmap of the companion if memory-mapping is enabled), or None if
+            there is no usable companion file
+        """
+        fname = 'zonemajor_p%02d_r%03d.npy' % (part, run)
+        if fname not in self._zoneMajor:
+            path = "%s/features/%s" % (self._reader._dataDir, fname)
+            zmajor = None
+            if os.path.isfile(path):
+                meta = self._reader._readMetaData(part)
+                ncycles = len(self._reader._readFileIndex(run, part)['cycles'])
+                nzones = len(meta['zones'])
+                nmetrics = len(meta['metrics'])
+                zoneBytes = ncycles * nmetrics * 4
+                if os.path.getsize(path) == nzones * zoneBytes:
+                    zmajor = {'path': path, 'ncycles': ncycles,
+                              'zoneBytes': zoneBytes}
+                    if self._reader._useMmap:
+                        zmajor['data'] = np.memmap(path, dtype=np.float32,
+                            mode='r', shape=(nzones, ncycles, nmetrics))
+            self._zoneMajor[fname] = zmajor
+        return self._zoneMajor[fname]
+
+
+    def forget(self, run, part):
+        """Drop cached companion layout, which may no longer match the index"""
+        self._zoneMajor.pop('zonemajor_p%02d_r%03d.npy' % (part, run), None)
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition
+
+        Each zone of the slab is a single contiguous read
+        """
+        zmajor = self._require(run, part)
+        if 'data' in zmajor:
+            data = zmajor['data'][zoneStart:zoneStop, cycleStart:cycleStop]
+            data = self._selectMetrics(data.transpose(1, 0, 2), mindex)
+            if out is None:
+                return data
+            out[...] = data
+            return out
+
+        out = self._allocate(run, part, (cycleStop - cycleStart,
+                                         zoneStop - zoneStart), mindex, out)
+        nmetrics = zmajor['zoneBytes'] // (zmajor['ncycles'] * 4)
+        fin = self._reader._openFile(zmajor['path'])
+        for (j, zone) in enumerate(range(zoneStart, zoneStop)):
+            direct = (mindex is None and out[:, j].flags.c_contiguous)
+            if direct:
+                data = out[:, j]
+            else:
+                data = np.empty((cycleStop - cycleStart, nmetrics),
+                                dtype=np.float32)
+            fin.seek(zone * zmajor['zoneBytes'] + cycleStart * nmetrics * 4)
+            self._readInto(fin, data)
+            if not direct:
+                out[:, j] = self._selectMetrics(data, mindex)
+        return out
+
+
+    def locate(self, run, part, positions, zoneOffsets, mindex=None):
+        """Locate records in the zone-major companion file"""
+        zmajor = self._require(run, part)
+        recordBytes = zmajor['zoneBytes'] // zmajor['ncycles']
+        seeks = (np.asarray(zoneOffsets, dtype=np.int64) * zmajor['zoneBytes'] +
+                 np.asarray(positions, dtype=np.int64) * recordBytes)
+        return {'path': zmajor['path'], 'recordBytes': recordBytes,
+                'seeks': seeks}
+
+
+class AutoBackend(StorageBackend):
+    """Backend picking the best storage available for every read
+
+    In order of preference:
+        zone-major companion files, for slabs with more cycles than zones
+        metric-columnar files, when a subset of metrics is read and all of
+            them have one
+        compressed feature files, when there is no raw feature file
+        raw feature files, memory-mapped if the reader was created with
+            useMmap=True
+    """
+
+    name = 'auto'
+
+    def open(self, run, part):
+        """Open storage used for whole-partition reads of run and partition"""
+        return self._select(run, part, None, False).open(run, part)
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition"""
+        trajectory = (cycleStop - cycleStart > zoneStop - zoneStart)
+        backend = self._select(run, part, mindex, trajectory)
+        return backend.readSlab(run, part, cycleStart, cycleStop, zoneStart,
+                                zoneStop, mindex, out, cache)
+
+
+    def readGather(self, run, part, positions, zoneOffsets, mindex=None):
+        """Read data of many (cycle position, zone offset) pairs"""
+        backend = self._select(run, part, mindex, False)
+        return backend.readGather(run, part, positions, zoneOffsets, mindex)
+
+
+    def locate(self, run, part, positions, zoneOffsets, mindex=None):
+        """Locate records in the file readGather would read"""
+        backend = self._select(run, part, mindex, False)
+        return backend.locate(run, part, positions, zoneOffsets, mindex)
+
+
+    def _select(self, run, part, mindex, trajectory):
+        """Select backend for a read
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            mindex: list of metric indexes, or None for all metrics
+            trajectory: True if the read spans more cycles than zones
+
+        Returns:
+            StorageBackend
+        """
+        reader = self._reader
+        if trajectory:
+            zmajor = reader.getBackend('zonemajor')
+            if zmajor.open(run, part) is not None:
+                return zmajor
+        if mindex is not None:
+            columnar = reader.getBackend('columnar')
+            if columnar.hasMetrics(run, part, mindex):
+                return columnar
+        if reader.getBackend('raw').open(run, part) is None:
+            compressed = reader.getBackend('compressed')
+            if compressed.open(run, part) is not None:
+                return compressed
+        return reader.getBackend('mmap' if reader._useMmap else 'raw')
+
+
+for backendClass in [RawBackend, MmapBackend, CompressedBackend,
+                     ColumnarBackend, ZoneMajorBackend, AutoBackend]:
+    registerBackend(backendClass.name, backendClass)
@@ -0,0 +1,457 @@
+"""Checks of the derived data paths against a tiny synthetic data directory
+
+Builds a data directory with the real metric names and a small mesh split
+into partitions, in which the cycles of one run are stored out of order and
+do not start at 0, and compares what every derived path (statistics
+sidecars, refreshed indexes, catalogs, ...) returns against a plain read of
+the original feature files.
+
+Usage: SyntheticDataCheck.py [dataDir]
+The data directory (default is a new temporary directory) is overwritten.
+"""
+
+import csv
+from DatasetCatalog import loadCatalog
+import FeatureDataWriter
+from FailureCatalog import FailureCatalog
+import glob
+import json
+import learning_example
+from NeighborFeatures import NeighborFeatures
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+from FeatureDataReader import FeatureDataReader
+import MeshStatistics
+import RunFollower
+from ZoneGraph import ZoneGraph
+import ZoneStatistics
+
+METRIC_NAMES = ['volume', 'aspectRatio', 'conditionNumber', 'distortion',
+                'jacobian', 'largestAngle', 'oddy', 'scaledJacobian',
+                'shape', 'shapeAndSize', 'shear', 'shearAndSize', 'skew',
+                'smallestAngle', 'stretch', 'taper']
+
+# zones of the mesh, a GRID[0] X GRID[1] grid of quadrilaterals, are split
+# into NUM_PARTS partitions of consecutive rows of the grid
+GRID = (6, 5)
+NUM_PARTS = 3
+
+# cycle #s of the runs; run 1 stores its cycles in shuffled order
+RUN_CYCLES = {0: np.arange(0, 40), 1: np.arange(3, 53, 2)}
+
+
+def makeDataset(dataDir, seed=0):
+    """Write the synthetic data directory
+
+    Args:
+        dataDir: data directory (created or overwritten)
+        seed: seed of the random feature values
+    """
+    if os.path.isdir(dataDir):
+        shutil.rmtree(dataDir)
+    for sub in ('features', 'indexes', 'failures', 'meshviewer'):
+        os.makedirs("%s/%s" % (dataDir, sub))
+    rng = np.random.RandomState(seed)
+    nmetrics = len(METRIC_NAMES)
+    for part in range(0, NUM_PARTS):
+        zones = getPartitionZones(part)
+        with open("%s/features/metadata_p%02d.txt" % (dataDir, part),
+                  'w') as fout:
+            fout.write('metrics\n%s\nzones\n' % ','.join(METRIC_NAMES))
+            fout.write(''.join(['%d\n' % zone for zone in zones]))
+        cycleBytes = len(zones) * nmetrics * 4
+        for (run, cycles) in sorted(RUN_CYCLES.items()):
+            data = rng.rand(len(cycles), len(zones),
+                            nmetrics).astype(np.float32)
+            slots = (rng.permutation(len(cycles)) if run % 2
+                     else np.arange(len(cycles)))
+            stored = np.empty_like(data)
+            stored[slots] = data
+            stored.tofile("%s/features/features_p%02d_r%03d.npy" % (
+                dataDir, part, run))
+            with open("%s/indexes/indexes_p%02d_r%03d.txt" % (
+                    dataDir, part, run), 'w') as fout:
+                for i in rng.permutation(len(cycles)):
+                    fout.write('%d -> %d\n' % (cycles[i],
+                                               slots[i] * cycleBytes))
+        with open("%s/failures/side_p%02d" % (dataDir, part), 'w') as fout:
+            fout.write('Run,Cycle,Zone\n')
+            for (run, cycles) in sorted(RUN_CYCLES.items()):
+                fout.write('%d,%d,%d\n' % (run, cycles[-1 - part],
+                                           zones[run % len(zones)]))
+            fout.write('volume,x\n1,2\n')
+        if part == 0:
+            with open("%s/failures/corner_p%02d" % (dataDir, part),
+                      'w') as fout:
+                fout.write('Run,Cycle,Zone\n%d,%d,%d\n' % (
+                    1, RUN_CYCLES[1][0], zones[-1]))
+        writeMeshViewer(dataDir, part, rng)
+
+
+def writeMeshViewer(dataDir, part, rng):
+    """Write the mesh viewer file of a partition (rank) of the mesh
+
+    Nodes of the grid are numbered row by row and moved off the grid lines a
+    little; nodes on partition boundaries appear in the files of both ranks
+    """
+    (ncols, nrows) = GRID
+    state = np.random.RandomState(0)  # same positions in every rank
+    positions = (np.indices((nrows + 1, ncols + 1))[::-1].reshape(2, -1).T +
+                 0.2 * state.rand((nrows + 1) * (ncols + 1), 2))
+    mesh = {'type': 'ZR', 'rank': part, 'zones': {}, 'nodes': {}}
+    for zone in rng.permutation(getPartitionZones(part)):
+        (row, col) = divmod(int(zone), ncols)
+        first = row * (ncols + 1) + col
+        nids = [first, first + 1, first + ncols + 2, first + ncols + 1]
+        mesh['zones'][str(zone)] = {'nids': nids}
+        for nid in nids:
+            mesh['nodes'][str(nid)] = {'pos': positions[nid].tolist()}
+    pos = np.array([node['pos'] for node in mesh['nodes'].values()])
+    mesh['bbox'] = {'min0': pos[:, 0].min(), 'min1': pos[:, 1].min(),
+                    'max0': pos[:, 0].max(), 'max1': pos[:, 1].max()}
+    with open("%s/meshviewer/mesh%02d_cycle00000.json" % (dataDir, part),
+              'w') as fout:
+        json.dump(mesh, fout)
+
+
+def getPartitionZones(part):
+    """Get zone ids of a partition of the synthetic mesh"""
+    rows = np.array_split(np.arange(GRID[1]), NUM_PARTS)[part]
+    return np.arange(rows[0] * GRID[0], (rows[-1] + 1) * GRID[0])
+
+
+def readPlain(dataDir, run):
+    """Read all cycles of a run straight from the original feature files
+
+    Returns:
+        Pair (cycles, data) of sorted cycle #s and a 3D numpy float32 array
+        of shape (# of cycles X # of zones in mesh X # of metrics) with zones
+        in order of partitions
+    """
+    nmetrics = len(METRIC_NAMES)
+    blocks = []
+    for part in range(0, NUM_PARTS):
+        nzones = len(getPartitionZones(part))
+        with open("%s/indexes/indexes_p%02d_r%03d.txt" % (dataDir, part,
+                                                          run)) as fin:
+            entries = sorted([map(int, line.split(' -> '))
+                              for line in fin.read().splitlines()])
+        raw = np.fromfile("%s/features/features_p%02d_r%03d.npy" % (
+            dataDir, part, run), dtype=np.float32)
+        blocks.append(np.array([
+            raw[offset // 4:offset // 4 + nzones * nmetrics].reshape(
+                nzones, nmetrics) for (cycle, offset) in entries]))
+    return (np.array([cycle for (cycle, offset) in entries]),
+            np.concatenate(blocks, axis=1))
+
+
+def checkZoneStats(dataDir):
+    """Zone statistics sidecar and report (see ZoneStatistics)"""
+    reader = FeatureDataReader(dataDir, NUM_PARTS)
+    for run in sorted(RUN_CYCLES):
+        (cycles, data) = readPlain(dataDir, run)
+        values = data.astype(np.float64)
+        stats = ZoneStatistics.buildZoneStats(reader, run, cyclesPerChunk=7)
+        assert np.all(stats['count'] == len(cycles))
+        assert np.array_equal(stats['min'], data.min(axis=0))
+        assert np.array_equal(stats['max'], data.max(axis=0))
+        assert np.array_equal(stats['argmin'], cycles[data.argmin(axis=0)])
+        assert np.array_equal(stats['argmax'], cycles[data.argmax(axis=0)])
+        assert np.allclose(stats['mean'], values.mean(axis=0))
+        assert np.allclose(stats['std'], values.std(axis=0))
+        assert np.array_equal(stats['first'], data[0])
+        assert np.array_equal(stats['last'], data[-1])
+
+        path = "%s/report_r%03d.csv" % (dataDir, run)
+        ZoneStatistics.writeZoneReport(reader, run, path)
+        with open(path) as fin:
+            rows = list(csv.reader(fin))
+        assert len(rows) == 1 + data.shape[1]
+        for (header, (metric, stat)) in zip(rows[0][1:],
+                                            ZoneStatistics.REPORT_COLUMNS):
+            assert header == '%s_%s' % (metric, stat)
+            column = np.array([float(row[rows[0].index(header)])
+                               for row in rows[1:]])
+            m = METRIC_NAMES.index(metric)
+            assert np.array_equal(column, stats[stat][:, m])
+
+
+def checkMeshStats(dataDir):
+    """Mesh statistics sidecar and ZSD query (see MeshStatistics)"""
+    reader = FeatureDataReader(dataDir, NUM_PARTS)
+    zones = reader.getCycleZoneIds()
+    for run in sorted(RUN_CYCLES):
+        (cycles, data) = readPlain(dataDir, run)
+        values = data.astype(np.float64)
+        stats = MeshStatistics.buildMeshStats(reader, run, cyclesPerChunk=6)
+        mean = values.mean(axis=1)
+        deviation = mean[:, np.newaxis] - values
+        worst = np.abs(deviation).argmax(axis=1)
+        assert np.array_equal(stats['cycle'][:, 0], cycles)
+        assert np.allclose(stats['mean'], mean)
+        assert np.allclose(stats['std'], values.std(axis=1))
+        assert np.array_equal(stats['min'], data.min(axis=1))
+        assert np.array_equal(stats['max'], data.max(axis=1))
+        assert np.array_equal(stats['maxDevZone'], zones[worst])
+        assert np.allclose(stats['percentiles'], np.rollaxis(np.percentile(
+            data, MeshStatistics.PERCENTILES, axis=1), 0, 3))
+
+        zone = zones[len(zones) // 2]
+        m = METRIC_NAMES.index('oddy')
+        zsd = MeshStatistics.queryZSD(reader, run, zone, 'oddy')
+        assert np.array_equal(zsd[:, 0], cycles)
+        assert np.allclose(zsd[:, 1], values[:, :, m].std(axis=1))
+        assert np.array_equal(zsd[:, 3], zones[worst[:, m]])
+        assert np.array_equal(zsd[:, 4], data[:, len(zones) // 2, m])
+        assert np.allclose(zsd[:, 5], values[:, len(zones) // 2, m] -
+                           mean[:, m])
+
+
+def checkFollow(dataDir):
+    """Run still writing cycles (see FeatureDataReader.refresh, RunFollower)
+
+    The text indexes are cut within their last line, including the first
+    time they are parsed, as a simulation writing them would leave them
+    """
+    run = 0
+    (cycles, data) = readPlain(dataDir, run)
+    sources = {}
+    for part in range(0, NUM_PARTS):
+        path = "%s/features/features_p%02d_r%03d.npy" % (dataDir, part, run)
+        with open(path, 'rb') as fin:
+            sources[part] = (path, fin.read())
+
+    def grow(count, cut, lead=0):
+        # first count cycles and half of the next, and their index lines in
+        # order, the next one cut after cut characters; partition 0 is lead
+        # cycles ahead of the others
+        for (part, (path, raw)) in sources.items():
+            if part == 0:
+                count += lead
+            cycleBytes = len(raw) // len(cycles)
+            with open(path, 'wb') as fout:
+                fout.write(raw[:count * cycleBytes + cycleBytes // 2])
+            lines = ['%d -> %d\n' % (cycles[i], i * cycleBytes)
+                     for i in range(0, min(count + 1, len(cycles)))]
+            text = ''.join(lines[:count])
+            if count < len(cycles):
+                text += lines[count][:cut]
+            with open("%s/indexes/indexes_p%02d_r%03d.txt" % (
+                    dataDir, part, run), 'w') as fout:
+                fout.write(text)
+            if part == 0:
+                count -= lead
+
+    def compare(reader, count, lead=0):
+        assert np.array_equal(RunFollower.getCompleteCycles(reader, run),
+                              cycles[:count])
+        for i in (0, count // 2, count - 1):
+            assert np.array_equal(reader.readAllZonesInCycle(run, cycles[i]),
+                                  data[i])
+        ncycles = [entry['ncycles'] for entry in loadCatalog(dataDir)['cycles']
+                   if entry['run'] == run]
+        assert ncycles == [count + lead]
+        ahead = getPartitionZones(0)
+        for zone in reader.getCycleZoneIds()[::7]:
+            n = count + (lead if zone in ahead else 0)
+            assert np.array_equal(reader.readAllCyclesForZone(run, zone),
+                                  data[:n, zone])
+
+    # the last index line is cut within its offset, e.g. '10 -> 6' of
+    # '10 -> 6400', on the first parse, and the sidecars are first built
+    # while partition 0 has a cycle the others do not have yet
+    reader = FeatureDataReader(dataDir, NUM_PARTS)
+    grow(10, len('%d -> %d' % (cycles[10], 0)), lead=1)
+    compare(reader, 10, lead=1)
+    ZoneStatistics.loadZoneStats(reader, run)
+    stored = MeshStatistics.loadMeshStats(reader, run)
+    assert np.array_equal(stored['cycle'][:, 0], cycles[:10])
+    metric = METRIC_NAMES.index('oddy')
+    column = FeatureDataWriter.writeMetricColumns(dataDir, NUM_PARTS, run, 1,
+                                                  [metric])[0]
+    zone = getPartitionZones(1)[3]
+
+    # after the arrow on the next refresh, then complete
+    for (count, cut) in ((20, len('%d -> ' % cycles[20])),
+                         (len(cycles), 0)):
+        grow(count, cut)
+        RunFollower.refreshRun(reader, run)
+        compare(reader, count)
+        compare(FeatureDataReader(dataDir, NUM_PARTS), count)
+        fresh = FeatureDataReader(dataDir, NUM_PARTS)
+        stored = np.load(ZoneStatistics.getZoneStatsPath(dataDir, run))
+        built = ZoneStatistics.buildZoneStats(fresh, run)
+        for name in ZoneStatistics.ZONE_STATS_DTYPE.names:
+            assert np.allclose(stored[name], built[name])
+        stored = np.load(MeshStatistics.getMeshStatsPath(dataDir, run))
+        assert np.array_equal(stored,
+                              MeshStatistics.buildMeshStats(fresh, run))
+
+        # the metric-columnar file is read while half a cycle more is being
+        # appended to it
+        with open(column, 'ab') as fout:
+            fout.write(np.zeros(len(getPartitionZones(1)) // 2,
+                                dtype=np.float32).tobytes())
+        columnar = FeatureDataReader(dataDir, NUM_PARTS, backend='columnar')
+        assert np.array_equal(
+            columnar.readAllCyclesForZone(run, zone, [metric])[:, 0],
+            data[:count, zone, metric])
+
+
+def checkFailureCatalog(dataDir):
+    """Failure catalog and its queries (see FailureCatalog)"""
+    failures = []
+    for part in range(0, NUM_PARTS):
+        for (kind, name) in enumerate(('side', 'corner')):
+            path = "%s/failures/%s_p%02d" % (dataDir, name, part)
+            if not os.path.isfile(path):
+                continue
+            with open(path) as fin:
+                fin.readline()  # skip 'Run,...' header
+                for line in fin:
+                    if line.startswith('volume'):
+                        break
+                    (run, cycle, zone) = map(int, line.split(','))
+                    failures.append((part, run, cycle, zone, kind))
+    assert failures
+
+    for rebuild in (True, False):
+        catalog = FailureCatalog(dataDir, rebuild)
+        assert catalog.failures.tolist() == failures
+    assert catalog.forRuns(1).tolist() == [f for f in failures if f[1] == 1]
+    assert catalog.inCycleWindow(30, 40, [0]).tolist() == [
+        f for f in failures if 30 <= f[2] <= 40 and f[1] == 0]
+    first = []
+    for run in sorted(set([f[1] for f in failures])):
+        first.append(min([f for f in failures if f[1] == run],
+                         key=lambda f: f[2]))
+    assert catalog.firstPerRun().tolist() == first
+    (zones, counts) = catalog.perZone()
+    failed = [f[3] for f in failures]
+    assert dict(zip(zones, counts)) == dict([(z, failed.count(z))
+                                             for z in failed])
+
+
+def readMeshViewer(dataDir):
+    """Read node ids of zones and node positions of all mesh viewer files"""
+    (zoneNodes, positions) = ({}, {})
+    for path in glob.glob("%s/meshviewer/mesh*_cycle00000.json" % dataDir):
+        with open(path) as fin:
+            mesh = json.load(fin)
+        for (zone, value) in mesh['zones'].items():
+            zoneNodes[int(zone)] = value['nids']
+        for (node, value) in mesh['nodes'].items():
+            positions[int(node)] = value['pos']
+    return (zoneNodes, positions)
+
+
+def checkZoneGraph(dataDir):
+    """Zone graph stitched from the mesh viewer files (see ZoneGraph)"""
+    (zoneNodes, positions) = readMeshViewer(dataDir)
+    meshDir = "%s/meshviewer" % dataDir
+    for rebuild in (True, False):
+        graph = ZoneGraph(meshDir, rebuild=rebuild)
+        assert graph.zones.tolist() == sorted(zoneNodes)
+        for zone in graph.zones:
+            shared = dict([(other, len(set(zoneNodes[zone]) &
+                                       set(zoneNodes[other])))
+                           for other in zoneNodes if other != zone])
+            for minShared in (1, 2):
+                assert graph.getNeighbors(zone, minShared).tolist() == sorted(
+                    [other for (other, count) in shared.items()
+                     if count >= minShared])
+            centroid = np.mean([positions[node] for node in zoneNodes[zone]],
+                               axis=0)
+            assert np.allclose(graph.centroids[graph.getRows(zone)],
+                               centroid)
+        adjacency = graph.getAdjacency(2)
+        assert adjacency.nnz == sum([len(graph.getNeighbors(zone, 2))
+                                     for zone in graph.zones])
+
+    # a later cycle whose mesh lacks the last partition has a graph of its
+    # own, which does not replace that of cycle 0
+    for part in range(0, NUM_PARTS - 1):
+        shutil.copy("%s/mesh%02d_cycle00000.json" % (meshDir, part),
+                    "%s/mesh%02d_cycle00010.json" % (meshDir, part))
+    last = getPartitionZones(NUM_PARTS - 1)
+    assert ZoneGraph(meshDir, 10).zones.tolist() == sorted(
+        [zone for zone in zoneNodes if zone not in last])
+    assert ZoneGraph(meshDir).zones.tolist() == sorted(zoneNodes)
+
+
+def checkNeighborFeatures(dataDir):
+    """Neighbour aggregates and learning data columns (see NeighborFeatures)"""
+    graph = ZoneGraph("%s/meshviewer" % dataDir)
+    reader = FeatureDataReader(dataDir, NUM_PARTS)
+    zones = reader.getCycleZoneIds()
+    metrics = ['oddy', 'shape']
+    mindex = [METRIC_NAMES.index(metric) for metric in metrics]
+    (cycles, data) = readPlain(dataDir, 1)
+
+    def aggregate(values, minShared):
+        # neighbour aggregates of every zone, one zone at a time
+        rows = []
+        for zone in zones:
+            i = graph.getRows(zone)
+            near = graph.getRows(graph.getNeighbors(zone, minShared))
+            offsets = graph.centroids[near] - graph.centroids[i]
+            gradient = np.linalg.lstsq(offsets, values[near] - values[i],
+                                       rcond=None)[0]
+            rows.append(np.concatenate((
+                values[near].mean(axis=0), values[near].max(axis=0),
+                values[near].min(axis=0), np.hypot(*gradient))))
+        return np.array(rows)
+
+    for minShared in (1, 2):
+        features = NeighborFeatures(graph, zones, minShared)
+        for i in (0, len(cycles) - 1):
+            values = data[i][:, mindex].astype(np.float64)
+            assert np.allclose(features.compute(values),
+                               aggregate(values, minShared))
+
+    learning_example.neighbor_metrics = metrics
+    learning_example.mesh_dir = "%s/meshviewer" % dataDir
+    index = [(cycles[i], zone) for i in (3, 3, 10) for zone in zones[::4]]
+    runs = np.ones(len(index), dtype=np.int64)
+    result = learning_example.get_neighbor_features(dataDir, runs, index)
+    for (row, (cycle, zone)) in zip(result, index):
+        values = data[cycles.tolist().index(cycle)][:, mindex]
+        expected = aggregate(values.astype(np.float64), 1)
+        assert np.allclose(row, expected[zones.tolist().index(zone)])
+
+
+CHECKS = [checkZoneStats, checkMeshStats, checkFollow, checkFailureCatalog,
+          checkZoneGraph, checkNeighborFeatures]
+
+
+def main(dataDir):
+    """Build the synthetic data directory and run all checks
+
+    Returns:
+        # of failed checks
+    """
+    failed = 0
+    for check in CHECKS:
+        makeDataset(dataDir)
+        try:
+            check(dataDir)
+            print 'ok', check.__name__
+        except Exception:
+            failed += 1
+            print 'FAILED', check.__name__
+            traceback.print_exc()
+    return failed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1]) > 0)
+    tmpDir = tempfile.mkdtemp()
+    try:
+        sys.exit(main(os.path.join(tmpDir, 'data')) > 0)
+    finally:
+        shutil.rmtree(tmpDir)
@@ -0,0 +1,224 @@
+"""Tiled (chunked) store for simulation feature data
+
+A tiled store splits each run/partition feature file into chunks of
+(cycle block X zone block X all metrics), so that both cycle-wide scans
+(readAllZonesInCycle) and zone-wide scans (readAllCyclesForZone) only touch a
+bounded number of bytes beyond what they return.
+
+Files are written to the tiles/ sub-directory of the data directory:
+    tiles_pXX_rYYY.npy: float32 chunks, each chunk stored cycle-major as a
+                        (# of cycles in block X # of zones in block X
+                        # of metrics) array
+    tiles_pXX_rYYY.idx: int64 chunk index, consisting of a header
+                        (see INDEX_HEADER), the sorted cycle #s, and the byte
+                        offset of every chunk in (cycle block, zone block) order
+
+Tiled stores are read by FeatureDataReader with backend='tiled' (see
+TiledBackend), or by TiledFeatureDataReader.
+"""
+
+from AtomicFile import atomicPath
+import numpy as np
+import os
+import sys
+from FeatureDataReader import FeatureDataReader
+from StorageBackend import StorageBackend, registerBackend
+
+INDEX_MAGIC = 0x454c4954  # 'TILE'
+INDEX_HEADER = ['magic', 'cycleBlock', 'zoneBlock', 'ncycles', 'nzones',
+                'nmetrics']
+
+
+def convertToTiled(dataDir, numParts, cycleBlock=256, zoneBlock=256,
+                   runs=None):
+    """Convert features/ + indexes/ layout of a data directory to tiled store
+
+    Args:
+        dataDir: data directory
+        numParts: # of partitions in mesh
+        cycleBlock: # of cycles per chunk
+        zoneBlock: # of zones per chunk
+        runs: list of simulation run #s (default is all runs in data directory)
+
+    Returns:
+        list of paths of tiled data files
+    """
+    reader = FeatureDataReader(dataDir, numParts, useMmap=True)
+    if runs is None:
+        runs = reader.getRuns()
+    if not os.path.isdir("%s/tiles" % dataDir):
+        os.makedirs("%s/tiles" % dataDir)
+
+    paths = []
+    for run in runs:
+        for part in range(0, numParts):
+            fmap = reader.getBackend('mmap').open(run, part)
+            cycles = reader._readFileIndex(run, part)['cycles']
+            rows = np.arange(len(fmap['data']))[fmap['order']]
+            (ncycles, nzones, nmetrics) = (len(rows),) + fmap['data'].shape[1:]
+
+            # the chunk index is published after the data file it points into
+            base = "%s/tiles/tiles_p%02d_r%03d" % (dataDir, part, run)
+            offsets = []
+            with atomicPath(base + '.npy') as tmp, open(tmp, 'wb') as fout:
+                for c in range(0, ncycles, cycleBlock):
+                    block = np.asarray(fmap['data'][rows[c:c+cycleBlock]])
+                    for z in range(0, nzones, zoneBlock):
+                        offsets.append(fout.tell())
+                        chunk = block[:, z:z+zoneBlock]
+                        np.ascontiguousarray(chunk).tofile(fout)
+
+            header = [INDEX_MAGIC, cycleBlock, zoneBlock, ncycles, nzones,
+                      nmetrics]
+            index = np.concatenate([np.asarray(header, dtype=np.int64), cycles,
+                                    np.asarray(offsets, dtype=np.int64)])
+            with atomicPath(base + '.idx') as tmp:
+                index.tofile(tmp)
+            paths.append(base + '.npy')
+    return paths
+
+
+class TiledBackend(StorageBackend):
+    """Storage backend for tiled stores
+
+    Only the chunks overlapping a slab are touched, and within each chunk only
+    the rows of the requested cycles are read
+
+    Attributes:
+        _tileIndex: cache content of chunk index files, one per run and
+                    partition (None if there is no tiled data file)
+    """
+
+    name = 'tiled'
+
+    def __init__(self, reader):
+        StorageBackend.__init__(self, reader)
+        self._tileIndex = {}
+
+
+    def open(self, run, part):
+        """Read chunk index and cache content into dictionary
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+
+        Returns:
+            Dictionary with header fields, sorted cycle #s, chunk offsets and
+            path of tiled data file, or None if there is no chunk index file
+        """
+        fname = 'tiles_p%02d_r%03d' % (part, run)
+        if fname not in self._tileIndex:
+            base = "%s/tiles/%s" % (self._reader._dataDir, fname)
+            tindex = None
+            if os.path.isfile(base + '.idx'):
+                raw = np.fromfile(base + '.idx', dtype=np.int64)
+                tindex = dict(zip(INDEX_HEADER,
+                                  map(int, raw[:len(INDEX_HEADER)])))
+                if tindex['magic'] != INDEX_MAGIC:
+                    raise IOError("Invalid chunk index file '%s.idx'." % base)
+
+                start = len(INDEX_HEADER)
+                tindex['cycles'] = raw[start:start+tindex['ncycles']]
+                tindex['offsets'] = raw[start+tindex['ncycles']:]
+                tindex['path'] = base + '.npy'
+            self._tileIndex[fname] = tindex
+        return self._tileIndex[fname]
+
+
+    def forget(self, run, part):
+        """Drop cached chunk index, which may have been rewritten"""
+        self._tileIndex.pop('tiles_p%02d_r%03d' % (part, run), None)
+
+
+    def metadata(self, run, part):
+        """Get layout of the data of a run and partition from chunk index"""
+        tindex = self._require(run, part)
+        return {'cycles': tindex['cycles'], 'nzones': tindex['nzones'],
+                'nmetrics': tindex['nmetrics']}
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop,
+                 mindex=None, out=None, cache=True):
+        """Read a rectangular slab of cycles and zones of a mesh partition"""
+        tindex = self._require(run, part)
+        (cb, zb) = (tindex['cycleBlock'], tindex['zoneBlock'])
+        (ncycles, nzones) = (tindex['ncycles'], tindex['nzones'])
+        nmetrics = tindex['nmetrics']
+        nzblocks = (nzones + zb - 1) // zb
+
+        out = self._allocate(run, part, (cycleStop - cycleStart,
+                                         zoneStop - zoneStart), mindex, out)
+        fin = self._reader._openFile(tindex['path'])
+        for cblock in range(cycleStart // cb, (cycleStop - 1) // cb + 1):
+            c0 = cblock * cb
+            c1 = min(c0 + cb, ncycles)
+            (lo, hi) = (max(c0, cycleStart), min(c1, cycleStop))
+            for zblock in range(zoneStart // zb, (zoneStop - 1) // zb + 1):
+                z0 = zblock * zb
+                width = min(z0 + zb, nzones) - z0
+                rowBytes = width * nmetrics * 4
+
+                offset = tindex['offsets'][cblock * nzblocks + zblock]
+                fin.seek(offset + (lo - c0) * rowBytes)
+                chunk = np.empty((hi - lo, width, nmetrics), dtype=np.float32)
+                self._readInto(fin, chunk)
+
+                (zlo, zhi) = (max(z0, zoneStart), min(z0 + width, zoneStop))
+                out[lo-cycleStart:hi-cycleStart, zlo-zoneStart:zhi-zoneStart] = \
+                    self._selectMetrics(chunk[:, zlo-z0:zhi-z0], mindex)
+        return out
+
+
+registerBackend(TiledBackend.name, TiledBackend)
+
+
+class TiledFeatureDataReader(FeatureDataReader):
+    """Reader for simulation feature data stored as a tiled store
+
+    Equivalent to FeatureDataReader with backend='tiled'; zone ids and metric
+    names are still read from the meta data files in features/
+    """
+
+    def __init__(self, dataDir, numParts=None, maxOpenFiles=64, numThreads=1):
+        """Class constructor
+
+        Args:
+            dataDir: data directory
+            numParts: # of partitions in mesh (default is taken from the
+                      catalog of the data directory)
+            maxOpenFiles: maximum # of file handles kept open between reads
+            numThreads: # of threads used to read partitions concurrently
+        """
+        FeatureDataReader.__init__(self, dataDir, numParts,
+                                   maxOpenFiles=maxOpenFiles,
+                                   numThreads=numThreads, backend='tiled')
+
+
+    def readSlab(self, run, part, cycleStart, cycleStop, zoneStart, zoneStop):
+        """Read a rectangular slab of cycles and zones of a mesh partition
+
+        Args:
+            run: simulation run #
+            part: mesh partition #
+            cycleStart: position of first cycle (in sorted cycle order)
+            cycleStop: position one past last cycle
+            zoneStart: offset of first zone within partition
+            zoneStop: offset one past last zone
+
+        Returns:
+            3D numpy array of shape
+            (# of cycles in slab X # of zones in slab X # of metrics)
+        """
+        return self._backend.readSlab(run, part, cycleStart, cycleStop,
+                                      zoneStart, zoneStop)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print 'Usage: TiledFeatureStore.py dataDir numParts [cycleBlock zoneBlock]'
+        sys.exit(1)
+
+    blocks = [int(size) for size in sys.argv[3:5]] or [256, 256]
+    for path in convertToTiled(sys.argv[1], int(sys.argv[2]), *blocks):
+        print path
@@ -0,0 +1,212 @@
+"""Zone adjacency graph of the simulation mesh
+
+The mesh viewer files (meshviewer/meshRR_cycleCCCCC.json, one per rank) list
+the zones of a rank with the ids of their nodes (nids) and the positions of
+those nodes.  Node ids are global, so nodes on rank boundaries appear in the
+files of several ranks; stitching the ranks together by node id yields the
+global zone graph, in which two zones are adjacent if they share at least one
+node.  The graph of the mesh of a cycle is stored in compressed sparse row
+(CSR) form as
+    meshDir/zonegraph_cycleCCCCC.npz
+and loaded from there afterwards, so the JSON files are parsed only once.
+"""
+
+from AtomicFile import atomicPath
+import glob
+import json
+import numpy as np
+import os
+import re
+import scipy.sparse
+import sys
+
+# graph file of the mesh of a cycle
+GRAPH_FILE = 'zonegraph_cycle%05d.npz'
+
+# mesh viewer files that ship with these scripts
+MESH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'meshviewer')
+
+
+class ZoneGraph(object):
+    """Zone adjacency of the mesh as CSR arrays
+
+    Row i of the graph is zone zones[i]; its neighbours are
+    zones[indices[indptr[i]:indptr[i+1]]], each of which shares
+    shared[indptr[i]:indptr[i+1]] nodes with it (1 for zones touching at a
+    corner, 2 for zones sharing a side of a quadrilateral mesh)
+
+    Attributes:
+        zones: sorted 1D numpy int32 array of zone ids
+        indptr: 1D numpy int32 array of row offsets into indices
+        indices: 1D numpy int32 array of rows of neighbours
+        shared: 1D numpy int8 array of # of nodes shared with each neighbour
+        centroids: 2D numpy float64 array of shape (# of zones X 2) with the
+                   mean position of the nodes of each zone
+    """
+
+    def __init__(self, meshDir=MESH_DIR, cycle=0, rebuild=False):
+        """Class constructor, loads (or builds) the graph
+
+        The graph is rebuilt whenever a mesh viewer file is newer than it
+
+        Args:
+            meshDir: directory of mesh viewer files
+            cycle: simulation cycle # of mesh viewer files to read
+            rebuild: rebuild graph even if it is up to date
+        """
+        path = "%s/%s" % (meshDir, GRAPH_FILE % cycle)
+        sources = _getMeshFiles(meshDir, cycle)
+        if (rebuild or not os.path.isfile(path) or
+                any([os.path.getmtime(source) > os.path.getmtime(path)
+                     for source in sources])):
+            arrays = buildZoneGraph(meshDir, cycle)
+        else:
+            with np.load(path) as npz:
+                arrays = dict(npz.items())
+        for name in ('zones', 'indptr', 'indices', 'shared', 'centroids'):
+            setattr(self, name, arrays[name])
+
+
+    def __len__(self):
+        return len(self.zones)
+
+
+    def getRows(self, zones):
+        """Get rows of the graph of zone ids
+
+        Args:
+            zones: mesh zone id or 1D array-like of zone ids
+
+        Returns:
+            row or 1D numpy array of rows
+
+        Raises:
+            KeyError: if any zone id is not in the mesh
+        """
+        rows = np.minimum(np.searchsorted(self.zones, zones),
+                          len(self.zones) - 1)
+        found = self.zones[rows] == zones
+        if not np.all(found):
+            raise KeyError(np.asarray(zones)[~found] if np.ndim(zones)
+                           else zones)
+        return rows
+
+
+    def getNeighbors(self, zone, minShared=1):
+        """Get ids of the neighbours of a zone
+
+        Args:
+            zone: mesh zone id
+            minShared: minimum # of nodes a neighbour shares with the zone
+
+        Returns:
+            sorted 1D numpy int32 array of zone ids
+        """
+        row = self.getRows(zone)
+        span = slice(self.indptr[row], self.indptr[row+1])
+        return self.zones[self.indices[span][self.shared[span] >= minShared]]
+
+
+    def getAdjacency(self, minShared=1):
+        """Get adjacency matrix of the graph
+
+        Args:
+            minShared: minimum # of nodes two zones share to be adjacent
+
+        Returns:
+            scipy.sparse.csr_matrix of shape (# of zones X # of zones) with
+            the # of shared nodes of adjacent zones as values
+        """
+        graph = scipy.sparse.csr_matrix((self.shared, self.indices,
+                                         self.indptr),
+                                        shape=(len(self.zones),) * 2)
+        if minShared > 1:
+            graph = graph.copy()
+            graph.data[graph.data < minShared] = 0
+            graph.eliminate_zeros()
+        return graph
+
+
+def buildZoneGraph(meshDir=MESH_DIR, cycle=0):
+    """Build the zone graph from the mesh viewer files of all ranks
+
+    Failure to write the graph file (e.g. read-only directory) is not an
+    error; the graph is still returned
+
+    Args:
+        meshDir: directory of mesh viewer files
+        cycle: simulation cycle # of mesh viewer files to read
+
+    Returns:
+        Dictionary of graph arrays (see ZoneGraph attributes)
+
+    Raises:
+        IOError: if there are no mesh viewer files
+        ValueError: if ranks disagree on the position of a shared node
+    """
+    sources = _getMeshFiles(meshDir, cycle)
+    if not sources:
+        raise IOError("No mesh viewer files for cycle %d in '%s'." % (cycle,
+                                                                      meshDir))
+    (zones, zoneNodes, nodes, positions) = ([], [], [], [])
+    for source in sources:
+        with open(source, 'r') as fin:
+            mesh = json.load(fin)
+        for (zone, value) in mesh['zones'].items():
+            zones.append(int(zone))
+            zoneNodes.append(value['nids'])
+        for (node, value) in mesh['nodes'].items():
+            nodes.append(int(node))
+            positions.append(value['pos'])
+
+    # deduplicate zones and nodes that appear on several ranks
+    (zones, first) = np.unique(zones, return_index=True)
+    zoneNodes = [zoneNodes[i] for i in first]
+    (nodes, inverse) = np.unique(nodes, return_inverse=True)
+    positions = np.asarray(positions, dtype=np.float64)
+    nodePositions = np.empty((len(nodes), positions.shape[1]))
+    nodePositions[inverse] = positions
+    if not np.allclose(nodePositions[inverse], positions):
+        raise ValueError("Ranks disagree on node positions in '%s'." % meshDir)
+
+    # zones X nodes incidence matrix, whose product with its transpose counts
+    # the nodes shared by every pair of zones
+    counts = np.array([len(nids) for nids in zoneNodes])
+    columns = np.searchsorted(nodes, np.concatenate(zoneNodes))
+    incidence = scipy.sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.int32), columns,
+         np.concatenate(([0], np.cumsum(counts)))),
+        shape=(len(zones), len(nodes)))
+    graph = (incidence * incidence.T).tocsr()
+    graph.setdiag(0)
+    graph.eliminate_zeros()
+    graph.sort_indices()
+    centroids = (incidence * nodePositions) / counts[:, np.newaxis]
+
+    arrays = {'zones': zones.astype(np.int32),
+              'indptr': graph.indptr.astype(np.int32),
+              'indices': graph.indices.astype(np.int32),
+              'shared': graph.data.astype(np.int8), 'centroids': centroids}
+    path = "%s/%s" % (meshDir, GRAPH_FILE % cycle)
+    try:
+        with atomicPath(path) as tmp, open(tmp, 'wb') as fout:
+            np.savez(fout, **arrays)
+    except (IOError, OSError):
+        pass
+    return arrays
+
+
+def _getMeshFiles(meshDir, cycle):
+    """Get sorted paths of the mesh viewer files of all ranks for a cycle"""
+    pattern = re.compile(r'mesh\d+_cycle%05d\.json$' % cycle)
+    return sorted([path for path in glob.glob("%s/mesh*.json" % meshDir)
+                   if pattern.match(os.path.basename(path))])
+
+
+if __name__ == '__main__':
+    meshDir = sys.argv[1] if len(sys.argv) > 1 else MESH_DIR
+    graph = ZoneGraph(meshDir, rebuild=True)
+    degrees = np.diff(graph.indptr)
+    print "%d zones, %d adjacent pairs, %d to %d neighbours per zone" % (
+        len(graph), len(graph.indices) // 2, degrees.min(), degrees.max())
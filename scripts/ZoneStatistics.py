@@ -0,0 +1,339 @@
+"""Per-zone summary statistics of simulation runs
+
+For every (run, zone, metric), the statistics sidecar holds the minimum and
+maximum over all cycles of the run, the cycle #s at which they are first
+reached, the mean, the (population) standard deviation and the values of the
+first and last cycle.  The sidecar of a run is built in one pass over its
+feature data, reading slabs of many cycles of a partition at once and reducing
+them with vectorized numpy operations, and stored as
+    dataDir/stats/zonestats_rYYY.npy
+a structured array of shape (# of zones in mesh X # of metrics) whose rows
+are in the order of FeatureDataReader.getCycleZoneIds.  Cycles appended to a
+run later are merged into its sidecar without reading the earlier ones again
+(see refreshZoneStats).  Reports that used to
+loop over every cycle of every zone (e.g. the run*.csv files of
+RebeccaScripts/TotalAnalysis1) are then a lookup in the sidecar.
+"""
+
+from AtomicFile import atomicPath
+import numpy as np
+import os
+import sys
+from FeatureDataReader import FeatureDataReader
+
+STATS = ('min', 'max', 'argmin', 'argmax', 'mean', 'std', 'first', 'last')
+
+ZONE_STATS_DTYPE = np.dtype([('count', np.int64), ('min', np.float64),
+                             ('max', np.float64), ('argmin', np.int64),
+                             ('argmax', np.int64), ('mean', np.float64),
+                             ('std', np.float64), ('first', np.float64),
+                             ('last', np.float64)])
+
+# columns of the run*.csv reports of RebeccaScripts/TotalAnalysis1
+REPORT_COLUMNS = [('oddy', 'max'), ('oddy', 'argmax'),
+                  ('conditionNumber', 'max'), ('conditionNumber', 'argmax'),
+                  ('aspectRatio', 'max'), ('aspectRatio', 'argmax'),
+                  ('taper', 'max'), ('taper', 'argmax'),
+                  ('largestAngle', 'max'), ('largestAngle', 'argmax'),
+                  ('shape', 'min'), ('shape', 'argmin'),
+                  ('shapeAndSize', 'min'), ('shapeAndSize', 'argmin'),
+                  ('shear', 'min'), ('shear', 'argmin'),
+                  ('shearAndSize', 'min'), ('shearAndSize', 'argmin')]
+
+
+def buildZoneStats(reader, run, cyclesPerChunk=256):
+    """Compute summary statistics of all zones and metrics of a run
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        cyclesPerChunk: # of cycles of a partition read and reduced at once
+
+    Returns:
+        structured numpy array of dtype ZONE_STATS_DTYPE and shape
+        (# of zones in mesh X # of metrics)
+    """
+    backend = reader.getBackend()
+    nmetrics = len(reader.getMetricNames())
+    parts = [backend.metadata(run, part)
+             for part in range(0, reader._numParts)]
+    stats = np.zeros((sum([meta['nzones'] for meta in parts]), nmetrics),
+                     dtype=ZONE_STATS_DTYPE)
+
+    start = 0
+    for (part, meta) in enumerate(parts):
+        (cycles, nzones) = (meta['cycles'], meta['nzones'])
+        rows = stats[start:start+nzones]
+        buf = np.empty((min(cyclesPerChunk, len(cycles)), nzones, nmetrics),
+                       dtype=np.float32)
+        for first in range(0, len(cycles), cyclesPerChunk):
+            last = min(first + cyclesPerChunk, len(cycles))
+            data = backend.readSlab(run, part, first, last, 0, nzones, None,
+                                    buf[:last-first], cache=False)
+            _mergeChunk(rows, data, cycles[first:last])
+        start += nzones
+    return stats
+
+
+def _mergeChunk(stats, data, cycles):
+    """Merge the statistics of a chunk of consecutive cycles into statistics
+
+    Means and variances are combined with the pairwise update of Chan et al.,
+    so chunks can be merged in any number and size without loss of precision
+
+    Args:
+        stats: structured array of dtype ZONE_STATS_DTYPE and shape
+               (# of zones X # of metrics), updated in place; rows with a
+               count of 0 hold no statistics yet
+        data: 3D numpy array of shape (# of cycles X # of zones X # of
+              metrics) of cycles following those already in stats
+        cycles: 1D numpy array of the cycle #s of data
+    """
+    if len(cycles) == 0:
+        return
+    data = data.astype(np.float64)
+    (na, nb) = (stats['count'], len(cycles))
+    empty = (na == 0)
+
+    lo = data.argmin(axis=0)
+    hi = data.argmax(axis=0)
+    chunkMin = data.min(axis=0)
+    chunkMax = data.max(axis=0)
+    chunkMean = data.mean(axis=0)
+    chunkM2 = np.square(data - chunkMean).sum(axis=0)
+
+    # strict comparisons keep the first cycle at which an extreme is reached
+    better = empty | (chunkMin < stats['min'])
+    stats['min'] = np.where(better, chunkMin, stats['min'])
+    stats['argmin'] = np.where(better, cycles[lo], stats['argmin'])
+    better = empty | (chunkMax > stats['max'])
+    stats['max'] = np.where(better, chunkMax, stats['max'])
+    stats['argmax'] = np.where(better, cycles[hi], stats['argmax'])
+
+    n = na + nb
+    delta = chunkMean - stats['mean']
+    m2 = (np.square(stats['std']) * na + chunkM2 +
+          np.square(delta) * na * nb / n)
+    stats['mean'] = stats['mean'] + delta * nb / n
+    stats['std'] = np.sqrt(m2 / n)
+    stats['first'] = np.where(empty, data[0], stats['first'])
+    stats['last'] = data[-1]
+    stats['count'] = n
+
+
+def getZoneStatsPath(dataDir, run):
+    """Get path of the statistics sidecar of a run"""
+    return "%s/stats/zonestats_r%03d.npy" % (dataDir, run)
+
+
+def writeZoneStats(reader, run, cyclesPerChunk=256):
+    """Build the statistics sidecar of a run
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        cyclesPerChunk: # of cycles of a partition read and reduced at once
+
+    Returns:
+        path of sidecar
+    """
+    stats = buildZoneStats(reader, run, cyclesPerChunk)
+    path = getZoneStatsPath(reader._dataDir, run)
+    saveStats(path, stats)
+    return path
+
+
+def saveStats(path, stats):
+    """Write a statistics sidecar atomically, creating its directory
+
+    Args:
+        path: path of sidecar
+        stats: numpy array to store
+    """
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with atomicPath(path) as tmp, open(tmp, 'wb') as fout:
+        np.save(fout, stats)
+
+
+def appendStats(path, rows):
+    """Append rows to a statistics sidecar in place
+
+    Only the new rows and the array header (with the new # of rows) are
+    written; the whole sidecar is rewritten if the new header does not fit
+    into the space of the old one
+
+    Args:
+        path: path of sidecar
+        rows: numpy array of the dtype and trailing shape of the sidecar
+    """
+    with open(path, 'r+b') as fio:
+        version = np.lib.format.read_magic(fio)
+        if version == (1, 0):
+            (shape, fortran, dtype) = np.lib.format.read_array_header_1_0(fio)
+            if (fortran or dtype != rows.dtype or
+                    tuple(shape[1:]) != rows.shape[1:]):
+                raise ValueError("Rows do not match sidecar '%s'." % path)
+            headerBytes = fio.tell()
+            header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+                np.lib.format.dtype_to_descr(dtype),
+                (shape[0] + len(rows),) + tuple(shape[1:]))
+            pad = headerBytes - 11 - len(header)
+            if pad >= 0:
+                fio.seek(headerBytes + int(np.prod(shape)) * dtype.itemsize)
+                fio.write(np.ascontiguousarray(rows).tostring())
+                fio.truncate()
+                fio.seek(10)
+                fio.write(header + ' ' * pad + '\n')
+                return
+    saveStats(path, np.concatenate((np.load(path), rows)))
+
+
+def loadZoneStats(reader, run):
+    """Load the statistics sidecar of a run, building it if needed
+
+    The sidecar is rebuilt whenever it is older than a file index of the run,
+    i.e. when cycles may have been added since it was built
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+
+    Returns:
+        memory-mapped structured array of dtype ZONE_STATS_DTYPE and shape
+        (# of zones in mesh X # of metrics)
+    """
+    path = getZoneStatsPath(reader._dataDir, run)
+    if not os.path.isfile(path) or isStale(reader, run, path):
+        refreshZoneStats(reader, run)
+    return np.load(path, mmap_mode='r')
+
+
+def refreshZoneStats(reader, run, cyclesPerChunk=256):
+    """Extend the statistics sidecar of a run by cycles appended since
+
+    Only the new cycles are read, and merged into the statistics of the
+    earlier ones; the sidecar is rebuilt if it does not exist or the new
+    cycles do not follow the earlier ones (checked against the last value of
+    every zone)
+
+    Args:
+        reader: FeatureDataReader (refreshed first, see
+                FeatureDataReader.refresh)
+        run: simulation run #
+        cyclesPerChunk: # of cycles of a partition read and reduced at once
+
+    Returns:
+        path of sidecar
+    """
+    reader.refresh()
+    path = getZoneStatsPath(reader._dataDir, run)
+    if not os.path.isfile(path):
+        return writeZoneStats(reader, run, cyclesPerChunk)
+    stats = np.load(path)
+    backend = reader.getBackend()
+
+    (start, changed) = (0, False)
+    for part in range(0, reader._numParts):
+        meta = backend.metadata(run, part)
+        (cycles, nzones) = (meta['cycles'], meta['nzones'])
+        rows = stats[start:start+nzones]
+        start += nzones
+        count = int(rows['count'].min()) if rows.size else len(cycles)
+        if count == len(cycles):
+            continue
+        if count > len(cycles) or (count and not np.array_equal(
+                backend.readSlab(run, part, count-1, count, 0, nzones)[0],
+                rows['last'])):
+            return writeZoneStats(reader, run, cyclesPerChunk)
+        for first in range(count, len(cycles), cyclesPerChunk):
+            last = min(first + cyclesPerChunk, len(cycles))
+            data = backend.readSlab(run, part, first, last, 0, nzones,
+                                    cache=False)
+            _mergeChunk(rows, data, cycles[first:last])
+        changed = True
+    if changed:
+        saveStats(path, stats)
+    return path
+
+
+def isStale(reader, run, path):
+    """Check whether a statistics sidecar is older than any run file index"""
+    mtime = os.path.getmtime(path)
+    for part in range(0, reader._numParts):
+        index = "%s/indexes/indexes_p%02d_r%03d.txt" % (reader._dataDir, part,
+                                                        run)
+        if os.path.isfile(index) and os.path.getmtime(index) > mtime:
+            return True
+    return False
+
+
+def queryZoneStats(reader, run, columns, zones=None):
+    """Get summary statistics of zones of a run
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        columns: list of (metric, statistic) pairs, where metric is a metric
+                 name or index and statistic is one of STATS
+        zones: 1D array-like of mesh zone ids (default is all zones, in the
+               order of getCycleZoneIds)
+
+    Returns:
+        2D numpy float64 array of shape (# of zones X # of columns); argmin
+        and argmax columns hold cycle #s
+    """
+    for (metric, stat) in columns:
+        if stat not in STATS:
+            raise ValueError("Unknown statistic '%s'." % stat)
+    mindex = reader.getMetricIndexes([metric for (metric, stat) in columns])
+    stats = loadZoneStats(reader, run)
+    if zones is not None:
+        (parts, offsets) = reader.lookupZones(np.asarray(zones))
+        starts = np.cumsum([0] + [len(reader.getPartitionZoneIds(part))
+                                  for part in range(0, reader._numParts)])
+        stats = stats[starts[parts] + offsets]
+
+    result = np.empty((len(stats), len(columns)), dtype=np.float64)
+    for (i, (m, (metric, stat))) in enumerate(zip(mindex, columns)):
+        result[:, i] = stats[stat][:, m]
+    return result
+
+
+def writeZoneReport(reader, run, path, columns=REPORT_COLUMNS, zones=None):
+    """Write a CSV report of summary statistics of zones of a run
+
+    Args:
+        reader: FeatureDataReader
+        run: simulation run #
+        path: path of CSV file
+        columns: list of (metric, statistic) pairs (default is the columns of
+                 the run*.csv reports of RebeccaScripts/TotalAnalysis1)
+        zones: 1D array-like of mesh zone ids (default is all zones)
+    """
+    if zones is None:
+        zones = reader.getCycleZoneIds()
+    result = queryZoneStats(reader, run, columns, zones)
+    names = reader.getMetricNames()
+    mindex = reader.getMetricIndexes([metric for (metric, stat) in columns])
+    header = ['zoneID'] + ['%s_%s' % (names[m], stat)
+                           for (m, (metric, stat)) in zip(mindex, columns)]
+    with open(path, 'w') as fout:
+        fout.write(','.join(header) + '\n')
+        for (zone, row) in zip(zones, result):
+            values = [str(int(v)) if stat.startswith('arg') else repr(v)
+                      for (v, (metric, stat)) in zip(row, columns)]
+            fout.write(','.join([str(zone)] + values) + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print 'Usage: ZoneStatistics.py dataDir run [report.csv]'
+        sys.exit(1)
+
+    reader = FeatureDataReader(sys.argv[1])
+    run = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        writeZoneReport(reader, run, sys.argv[3])
+    else:
+        print writeZoneStats(reader, run)
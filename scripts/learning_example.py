@@ -1,8 +1,11 @@
 #!usr/bin/env python
 
 import cPickle
+from DatasetCatalog import loadCatalog
+from FailureCatalog import FailureCatalog
 from FeatureDataReader import FeatureDataReader
-import glob
+from FeatureSampler import sampleInstances
+from NeighborFeatures import AGGREGATES, NeighborFeatures, getFeatureNames
 import numpy as np
 from numpy import isinf, mean, std
 import os
@@ -12,6 +15,7 @@ from scipy.spatial.distance import euclidean
 from sklearn.ensemble.forest import RandomForestRegressor
 import sys
 import time
+from ZoneGraph import MESH_DIR, ZoneGraph
 
 
 #===============================================================================
@@ -31,11 +35,18 @@ start_cycle = 0   # start sampling "good" zones at this cycle
 #end_cycle = 0    # only sample "good" from cycle 0
 end_cycle = -1    # stop sampling "good" zones at this cycle (-1 means train all cycles from run 0 - decay_window)
 sample_freq = 1000 # how frequently to sample "good" zones
+good_sample_size = 0 # if > 0, sample this many "good" (cycle,zone) instances uniformly at
+                     # random from all good cycles instead of every sample_freq-th cycle in full
 #decay_window = 1000 # how many cycles back does decay function go for failed (zone,cycle)
 decay_window = 100 # how many cycles back does decay function go for failed (zone,cycle)
 load_learning_data = False  # if true, load pre-created learning data
                             # other wise, load raw simulation data and
                             # calculate learning data on-the-fly
+neighbor_metrics = [] # metrics whose aggregates over the neighbours of a zone are added
+                      # as features, e.g. ['oddy', 'shape'] (see NeighborFeatures)
+neighbor_aggregates = AGGREGATES # neighbour aggregates of each of neighbor_metrics
+neighbor_min_shared = 1 # minimum number of nodes neighbours share (2 = only zones sharing a side)
+mesh_dir = MESH_DIR # mesh viewer files the zone graph is built from
 
 # random forest configuration
 NumTrees = 1000
@@ -70,12 +81,11 @@ def get_reader(data_dir):
 #===============================================================================
 
 #
-# Looks at directory structure and returns the number of partition index files.
+# Returns the number of partitions recorded in the catalog of the data directory.
 #
 def get_num_partitions(data_dir):
 
-    files = glob.glob("%s/indexes/indexes_p*_r000.txt" % data_dir)
-    return len(files)
+    return loadCatalog(data_dir)['numParts']
 
 #
 # Get features names in order they appear in feature vectors
@@ -89,6 +99,56 @@ def get_feature_names(data_dir):
 
   return feature_name_cache
 
+#
+# Get names of the neighbour features in order they appear in feature vectors
+# (after the features of get_feature_names)
+#
+def get_neighbor_feature_names():
+  return getFeatureNames(neighbor_metrics, neighbor_aggregates)
+
+#
+# Returns the neighbour feature engine for the zones of a data directory,
+# whose zone graph is built (or loaded) once.
+#
+neighbor_engines = {}
+def get_neighbor_engine(data_dir):
+
+    global neighbor_engines
+
+    key = (data_dir, mesh_dir, neighbor_min_shared)
+    if key not in neighbor_engines:
+        reader = get_reader(data_dir)
+        neighbor_engines[key] = NeighborFeatures(ZoneGraph(mesh_dir), reader.getCycleZoneIds(), neighbor_min_shared)
+
+    return neighbor_engines[key]
+
+#
+# Returns an (N x F) array of neighbour features (see get_neighbor_feature_names)
+# of N (run,cycle,zone) instances given as arrays runs and index of (cycle,zone_id)
+# pairs. Neighbour aggregates are computed for the full mesh of each distinct
+# (run,cycle) at once and the rows of the requested zones taken from them.
+#
+def get_neighbor_features(data_dir, runs, index):
+    reader = get_reader(data_dir)
+    engine = get_neighbor_engine(data_dir)
+
+    out = np.empty((len(index), len(get_neighbor_feature_names())))
+    if len(index) == 0:
+        return out
+    (cycles, zones) = np.asarray(index, dtype=np.int64).T
+    rows = engine.getRows(zones)
+
+    # group instances by (run,cycle)
+    (pairs, inverse) = np.unique(np.column_stack((runs, cycles)), axis=0, return_inverse=True)
+    groups = np.split(np.argsort(inverse, kind='mergesort'), np.cumsum(np.bincount(inverse))[:-1])
+
+    buf = None
+    for ((run, cycle), group) in zip(pairs, groups):
+        buf = reader.readAllZonesInCycle(run, cycle, neighbor_metrics, out=buf)
+        out[group] = engine.compute(buf, neighbor_aggregates)[rows[group]]
+
+    return out
+
 
 #
 # Returns a pair (index,data) where:
@@ -96,21 +156,31 @@ def get_feature_names(data_dir):
 #  - data is a 2d numpy array of (N instances x F features)
 #
 # cycles - list of cycles to include
+# out - optional (N x F) array to read data into, e.g. rows and columns of a
+#       larger matrix; if it is not a contiguous float32 array, each cycle is
+#       read through a single reused buffer
 #
-def get_learning_data_with_index_for_cycle_range(data_dir, cycles, run):
+def get_learning_data_with_index_for_cycle_range(data_dir, cycles, run, out=None):
     reader = get_reader(data_dir)
 
-    index_list = []
-    data_list = []
-    for cycle in cycles:
-        zone_ids = reader.getCycleZoneIds()
-        index = zip([cycle]*len(zone_ids), zone_ids)
-        data = reader.readAllZonesInCycle(run, cycle)
+    zone_ids = reader.getCycleZoneIds()
+    num_zones = len(zone_ids)
+    if out is None:
+        out = np.empty((len(cycles)*num_zones, len(get_feature_names(data_dir))), dtype=np.float32)
+    direct = (out.dtype == np.float32 and out.flags.c_contiguous)
 
-        index_list = index_list + index
-        data_list.append(data)
+    index_list = []
+    buf = None
+    for (i, cycle) in enumerate(cycles):
+        index_list.extend(zip([cycle]*num_zones, zone_ids))
+        rows = out[i*num_zones:(i+1)*num_zones]
+        if direct:
+            reader.readAllZonesInCycle(run, cycle, out=rows)
+        else:
+            buf = reader.readAllZonesInCycle(run, cycle, out=buf)
+            rows[...] = buf
 
-    return (index_list, np.concatenate(data_list, axis=0))
+    return (index_list, out)
 
 
 #
@@ -124,47 +194,18 @@ def decay(decay_function, step, num_steps):
 #
 # return [failures, failed_cycles] where:
 #
-# failures is a list of (part, run, cycle, zone) tuples
-# failued_cycles is a list containing only the cycles
+# failures is a structured numpy array with (part, run, cycle, zone, kind)
+# records (see FailureCatalog)
+# failued_cycles is a numpy array containing only the cycles
 def get_failures(data_dir):
-    # read failure data
-    filenames = []
-    partitions = range(get_num_partitions(data_dir))
-    for pnum in partitions:
-        filenames.append("%s/failures/side_p%02d" % (data_dir, pnum))
-        filenames.append("%s/failures/corner_p%02d" % (data_dir, pnum))
-
-    failures = []
-    failed_cycles = []
-    for file in filenames:
-        if os.path.isfile(file):
-            print "Reading file: ", file
-
-            name,part = file.split("_p")
-
-            with open(file, "r") as fin:
-                state = 0
-                for line in fin:
-                    vals = line.split(",")
-
-                    if vals[0] == "Run":
-                        state = 1
-                    elif vals[0] == "volume":
-                        state = 2
-                    else:
-                        if state == 1:
-                            part = int(part)
-                            run = int(vals[0])
-                            cycle = int(vals[1])
-                            zone = int(vals[2])
-
-                            failures.append((part, run, cycle, zone))
-                            failed_cycles.append(int(cycle))
+    # read failure data from the binary failure catalog, which is built from
+    # the failure files on first use
+    failures = np.asarray(FailureCatalog(data_dir).failures)
 
     if len(failures) < 1:
         raise IOError("No failure data found in data directory '%s'." % (data_dir))
 
-    return [failures, failed_cycles]
+    return [failures, failures['cycle']]
 
 
 #
@@ -193,7 +234,7 @@ def get_learning_data_for_run(data_dir, start_cycle, end_cycle, sample_freq, dec
 
     # cache learning data in memory to improve run time
     global learning_data_cache
-    key = ":".join([ data_dir, str(start_cycle), str(end_cycle), str(sample_freq), str(decay_window), str(run_for_good_zones), str(num_failures) ])
+    key = ":".join([ data_dir, str(start_cycle), str(end_cycle), str(sample_freq), str(decay_window), str(run_for_good_zones), str(num_failures), str(good_sample_size), str(get_neighbor_feature_names()) ])
     if num_failures < 0 and key in learning_data_cache:
       return learning_data_cache[key] 
 
@@ -216,79 +257,75 @@ def get_learning_data_for_run(data_dir, start_cycle, end_cycle, sample_freq, dec
     if sample_freq == 0:
         # don't include any "good" examples
         candidate_cycles = []
+    elif good_sample_size > 0:
+        # sample instances from all cycles below
+        candidate_cycles = range(start_cycle, end_cycle+1)
     else:
         candidate_cycles = range(start_cycle, end_cycle+1, sample_freq)
 
 
-    # remove cycles in range of failures from sample cycles
-    good_cycles = []
-    for candidate_cycle in candidate_cycles:
-        candidate_is_good = True
-        for bad_cycle in failed_cycles:
-            if candidate_cycle <= bad_cycle and candidate_cycle > (bad_cycle - decay_window):
-                candidate_is_good = False
-                break
-
-        if candidate_is_good:
-            good_cycles.append(candidate_cycle)
+    # remove cycles in range of failures from sample cycles: a candidate cycle
+    # is bad if the first failed cycle at or after it is within decay_window
+    bad_cycles = np.unique(failed_cycles)
+    candidates = np.asarray(candidate_cycles, dtype=np.int64)
+    next_bad = np.minimum(np.searchsorted(bad_cycles, candidates), len(bad_cycles)-1)
+    in_window = (candidates <= bad_cycles[next_bad]) & (candidates > bad_cycles[next_bad] - decay_window)
+    good_cycles = candidates[~in_window].tolist()
 
-    # read data for sample of good zones
-    (index_good,good_zones) = get_learning_data_with_index_for_cycle_range(data_dir, good_cycles, run_for_good_zones)
-    if good_zones is None:
-        Y_good = None
+    # index sample of good zones (data is read below, once the matrix is sized)
+    if good_sample_size > 0 and len(good_cycles) > 0:
+        (sampled_zones,sample_index) = sampleInstances(reader, good_sample_size, runs=[run_for_good_zones], cycles=good_cycles, seed=rand_seed)
+        index_good = zip(sample_index[:,1], sample_index[:,2])
     else:
-        Y_good = [0] * good_zones.shape[0]
+        sampled_zones = None
+        zone_ids = reader.getCycleZoneIds()
+        index_good = [(cycle,zone_id) for cycle in good_cycles for zone_id in zone_ids]
+    Y_good = [0] * len(index_good)
 
     # sample failures
     # choose 'num_failures' failures uniformly at random
     if (num_failures > -1 and num_failures < len(failures)):
-        random.shuffle(failures)
-        failures = failures[0:num_failures]
+        order = range(len(failures))
+        random.shuffle(order)
+        failures = failures[order[0:num_failures]]
 
-    # read data for bad zones
+    # index bad zones
     # assign weights to failures based on function 'decay'
-    bad_zones_list = []
-    Y_bad = []
-    index_bad = []
-    for fail in failures:
-        [pnum, run, fail_cycle, zone] = fail
-        weight = 1.0
-        for step in range(decay_window):
-
-            cycle = fail_cycle - step
-            data = reader.readZone(run, cycle, zone)
-            weight = decay('linear', step, decay_window)
-
-            bad_zones_list.append(data.reshape(1,len(data)))
-            Y_bad.append(weight)
-            index_bad.append((cycle,zone))
-
-    bad_zones = np.concatenate(bad_zones_list, axis=0)
+    # each failure contributes cycles fail_cycle, fail_cycle-1, ... going back decay_window cycles
+    weights = [decay('linear', step, decay_window) for step in range(decay_window)]
+    bad_runs = np.repeat(failures['run'], decay_window)
+    bad_zone_cycles = np.repeat(failures['cycle'], decay_window) - np.tile(np.arange(decay_window), len(failures))
+    bad_zones = np.repeat(failures['zone'], decay_window)
+    Y_bad = weights * len(failures)
+    index_bad = zip(bad_zone_cycles.tolist(), bad_zones.tolist())
 
     # combine good and bad zones
-    if bad_zones is None:
-        X = good_zones
-        Y_list = Y_good
-        index = index_good
-    elif good_zones is None:
-        X = bad_zones
-        Y_list = Y_bad
-        index = index_bad
-    else:
-        X = np.vstack((good_zones, bad_zones))
-        Y_list = Y_good + Y_bad
-        index = index_good + index_bad
-
-    Y = np.array(Y_list).reshape(len(Y_list),1)
+    index = index_good + index_bad
+    Y_list = Y_good + Y_bad
 
     # hook for adding additional features
     new_features = add_features(index)
-    X = np.hstack((X, new_features))
 
-    # combine X and Y
-    XY = np.hstack((X,Y))
+    # size the learning data matrix (features, neighbour features, new
+    # features, label) up front and read good and bad zones straight into its rows
+    num_good = len(index_good)
+    num_features = len(get_feature_names(data_dir))
+    num_neighbor_features = len(get_neighbor_feature_names())
+    XY = np.empty((len(index), num_features + num_neighbor_features + new_features.shape[1] + 1))
+    if sampled_zones is None:
+        get_learning_data_with_index_for_cycle_range(data_dir, good_cycles, run_for_good_zones, out=XY[:num_good,:num_features])
+    else:
+        XY[:num_good,:num_features] = sampled_zones
+
+    # gather all (run,cycle,zone) requests with a single planned read
+    XY[num_good:,:num_features] = reader.planReads(bad_runs, bad_zone_cycles, bad_zones).execute()
+
+    if num_neighbor_features > 0:
+        runs = np.concatenate((np.repeat(run_for_good_zones, num_good), bad_runs))
+        XY[:,num_features:num_features+num_neighbor_features] = get_neighbor_features(data_dir, runs, index)
 
-    # debug output
+    XY[:,num_features+num_neighbor_features:-1] = new_features
+    XY[:,-1] = Y_list
 
     # cache data for subsequent calls to this function
     return_val = (index, XY)
@@ -303,7 +340,7 @@ def get_learning_data_for_run(data_dir, start_cycle, end_cycle, sample_freq, dec
 def output_feature_importance(rand_forest, data_dir):
     importances = rand_forest.feature_importances_
     indices = np.argsort(importances)[::-1]
-    feature_names = get_feature_names(data_dir)
+    feature_names = get_feature_names(data_dir) + get_neighbor_feature_names()
     for f in range(len(importances)):
         feature_index = indices[f]
         try:
@@ -410,11 +447,10 @@ def train_many_test_many(train_data_paths, test_data_paths, test_data_spec):
                 for i in range(len(test_Y)):
                     print test_Y[i], cv_predict[i]
 
-            if "piston" in test_path:
-                piston_offset = test_path.find("piston") + len("piston")
-                piston_param = int(test_path[piston_offset:piston_offset+3])
-                density_offset = test_path.find("density") + len("density")
-                density_param = float(test_path[density_offset:density_offset+4])
+            catalog = loadCatalog(test_path)
+            if catalog['piston'] is not None:
+                piston_param = catalog['piston']
+                density_param = catalog['density']
 
             print "PERFORMANCE\t%d\t%s\t%d\t%d\t%.2f\t%.15f\t%d\t%d\t%d\t%d" % (test_data_spec, test_path, test_run, piston_param, density_param, RMSE, fp, fn, len(test_Y), round(end-start))
             sys.stdout.flush()